@@ -0,0 +1,125 @@
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from vfb_query_builder.executor import Neo4jRestClient, Neo4jTransientError, \
+    TERM_INFO_METHODS, dict_cursor
+from vfb_query_builder.query_roller import CompiledQueryCache
+from vfb_query_builder.single_flight import AsyncSingleFlight, statement_key
+
+
+class AsyncQueryRunner:
+    """Runs many statements concurrently from asyncio.
+    At most max_in_flight statements are in flight at any time, each on
+    one of a pool of max_in_flight worker threads sharing the client's
+    pooled HTTP connections.  Transient failures are retried up to
+    `retries` times with exponential backoff (backoff * 2**attempt seconds).
+    With coalesce, identical statements in flight at the same time are
+    sent once, sharing the result (or exception).
+
+    The worker threads and the in-flight limit belong to the runner and are
+    shared by all its streams (and coalesced calls outliving them); close()
+    (or leaving `with`/`async with`) shuts the threads down.
+
+    client: A Neo4jRestClient or an endpoint URL to build one for.
+    """
+
+    def __init__(self, client, max_in_flight=8, retries=3, backoff=0.5,
+                 query_library=None, usr='neo4j', pwd='neo4j', coalesce=False):
+        if isinstance(client, str):
+            client = Neo4jRestClient(client, usr=usr, pwd=pwd, pool_size=max_in_flight)
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = CompiledQueryCache(query_library)
+        self.flight = AsyncSingleFlight() if coalesce else None
+        self._pool = None
+        self._semaphores = weakref.WeakKeyDictionary()  # event loop: semaphore
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        return self._pool
+
+    def _semaphore(self, loop):
+        # asyncio primitives are bound to one loop; run() starts a new one per call.
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    def close(self):
+        """Shut down the worker threads, waiting for running commits.
+        The runner may be used again; a new pool is started on demand."""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        # Without blocking the event loop on running commits.
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def _fetch(self, statement):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(loop)
+        attempt = 0
+        while True:
+            # The slot is held per attempt, not during backoff.
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(self._executor(), self.client.commit, [statement])
+                except Neo4jTransientError:
+                    if attempt >= self.retries:
+                        raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def _run_one(self, key, statement):
+        if self.flight is None:
+            results = await self._fetch(statement)
+        else:
+            results = await self.flight.do(statement_key([statement]), self._fetch, statement)
+        return key, dict_cursor(results)
+
+    async def stream(self, statements):
+        """Async generator yielding (key, rows) as each statement completes.
+        statements: dict or iterable of (key, statement) pairs, where statement
+        is a cypher string or (statement, parameters) tuple."""
+        if isinstance(statements, dict):
+            statements = statements.items()
+        tasks = [asyncio.ensure_future(self._run_one(k, s)) for k, s in statements]
+        try:
+            for f in asyncio.as_completed(tasks):
+                yield await f
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def term_info_statements(self, short_forms, term_type, **kwargs):
+        """(short_form, (statement, parameters)) pairs for TermInfo queries.
+        kwargs are passed to the QueryLibrary method."""
+        method = TERM_INFO_METHODS[term_type]
+        return [(sf, self.cache.get(method, [sf], **kwargs)) for sf in short_forms]
+
+    async def term_info(self, short_forms, term_type, **kwargs):
+        """Async generator yielding (short_form, TermInfo result or None) as each completes."""
+        async for sf, rows in self.stream(self.term_info_statements(short_forms, term_type, **kwargs)):
+            yield sf, rows[0] if rows else None
+
+    async def run_all(self, statements):
+        """Run statements, returning a dict of key: rows."""
+        return {k: rows async for k, rows in self.stream(statements)}
+
+    def run(self, statements):
+        """Synchronous wrapper for run_all."""
+        return asyncio.run(self.run_all(statements))
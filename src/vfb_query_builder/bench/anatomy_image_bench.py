@@ -0,0 +1,85 @@
+"""Compare latency of anatomy_channel_image traversal strategies on a
+synthetic deep ontology: a DAG of Classes, each with two parents, of
+increasing depth, with an imaged Individual of every Class.
+Each strategy changes one variable against the default (all paths,
+unbounded): the depth bound alone, the nearest-first traversal alone
+(with its default max_depth), then both.  Latency of the default grows
+with the number of paths; nearest-first, which stops once enough images
+are found, should stay flat.
+Requires a scratch Neo4j 4+ endpoint with APOC: the synthetic nodes are
+labelled BenchOntology and deleted afterwards.
+Run from src: python -m vfb_query_builder.bench.anatomy_image_bench endpoint [usr pwd]"""
+import sys
+import time
+from vfb_query_builder.executor import Neo4jRestClient, chunks
+from vfb_query_builder.query_roller import QueryLibrary, NEAREST_IMAGE_MAX_DEPTH
+
+DEPTHS = (4, 6, 8, 10)
+BRANCHING = 2
+
+
+def ontology(depth, branching=BRANCHING):
+    """(classes, subclass edges) for a DAG in which each class below the
+    root is a SUBCLASSOF its parent and its parent's next sibling."""
+    levels = [['bench_0_0']]
+    edges = []
+    for level in range(1, depth + 1):
+        parents = levels[-1]
+        nodes = ['bench_%d_%d' % (level, i) for i in range(len(parents) * branching)]
+        for i, n in enumerate(nodes):
+            p = i // branching
+            edges.append((n, parents[p]))
+            if len(parents) > 1:
+                edges.append((n, parents[(p + 1) % len(parents)]))
+        levels.append(nodes)
+    return [n for l in levels for n in l], edges
+
+
+def load(client, depth):
+    classes, edges = ontology(depth)
+    client.commit(["CREATE (:Individual:Template:BenchOntology {short_form: 'bench_template'})"
+                   "<-[:depicts]-(:Individual:BenchOntology {short_form: 'bench_template_channel'})"])
+    for c in chunks(classes, 5000):
+        client.commit([("UNWIND $sfs AS sf CREATE (:Class:Anatomy:BenchOntology {short_form: sf, label: sf})",
+                        {'sfs': c})])
+    client.commit(["CREATE INDEX bench_sf IF NOT EXISTS FOR (n:BenchOntology) ON (n.short_form)"])
+    for c in chunks(edges, 5000):
+        client.commit([("UNWIND $edges AS e MATCH (c:BenchOntology {short_form: e[0]}), "
+                        "(p:BenchOntology {short_form: e[1]}) CREATE (c)-[:SUBCLASSOF]->(p)", {'edges': c})])
+    for c in chunks(classes, 5000):
+        client.commit([("UNWIND $sfs AS sf MATCH (c:BenchOntology {short_form: sf}), "
+                        "(tc:BenchOntology {short_form: 'bench_template_channel'})-[:depicts]->(t) "
+                        "CREATE (c)<-[:INSTANCEOF]-(i:Individual:BenchOntology {short_form: 'i_' + sf})"
+                        "<-[:depicts]-(ch:Individual:BenchOntology {short_form: 'ch_' + sf})"
+                        "-[:in_register_with]->(tc)", {'sfs': c})])
+
+
+def clear(client):
+    client.commit(["MATCH (n:BenchOntology) DETACH DELETE n"])
+
+
+def timed(client, statement):
+    start = time.perf_counter()
+    client.commit([statement])
+    return time.perf_counter() - start
+
+
+def main(endpoint, usr='neo4j', pwd='neo4j', depths=DEPTHS, max_depth=4):
+    client = Neo4jRestClient(endpoint, usr=usr, pwd=pwd)
+    strategies = [('all paths', QueryLibrary()),
+                  ('all paths, max_depth=%d' % max_depth, QueryLibrary(image_max_depth=max_depth)),
+                  ('nearest, max_depth=%d (default)' % NEAREST_IMAGE_MAX_DEPTH, QueryLibrary(nearest_images=True)),
+                  ('nearest, max_depth=%d' % max_depth, QueryLibrary(image_max_depth=max_depth, nearest_images=True))]
+    results = {}
+    for depth in depths:
+        clear(client)
+        load(client, depth)
+        for name, ql in strategies:
+            results[(depth, name)] = timed(client, ql.anat_query(['bench_0_0'], parameterise=True))
+            print("depth %d, %s: %.3f s" % (depth, name, results[(depth, name)]))
+    clear(client)
+    return results
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
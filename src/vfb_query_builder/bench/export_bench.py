@@ -0,0 +1,30 @@
+"""Benchmark query export with per-query vs per-process version resolution.
+Run from src: python -m vfb_query_builder.bench.export_bench"""
+import timeit
+from vfb_query_builder import query_roller
+from vfb_query_builder.query_roller import term_info_export, multi_input_export
+
+
+def bench(f, number):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number * 1000
+
+
+def main(number=20):
+    cached = query_roller.get_version_tag
+    results = {}
+    for name, f in [('term_info_export', term_info_export),
+                    ('multi_input_export', multi_input_export)]:
+        # Old behaviour: one git subprocess per generated query.
+        query_roller.get_version_tag = query_roller._git_version_tag
+        try:
+            before = bench(f, number)
+        finally:
+            query_roller.get_version_tag = cached
+        after = bench(f, number)
+        results[name] = (before, after)
+        print("%s: %.2f ms -> %.2f ms per export (%.1fx)" % (name, before, after, before / after))
+    return results
+
+
+if __name__ == '__main__':
+    main()
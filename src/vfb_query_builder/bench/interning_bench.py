@@ -0,0 +1,60 @@
+"""Measure serialised size and memory of 10k synthetic anat_image_query
+rows as plain JSON, normalised (normalise) and interned (intern_rows).
+Run from src: python -m vfb_query_builder.bench.interning_bench [n_rows]"""
+import json
+import sys
+import tracemalloc
+from vfb_query_builder.interning import normalise, expand, intern_rows
+
+
+def entity(sf, types):
+    return {'short_form': sf, 'label': 'label of %s' % sf, 'iri': 'http://virtualflybrain.org/reports/' + sf,
+            'types': types, 'unique_facets': types[:2], 'symbol': ''}
+
+
+def anat_image_rows(n, n_templates=4, n_datasets=20):
+    """Rows shaped like anat_image_query results, plus dataset_license."""
+    rows = []
+    for i in range(n):
+        t = i % n_templates
+        ds = i % n_datasets
+        rows.append({'term': {'core': entity('VFB_%08d' % i, ['Entity', 'Individual', 'Anatomy', 'Neuron']),
+                              'description': [], 'comment': []},
+                     'channel_image': [{'channel': entity('VFBc_%08d' % i, ['Entity', 'Individual']),
+                                        'imaging_technique': entity('FBbi_00000251', ['Entity', 'Class']),
+                                        'image': {'template_channel': entity('VFBc_0001789%d' % t, ['Entity', 'Individual']),
+                                                  'template_anatomy': entity('VFB_0001789%d' % t, ['Entity', 'Individual', 'Template']),
+                                                  'image_folder': 'http://www.virtualflybrain.org/data/VFB/i/%08d/' % i,
+                                                  'index': []}}],
+                     'dataset_license': [{'dataset': {'link': '', 'core': entity('ds_%d' % ds, ['Entity', 'DataSet'])},
+                                          'license': {'icon': 'http://x/cc.png', 'link': 'http://x/cc',
+                                                      'core': entity('VFBlicense_CC_BY_4_0', ['Entity', 'License'])}}]})
+    return rows
+
+
+def measure(build):
+    tracemalloc.start()
+    out = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return out, size
+
+
+def main(n=10000):
+    n = int(n)
+    serialised = json.dumps(anat_image_rows(n)).encode('utf-8')
+    rows, plain_mem = measure(lambda: json.loads(serialised))
+    payload = normalise(rows)
+    normalised = json.dumps(payload).encode('utf-8')
+    assert expand(payload) == rows
+    _, shared_mem = measure(lambda: intern_rows(json.loads(serialised)))
+    results = {'json_bytes': (len(serialised), len(normalised)),
+               'memory_bytes': (plain_mem, shared_mem)}
+    for k, (before, after) in results.items():
+        print("%s: %d -> %d (%.1f%% smaller)" % (k, before, after, 100 * (1 - after / before)))
+    print("%d entities in table" % len(payload['entities']))
+    return results
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,46 @@
+"""Report statement size, and optionally Neo4j planning time, of each
+exported query with default and compact (QueryLibrary(compact=True))
+emission.  Planning time is the time taken to EXPLAIN the statement with
+a forced replan, so needs a Neo4j 4.1+ endpoint.
+Run from src: python -m vfb_query_builder.bench.statement_size_bench [endpoint usr pwd]"""
+import sys
+import time
+from vfb_query_builder.executor import Neo4jRestClient
+from vfb_query_builder.query_roller import QueryLibrary, TERM_INFO_EXPORT_METHODS, MULTI_INPUT_EXPORT_METHODS
+
+
+def statements(ql):
+    return {m: getattr(ql, m)(['$ID'], parameterise=True)
+            for m in TERM_INFO_EXPORT_METHODS + MULTI_INPUT_EXPORT_METHODS}
+
+
+def planning_time(client, statement, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.commit([('CYPHER replan=force EXPLAIN ' + statement[0], statement[1])])
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(endpoint=None, usr='neo4j', pwd='neo4j'):
+    client = Neo4jRestClient(endpoint, usr=usr, pwd=pwd) if endpoint else None
+    default, compact = statements(QueryLibrary()), statements(QueryLibrary(compact=True))
+    totals = [0, 0]
+    results = {}
+    for m in default:
+        before, after = len(default[m][0].encode('utf-8')), len(compact[m][0].encode('utf-8'))
+        totals[0] += before
+        totals[1] += after
+        line = "%s: %d -> %d bytes (%.1f%% smaller)" % (m, before, after, 100 * (1 - after / before))
+        if client:
+            plan = (planning_time(client, default[m]), planning_time(client, compact[m]))
+            line += ", planning %.1f ms -> %.1f ms" % plan
+        results[m] = line
+        print(line)
+    print("total: %d -> %d bytes (%.1f%% smaller)" % (totals[0], totals[1], 100 * (1 - totals[1] / totals[0])))
+    return results
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,37 @@
+"""Compare db hits of chained (default) and CALL { } subquery generation
+for the heaviest TermInfo queries, checking that results are identical.
+Requires a Neo4j 4+ endpoint with a VFB KB loaded.
+Run from src: python -m vfb_query_builder.bench.subquery_bench endpoint [usr pwd]"""
+import json
+import sys
+from vfb_query_builder.executor import Neo4jRestClient
+from vfb_query_builder.profiler import sum_db_hits
+from vfb_query_builder.query_roller import QueryLibrary
+
+CASES = [('class_term_info', 'FBbt_00003748'),  # medulla
+         ('neuron_class_term_info', 'FBbt_00047035'),
+         ('anatomical_ind_term_info', 'VFB_00011179'),
+         ('template_term_info', 'VFB_00017894'),
+         ('dataset_term_info', 'Ito2013')]
+
+
+def profile(client, statement):
+    result = client.commit([('PROFILE ' + statement[0], statement[1])])[0]
+    rows = [json.dumps(dict(zip(result['columns'], d['row'])), sort_keys=True)
+            for d in result['data']]
+    return sum_db_hits(result.get('profile', {})), sorted(rows)
+
+
+def main(endpoint, usr='neo4j', pwd='neo4j', cases=CASES):
+    client = Neo4jRestClient(endpoint, usr=usr, pwd=pwd)
+    chained, subqueries = QueryLibrary(), QueryLibrary(subqueries=True)
+    for method, sf in cases:
+        before, r1 = profile(client, getattr(chained, method)([sf], parameterise=True))
+        after, r2 = profile(client, getattr(subqueries, method)([sf], parameterise=True))
+        print("%s %s: %d -> %d db hits (%.1fx), results %s"
+              % (method, sf, before, after, before / max(after, 1),
+                 'identical' if r1 == r2 else 'DIFFER'))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
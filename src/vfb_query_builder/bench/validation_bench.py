@@ -0,0 +1,64 @@
+"""Benchmark generated validators against jsonschema on large synthetic instances.
+Run from src: python -m vfb_query_builder.bench.validation_bench"""
+import os
+import timeit
+from vfb_query_builder import schema_test_suite, fast_validator
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'json_schema')
+
+
+def min_node(sf, types=('Entity',)):
+    return {'short_form': sf, 'iri': 'http://virtualflybrain.org/reports/' + sf,
+            'label': 'label of ' + sf, 'types': list(types), 'unique_facets': list(types), 'symbol': ''}
+
+
+def channel_image(i):
+    return {'channel': min_node('VFBc_%08d' % i, ('Individual', 'Channel')),
+            'imaging_technique': min_node('FBbi_00000251', ('Class',)),
+            'image': {'template_channel': min_node('VFBc_00017894'),
+                      'template_anatomy': min_node('VFB_00017894', ('Individual', 'Template')),
+                      'image_folder': 'http://www.virtualflybrain.org/data/VFB/i/%08d/' % i,
+                      'image_nrrd': '', 'image_thumbnail': '', 'image_swc': '',
+                      'image_obj': '', 'image_wlz': '', 'index': []}}
+
+
+def term_info(n):
+    """Class TermInfo with n anatomy_channel_image entries."""
+    return {'term': {'core': min_node('FBbt_00005106', ('Class', 'Anatomy', 'Neuron')),
+                     'description': ['neuron'], 'comment': []},
+            'parents': [min_node('FBbt_%08d' % i, ('Class',)) for i in range(5)],
+            'anatomy_channel_image': [{'anatomy': min_node('VFB_%08d' % i, ('Individual',)),
+                                       'channel_image': channel_image(i)} for i in range(n)],
+            'query': 'Get JSON for Class', 'version': 'abc1234'}
+
+
+def anat_image_rows(n):
+    """n rows of anat_image_query results."""
+    return [{'term': {'core': min_node('VFB_%08d' % i, ('Individual',))},
+             'channel_image': [channel_image(i)],
+             'parents': [min_node('FBbt_00005106', ('Class',))],
+             'query': 'Get JSON for anat_image query', 'version': 'abc1234'} for i in range(n)]
+
+
+def bench(f, number=5):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number * 1000
+
+
+def main(sizes=(10, 100, 1000)):
+    base_uri = 'file://' + os.path.abspath(SCHEMA_DIR) + '/'
+    for schema, make in [('vfb_termInfo.json', lambda n: [term_info(n)]),
+                         ('vfb_query.json', anat_image_rows)]:
+        path = os.path.join(SCHEMA_DIR, schema)
+        jv = schema_test_suite.get_validator(path, base_uri=base_uri)
+        fv = fast_validator.get_validator(path, base_uri=base_uri)
+        for n in sizes:
+            instances = make(n)
+            assert all(jv.is_valid(i) and fv.is_valid(i) for i in instances)
+            before = bench(lambda: [jv.is_valid(i) for i in instances])
+            after = bench(lambda: [fv.is_valid(i) for i in instances])
+            print("%s, n=%d: jsonschema %.2f ms, generated %.3f ms (%.0fx)"
+                  % (schema, n, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Parallel validation of bulk JSONL dumps (one result per line).
+The dump is split into byte ranges, aligned to lines, which are
+validated by a pool of worker processes, each holding one generated
+validator.  Errors are merged into a histogram of counts per schema path.
+
+Usage: python -m vfb_query_builder.bulk_validate schema_file dump.jsonl [--processes N]
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from dataclasses import asdict
+from multiprocessing import Pool
+from vfb_query_builder.fast_validator import get_validator
+from vfb_query_builder.schema_test_suite import collect_errors
+
+_validator = None
+
+
+def _init_worker(schema_file, base_uri):
+    global _validator
+    _validator = get_validator(schema_file, base_uri=base_uri)
+
+
+def byte_ranges(path, chunk_size):
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def _iter_lines(path, start, end):
+    """(offset, line) for lines starting within [start, end)."""
+    with open(path, 'rb') as f:
+        if start:
+            # Skip to the first line starting at or after start.
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            yield offset, line
+
+
+def _validate_range(args):
+    path, start, end, max_samples, max_errors = args
+    total = failed = 0
+    histogram = Counter()
+    samples = []
+    for offset, line in _iter_lines(path, start, end):
+        if not line.strip():
+            continue
+        total += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            failed += 1
+            histogram['<invalid JSON>'] += 1
+            continue
+        if _validator.is_valid(row):
+            continue
+        failed += 1
+        records, _ = collect_errors(_validator, row, max_errors=max_errors)
+        for r in records:
+            histogram[r.schema_path] += r.count
+            if len(samples) < max_samples:
+                samples.append(dict(asdict(r), offset=offset))
+    return total, failed, histogram, samples
+
+
+def bulk_validate(schema_file, dump_file, processes=None, chunk_size=8 << 20,
+                  base_uri='', max_samples=10, max_errors=100):
+    """Validate every line of a JSONL dump against schema_file using a process pool.
+    Returns a report dict: total, failed, errors (schema path: count, most common first),
+    samples (up to max_samples example errors).
+    max_errors: maximum distinct errors recorded per row."""
+    ranges = [(dump_file, s, e, max_samples, max_errors) for s, e in byte_ranges(dump_file, chunk_size)]
+    total = failed = 0
+    histogram = Counter()
+    samples = []
+    with Pool(processes, initializer=_init_worker, initargs=(schema_file, base_uri)) as pool:
+        for t, f, h, s in pool.imap_unordered(_validate_range, ranges):
+            total += t
+            failed += f
+            histogram.update(h)
+            samples.extend(s[:max_samples - len(samples)])
+    return {'total': total,
+            'passed': total - failed,
+            'failed': failed,
+            'errors': dict(histogram.most_common()),
+            'samples': samples}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('schema_file')
+    parser.add_argument('dump_file')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk_mb', type=int, default=8)
+    parser.add_argument('--max_samples', type=int, default=10)
+    args = parser.parse_args(argv)
+    report = bulk_validate(args.schema_file, args.dump_file, processes=args.processes,
+                           chunk_size=args.chunk_mb << 20, max_samples=args.max_samples)
+    print(json.dumps(report, indent=2))
+    return 0 if not report['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
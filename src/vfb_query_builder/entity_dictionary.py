@@ -0,0 +1,116 @@
+"""Client-side dictionary of small entity sets (Sites, Licenses, Templates,
+imaging techniques) that are repeated across many results.
+Queries generated with QueryLibrary(entity_refs=True) return these as
+{'_ref': [kind, short_form]}; EntityDictionary.hydrate replaces each
+reference with the full map the default queries would have returned."""
+import copy
+import threading
+import time
+from vfb_query_builder.executor import dict_cursor
+from vfb_query_builder.query_roller import ENTITY_MAPS, ENTITY_REF_KEY
+
+# kind -> MATCH binding n to every entity of that kind.
+ENTITY_MATCHES = {'site': "MATCH (n:Site)",
+                  'license': "MATCH (n:License)",
+                  'template': "MATCH (n:Template)",
+                  'technique': "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBbi_'"}
+
+# What the default queries return for a null (OPTIONAL MATCH) entity.
+NULL_MIN_NODE = {'short_form': None, 'label': '', 'iri': None, 'types': None,
+                 'unique_facets': [], 'symbol': ''}
+NULL_ENTITIES = {'site': NULL_MIN_NODE,
+                 'license': {'icon': '', 'link': '', 'core': NULL_MIN_NODE},
+                 'template': NULL_MIN_NODE,
+                 'technique': NULL_MIN_NODE}
+
+
+def entity_query(kinds=None):
+    """One query returning (kind, short_form, entity) for every entity of kinds."""
+    return ' UNION ALL '.join("%s RETURN '%s' AS kind, n.short_form AS short_form, %s AS entity"
+                              % (ENTITY_MATCHES[k], k, ENTITY_MAPS[k]('n'))
+                              for k in (kinds or sorted(ENTITY_MATCHES)))
+
+
+def missing_entity_query(kind):
+    """Query for entities of kind by short_form ($short_forms), whatever their labels."""
+    return ("MATCH (n) WHERE n.short_form IN $short_forms "
+            "RETURN '%s' AS kind, n.short_form AS short_form, %s AS entity" % (kind, ENTITY_MAPS[kind]('n')))
+
+
+class EntityDictionary:
+    """Dictionary of kind: {short_form: entity}, loaded with a single query
+    and reloaded when older than refresh_interval seconds.
+    References to entities not in the dictionary (e.g. added since the
+    last load) are fetched by short_form; references that still cannot be
+    resolved raise KeyError."""
+
+    def __init__(self, client, refresh_interval=3600, clock=time.time):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.entities = {}
+        self.loaded = None
+        self._lock = threading.Lock()
+
+    def _add(self, rows):
+        for r in rows:
+            self.entities.setdefault(r['kind'], {})[r['short_form']] = r['entity']
+
+    def load(self):
+        rows = dict_cursor(self.client.commit([entity_query()]))
+        with self._lock:
+            self.entities = {}
+            self._add(rows)
+            self.loaded = self.clock()
+
+    def _stale(self):
+        return self.loaded is None or (self.refresh_interval is not None and
+                                       self.clock() - self.loaded > self.refresh_interval)
+
+    def _refs(self, result, refs):
+        if isinstance(result, dict):
+            if ENTITY_REF_KEY in result:
+                refs.add(tuple(result[ENTITY_REF_KEY]))
+            else:
+                for v in result.values():
+                    self._refs(v, refs)
+        elif isinstance(result, list):
+            for v in result:
+                self._refs(v, refs)
+        return refs
+
+    def _fetch_missing(self, refs):
+        missing = {}
+        for kind, sf in refs:
+            if sf is not None and sf not in self.entities.get(kind, {}):
+                missing.setdefault(kind, []).append(sf)
+        for kind, short_forms in sorted(missing.items()):
+            rows = dict_cursor(self.client.commit([(missing_entity_query(kind),
+                                                    {'short_forms': sorted(short_forms)})]))
+            with self._lock:
+                self._add(rows)
+
+    def lookup(self, kind, short_form):
+        if short_form is None:
+            return copy.deepcopy(NULL_ENTITIES[kind])
+        try:
+            return copy.deepcopy(self.entities[kind][short_form])
+        except KeyError:
+            raise KeyError('Unknown %s: %s' % (kind, short_form))
+
+    def _replace(self, result):
+        if isinstance(result, dict):
+            if ENTITY_REF_KEY in result:
+                return self.lookup(*result[ENTITY_REF_KEY])
+            return {k: self._replace(v) for k, v in result.items()}
+        if isinstance(result, list):
+            return [self._replace(v) for v in result]
+        return result
+
+    def hydrate(self, result):
+        """Copy of result (e.g. a TermInfo row or list of rows) with each
+        entity reference replaced by the entity."""
+        if self._stale():
+            self.load()
+        self._fetch_missing(self._refs(result, set()))
+        return self._replace(result)
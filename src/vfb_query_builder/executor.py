@@ -0,0 +1,240 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from vfb_query_builder.query_roller import CompiledQueryCache, SHORT_FORMS_PARAM, CURSOR_PARAM
+
+# TermInfo type -> QueryLibrary method
+TERM_INFO_METHODS = {'Class': 'class_term_info',
+                     'Individual': 'anatomical_ind_term_info',
+                     'DataSet': 'dataset_term_info',
+                     'Template': 'template_term_info',
+                     'pub': 'pub_term_info',
+                     'License': 'license_term_info'}
+
+# Results query method -> function returning the input short_form a row was matched by
+RESULTS_ROW_KEYS = {'anat_query': lambda row: row['term']['core']['short_form'],
+                    'anat_image_query': lambda row: row['term']['core']['short_form'],
+                    'anat_2_ep_query': lambda row: row['anatomy']['short_form']}
+
+
+class Neo4jQueryError(Exception):
+    pass
+
+
+class Neo4jTransientError(Neo4jQueryError):
+    """Failures worth retrying: connection errors, 429/5xx responses
+    and Neo4j TransientErrors."""
+    pass
+
+
+def dict_cursor(results):
+    """Takes JSON results from a neo4J query and turns them into a list of dicts."""
+    dc = []
+    for n in results:
+        if n['columns'] and n['data']:
+            for d in n['data']:
+                dc.append(dict(zip(n['columns'], d['row'])))
+    return dc
+
+
+def chunks(l, size):
+    return [l[i:i + size] for i in range(0, len(l), size)]
+
+
+class Neo4jRestClient:
+    """Minimal client for the Neo4j HTTP transactional endpoint
+    supporting parameterised statements.  HTTP connections are pooled
+    (pool_size) and may be shared between threads."""
+
+    def __init__(self, endpoint, usr='neo4j', pwd='neo4j',
+                 path='/db/neo4j/tx/commit', pool_size=10, timeout=300):
+        self.url = endpoint.rstrip('/') + path
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (usr, pwd)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def commit(self, statements):
+        """Commit a list of statements in a single request.
+        statements: list of cypher strings or (statement, parameters) tuples.
+        Returns the list of results, one per statement.
+        Raises Neo4jQueryError on HTTP or Cypher errors."""
+        payload = {'statements': []}
+        for s in statements:
+            if isinstance(s, str):
+                payload['statements'].append({'statement': s})
+            else:
+                payload['statements'].append({'statement': s[0], 'parameters': s[1]})
+        try:
+            response = self.session.post(self.url, data=json.dumps(payload),
+                                         headers={'Content-Type': 'application/json'},
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            raise Neo4jTransientError(str(e)) from e
+        if response.status_code != 200:
+            error = Neo4jTransientError if response.status_code == 429 or response.status_code >= 500 \
+                else Neo4jQueryError
+            raise error("Connection to %s failed with status %s: %s"
+                        % (self.url, response.status_code, response.reason))
+        r = response.json()
+        if r.get('errors'):
+            error = Neo4jTransientError if all('TransientError' in e.get('code', '') for e in r['errors']) \
+                else Neo4jQueryError
+            raise error('; '.join(e.get('message', '') for e in r['errors']))
+        return r['results']
+
+
+class TermInfoBatchExecutor:
+    """Runs TermInfo queries for many short_forms of one type,
+    using a single parameterised statement per chunk of short_forms.
+    Chunks are sent chunks_per_request at a time, with up to
+    max_workers requests in flight.
+    result_cache: optional TermInfoResultCache. Cached results are
+    returned without querying; new results are added to it."""
+
+    def __init__(self, client, query_library=None, chunk_size=100,
+                 chunks_per_request=1, max_workers=1, result_cache=None):
+        self.client = client
+        self.cache = CompiledQueryCache(query_library)
+        self.result_cache = result_cache
+        self.chunk_size = chunk_size
+        self.chunks_per_request = chunks_per_request
+        self.max_workers = max_workers
+
+    @staticmethod
+    def key(row):
+        return row['term']['core']['short_form']
+
+    def _commit(self, statements):
+        return dict_cursor(self.client.commit(statements))
+
+    def run(self, short_forms, term_type, **kwargs):
+        """Return a dict of TermInfo results keyed by short_form.
+        term_type: One of TERM_INFO_METHODS.
+        kwargs are passed to the QueryLibrary method (e.g. q_name).
+        short_forms with no result map to None."""
+        if term_type not in TERM_INFO_METHODS:
+            raise ValueError('Unknown TermInfo type: %s should be one of %s'
+                             % (term_type, ', '.join(TERM_INFO_METHODS)))
+        method = TERM_INFO_METHODS[term_type]
+        short_forms = list(dict.fromkeys(short_forms))
+        out = dict.fromkeys(short_forms)
+        if self.result_cache is not None:
+            query = repr(self.cache.key(method, kwargs))
+            for sf in short_forms:
+                out[sf] = self.result_cache.get(query, sf)
+            short_forms = [sf for sf in short_forms if out[sf] is None]
+        statements = [self.cache.get(method, c, **kwargs)
+                      for c in chunks(short_forms, self.chunk_size)]
+        batches = chunks(statements, self.chunks_per_request)
+        if self.max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(self._commit, batches))
+        else:
+            results = [self._commit(r) for r in batches]
+        for rows in results:
+            for row in rows:
+                out[self.key(row)] = row
+                if self.result_cache is not None:
+                    self.result_cache.put(query, self.key(row), row)
+        return out
+
+
+class ChunkedQueryExecutor:
+    """Runs results queries (RESULTS_ROW_KEYS) for long lists of short_forms,
+    split into chunks run concurrently (up to max_workers at a time).
+    Rows are merged in input order and duplicates dropped.
+    The chunk size is adapted after each round of chunks, scaling it
+    towards the size expected to take target_latency seconds per request
+    (by at most a factor of 2 per round, within min/max_chunk_size)."""
+
+    def __init__(self, client, query_library=None, chunk_size=100, min_chunk_size=10,
+                 max_chunk_size=2000, target_latency=2.0, max_workers=4):
+        self.client = client
+        self.cache = CompiledQueryCache(query_library)
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_latency = target_latency
+        self.max_workers = max_workers
+
+    def _commit(self, statement):
+        start = time.perf_counter()
+        rows = dict_cursor(self.client.commit([statement]))
+        return rows, time.perf_counter() - start
+
+    def adapt(self, size, latency):
+        """Update chunk_size given the latency (seconds) of a chunk of size short_forms."""
+        scale = self.target_latency / max(latency, 1e-6)
+        target = size * min(max(scale, 0.5), 2.0)
+        self.chunk_size = int(min(max(target, self.min_chunk_size), self.max_chunk_size))
+        return self.chunk_size
+
+    def run(self, method, short_forms, **kwargs):
+        """Return the rows of a results query for short_forms, ordered by
+        the position of the short_form each row was matched by.
+        kwargs are passed to the QueryLibrary method (e.g. q_name)."""
+        if method not in RESULTS_ROW_KEYS:
+            raise ValueError('Unsupported query: %s should be one of %s'
+                             % (method, ', '.join(RESULTS_ROW_KEYS)))
+        key = RESULTS_ROW_KEYS[method]
+        short_forms = list(dict.fromkeys(short_forms))
+        order = {sf: i for i, sf in enumerate(short_forms)}
+        rows = []
+        i = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while i < len(short_forms):
+                batch = []
+                for _ in range(self.max_workers):
+                    if i >= len(short_forms):
+                        break
+                    batch.append(short_forms[i:i + self.chunk_size])
+                    i += len(batch[-1])
+                results = list(pool.map(self._commit,
+                                        [self.cache.get(method, c, **kwargs) for c in batch]))
+                for r, _ in results:
+                    rows.extend(r)
+                size = sum(len(c) for c in batch) / len(batch)
+                self.adapt(size, sum(t for _, t in results) / len(results))
+        seen = set()
+        out = []
+        for row in sorted(rows, key=lambda r: order.get(key(r), len(order))):
+            k = json.dumps(row, sort_keys=True)
+            if k not in seen:
+                seen.add(k)
+                out.append(row)
+        return out
+
+
+def iter_pages(client, method, short_forms=None, page_size=1000, cache=None, **kwargs):
+    """Lazily run a paged results query (a QueryLibrary method supporting
+    page_size), yielding one list of rows per page.  Each page is fetched
+    with the cursor of the last row of the previous page, so only one page
+    is held in memory at a time.  Rows are returned without the cursor column.
+    cache: a CompiledQueryCache, to share rendered statements between calls."""
+    if cache is None:
+        cache = CompiledQueryCache()
+    statement = cache.statement(method, page_size=page_size, **kwargs)
+    parameters = {CURSOR_PARAM: ''}
+    if short_forms is not None:
+        parameters[SHORT_FORMS_PARAM] = list(short_forms)
+    while True:
+        rows = dict_cursor(client.commit([(statement, dict(parameters))]))
+        if not rows:
+            return
+        parameters[CURSOR_PARAM] = rows[-1][CURSOR_PARAM]
+        for r in rows:
+            del r[CURSOR_PARAM]
+        yield rows
+        if len(rows) < page_size:
+            return
+
+
+def iter_rows(client, method, short_forms=None, page_size=1000, cache=None, **kwargs):
+    """As iter_pages, yielding rows one at a time."""
+    for page in iter_pages(client, method, short_forms, page_size=page_size, cache=cache, **kwargs):
+        yield from page
@@ -0,0 +1,194 @@
+"""Incremental, content-addressed query export.
+ExportCache keys each exported query by a digest of its composition: the
+clauses passed to query_builder (Clause.key()), the builder arguments, any
+text a library method adds around the built statement, and the export
+format, and a fingerprint of the code rendering statements (RENDERERS).
+Rendered statements are stored in cache_dir by digest, so re-exporting
+only builds and renders queries whose composition changed.  Statements
+are cached with a placeholder for the version tag, which is substituted
+on the way out; a new version tag alone re-renders nothing.
+
+write_resources writes VFB_connect's resource files and a manifest of
+query digests, listing the queries added, changed and removed since the
+previous export.  As every statement returns the version tag, all
+queries are listed as changed when it changes.  The cache directory may
+be deleted at any time.
+
+Usage: python -m vfb_query_builder.export_cache out_dir [--cache_dir DIR] [--compact]
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+from vfb_query_builder import query_roller
+from vfb_query_builder.query_roller import _export_forms, TERM_INFO_EXPORT_METHODS, MULTI_INPUT_EXPORT_METHODS
+
+# Bump when the format of cached statements changes.
+CACHE_VERSION = 1
+# Code turning clauses into rendered statements.  Its source (with the
+# patterns it uses) is part of every digest, so changes invalidate the cache.
+RENDERERS = [query_roller.Clause, query_roller.select_clauses, query_roller.page_clause,
+             query_roller.query_builder, query_roller.QueryLibraryCore.query_builder,
+             query_roller._collapse, query_roller.minify, query_roller.compact_whitespace,
+             query_roller._json_escape, query_roller.render_statement, query_roller._statement_forms]
+RENDER_PATTERNS = [query_roller._LITERAL, query_roller._PUNCTUATION_SPACE, query_roller._CONTROL]
+VERSION_PLACEHOLDER = '__vfb_query_version__'
+# Stands in for the built statement while recording a library method's composition.
+_STATEMENT = '\0statement\0'
+
+# VFB_connect resource file: QueryLibrary methods exported to it.
+RESOURCE_FILES = {'VFB_TermInfo_queries.json': TERM_INFO_EXPORT_METHODS,
+                  'VFB_results_multi_input.json': MULTI_INPUT_EXPORT_METHODS}
+MANIFEST = 'export_manifest.json'
+
+
+def renderer_fingerprint():
+    """Digest of the source of RENDERERS and RENDER_PATTERNS.  Without
+    source (e.g. in a bytecode-only install), the version tag stands in."""
+    h = hashlib.sha1()
+    for r in RENDERERS:
+        try:
+            source = inspect.getsource(r)
+        except (OSError, TypeError):
+            source = query_roller.get_version_tag()
+        h.update(source.encode('utf-8'))
+    for p in RENDER_PATTERNS:
+        h.update(p.pattern.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ExportCache:
+    """Rendered statements, stored in cache_dir by composition digest.
+    version: tag substituted into statements (default: get_version_tag()).
+    hits/misses count statements reused and rendered."""
+
+    def __init__(self, cache_dir, version=None):
+        self.cache_dir = cache_dir
+        self.version = version or query_roller.get_version_tag()
+        self.fingerprint = renderer_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self._forms = {}  # digest: forms read or rendered in this process
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _record(self, ql, method, args, kwargs):
+        """(clauses, builder kwargs, method output) for a call of a library
+        method, with query_builder replaced by a recorder.  The output has
+        _STATEMENT in place of the built statement."""
+        calls = []
+
+        def record(clauses, **kw):
+            calls.append((clauses, kw))
+            return (_STATEMENT, {}) if kw.get('parameterise') else _STATEMENT
+
+        override = vars(ql).get('query_builder')
+        ql.query_builder = record
+        try:
+            out = getattr(ql, method)(*args, **kwargs)
+        finally:
+            if override is None:
+                del ql.query_builder
+            else:
+                ql.query_builder = override
+        if isinstance(out, tuple):
+            out = out[0]
+        if len(calls) != 1 or out.count(_STATEMENT) != 1:
+            raise ValueError('%s does not build a single statement' % method)
+        return calls[0][0], calls[0][1], out
+
+    def digest(self, ql, clauses, kw, out, variant):
+        return hashlib.sha1(json.dumps([CACHE_VERSION, self.fingerprint, variant, ql.subqueries, ql.compact,
+                                        [c.key() for c in clauses], kw, out],
+                                       sort_keys=True, default=sorted).encode('utf-8')).hexdigest()
+
+    def forms(self, ql, method, args, kwargs, variant, render):
+        """(digest, forms) for method of QueryLibrary ql called with args
+        and kwargs.  render maps a statement to its forms (a tuple of
+        strings); variant identifies render in the digest."""
+        clauses, kw, out = self._record(ql, method, args, kwargs)
+        digest = self.digest(ql, clauses, kw, out, variant)
+        path = os.path.join(self.cache_dir, digest + '.json')
+        try:
+            forms = self._forms.get(digest)
+            if forms is None:
+                with open(path, 'r') as f:
+                    forms = json.load(f)
+            self.hits += 1
+        except (OSError, ValueError):
+            q = ql.query_builder(clauses, version=VERSION_PLACEHOLDER, **kw)
+            if isinstance(q, tuple):
+                q = q[0]
+            forms = render(out.replace(_STATEMENT, q))
+            _write_atomic(path, json.dumps(forms).encode('utf-8'))
+            self.misses += 1
+        self._forms[digest] = forms
+        tags = render(self.version)
+        return digest, tuple(f.replace(VERSION_PLACEHOLDER, t) for f, t in zip(forms, tags))
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def write_resources(out_dir, cache_dir=None, compact=False, version=None):
+    """Write RESOURCE_FILES (q_name: statement, with $ID for the short_form)
+    to out_dir, reusing statements from cache_dir (default:
+    out_dir/.export_cache).  Files whose content is unchanged are not
+    rewritten.  Returns the manifest, also written to out_dir/MANIFEST:
+    version and previous_version; digests, q_name: digest per file; diff,
+    the q_names added, changed (all of them, if the version changed) and
+    removed per file; and the files written."""
+    cache = ExportCache(cache_dir or os.path.join(out_dir, '.export_cache'), version=version)
+    path = os.path.join(out_dir, MANIFEST)
+    previous = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            previous = json.load(f)
+    manifest = {'version': cache.version, 'previous_version': previous.get('version'),
+                'digests': {}, 'diff': {}, 'written': []}
+    new_version = manifest['version'] != manifest['previous_version']
+    for name, methods in RESOURCE_FILES.items():
+        statements, digests = {}, {}
+        for key, digest, forms in _export_forms(methods, 'json', compact=compact, cache=cache):
+            statements[key] = forms[0]
+            digests[key] = digest
+        old = previous.get('digests', {}).get(name, {})
+        manifest['digests'][name] = digests
+        manifest['diff'][name] = {'added': sorted(set(digests) - set(old)),
+                                  'changed': sorted(k for k in digests
+                                                    if k in old and (new_version or old[k] != digests[k])),
+                                  'removed': sorted(set(old) - set(digests))}
+        data = json.dumps(statements, indent=2).encode('utf-8')
+        resource = os.path.join(out_dir, name)
+        if os.path.exists(resource):
+            with open(resource, 'rb') as f:
+                if f.read() == data:
+                    continue
+        _write_atomic(resource, data)
+        manifest['written'].append(name)
+    _write_atomic(path, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('out_dir')
+    parser.add_argument('--cache_dir', default=None)
+    parser.add_argument('--compact', action='store_true')
+    args = parser.parse_args(argv)
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest = write_resources(args.out_dir, cache_dir=args.cache_dir, compact=args.compact)
+    print(json.dumps({k: manifest[k] for k in ('version', 'previous_version', 'diff', 'written')}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
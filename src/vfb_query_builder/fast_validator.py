@@ -0,0 +1,230 @@
+"""Compiles VFB JSON schemas into specialised Python validation functions.
+Only the draft-04 keywords used in the VFB schemas are supported
+(type, required, properties, additionalProperties, items, minItems,
+maxItems, $ref).  $ref siblings are ignored, as in draft-04.
+Validation failures are reported using jsonschema, so validate()
+below is a drop-in for schema_test_suite.validate.
+
+Usage: python -m vfb_query_builder.fast_validator path/to/json_schema [out.py]
+writes the generated module source.
+"""
+import glob
+import os
+import sys
+from urllib.parse import urljoin, urldefrag
+from vfb_query_builder.schema_test_suite import get_json_from_file, _ref_files, \
+    get_validator as get_jsonschema_validator, validate as jsonschema_validate
+
+UNSUPPORTED = {'enum', 'pattern', 'minimum', 'maximum', 'exclusiveMinimum', 'exclusiveMaximum',
+               'multipleOf', 'minLength', 'maxLength', 'anyOf', 'allOf', 'oneOf', 'not',
+               'patternProperties', 'dependencies', 'uniqueItems', 'minProperties',
+               'maxProperties', 'additionalItems'}
+
+TYPE_CHECKS = {'object': 'isinstance(%s, dict)',
+               'array': 'isinstance(%s, list)',
+               'string': 'isinstance(%s, str)',
+               'integer': '(isinstance(%s, int) and not isinstance(%s, bool))',
+               'number': '(isinstance(%s, (int, float)) and not isinstance(%s, bool))',
+               'boolean': 'isinstance(%s, bool)',
+               'null': '%s is None'}
+
+
+def _type_check(t, var):
+    tc = TYPE_CHECKS[t]
+    return tc % ((var,) * tc.count('%s'))
+
+
+class SchemaCompiler:
+    """Generates Python source for validating instances of a set of schemas.
+    store: dict of schema URL: schema document."""
+
+    def __init__(self, store):
+        self.store = store
+        self.functions = {}  # resolved URL -> function name
+        self.constants = []
+        self.blocks = []
+        self._n = 0
+
+    def _name(self, prefix):
+        self._n += 1
+        return '%s_%d' % (prefix, self._n)
+
+    def resolve(self, url):
+        doc_url, fragment = urldefrag(url)
+        node = self.store[doc_url]
+        for part in [p for p in fragment.lstrip('/').split('/') if p]:
+            node = node[part.replace('~1', '/').replace('~0', '~')]
+        return doc_url, node
+
+    def function(self, url):
+        """Name of the generated function validating the schema at url."""
+        doc_url, fragment = urldefrag(url)
+        url = doc_url + '#/' + fragment.lstrip('/')
+        if url not in self.functions:
+            stem = os.path.splitext(os.path.basename(doc_url))[0]
+            label = fragment.strip('/').split('/')[-1] if fragment.strip('/') else stem
+            name = self._name('v_' + ''.join(c if c.isalnum() else '_' for c in label))
+            self.functions[url] = name
+            base, node = self.resolve(url)
+            lines = ['def %s(d):' % name]
+            self._node(node, 'd', base, lines, 1)
+            lines.append('    return True')
+            self.blocks.append('\n'.join(lines))
+        return self.functions[url]
+
+    def _node(self, node, var, base, out, indent):
+        pad = '    ' * indent
+        if '$ref' in node:
+            out.append('%sif not %s(%s):' % (pad, self.function(urljoin(base, node['$ref'])), var))
+            out.append('%s    return False' % pad)
+            return
+        unsupported = UNSUPPORTED.intersection(node)
+        if unsupported:
+            raise NotImplementedError('Unsupported schema keywords: %s' % ', '.join(sorted(unsupported)))
+        if 'type' in node:
+            types = node['type'] if isinstance(node['type'], list) else [node['type']]
+            out.append('%sif not (%s):' % (pad, ' or '.join(_type_check(t, var) for t in types)))
+            out.append('%s    return False' % pad)
+        self._object(node, var, base, out, indent)
+        self._array(node, var, base, out, indent)
+
+    def _object(self, node, var, base, out, indent):
+        properties = node.get('properties', {})
+        additional = node.get('additionalProperties', True)
+        if not (properties or node.get('required') or additional is not True):
+            return
+        pad = '    ' * indent
+        body = []
+        if node.get('required'):
+            body.append('%s    if not (%s):' % (pad, ' and '.join('%r in %s' % (k, var) for k in node['required'])))
+            body.append('%s        return False' % pad)
+        if additional is False:
+            allowed = self._name('_allowed')
+            self.constants.append('%s = frozenset(%r)' % (allowed, sorted(properties)))
+            body.append('%s    if not %s.issuperset(%s):' % (pad, allowed, var))
+            body.append('%s        return False' % pad)
+        elif isinstance(additional, dict):
+            k, v = self._name('k'), self._name('v')
+            sub = []
+            self._node(additional, v, base, sub, indent + 3)
+            if sub:
+                allowed = self._name('_allowed')
+                self.constants.append('%s = frozenset(%r)' % (allowed, sorted(properties)))
+                body.append('%s    for %s, %s in %s.items():' % (pad, k, v, var))
+                body.append('%s        if %s not in %s:' % (pad, k, allowed))
+                body.extend(sub)
+        for prop, schema in properties.items():
+            v = self._name('v')
+            sub = []
+            self._node(schema, v, base, sub, indent + 2)
+            if sub:
+                body.append('%s    %s = %s.get(%r, _MISSING)' % (pad, v, var, prop))
+                body.append('%s    if %s is not _MISSING:' % (pad, v))
+                body.extend(sub)
+        if body:
+            out.append('%sif isinstance(%s, dict):' % (pad, var))
+            out.extend(body)
+
+    def _array(self, node, var, base, out, indent):
+        pad = '    ' * indent
+        body = []
+        if 'minItems' in node:
+            body.append('%s    if len(%s) < %d:' % (pad, var, node['minItems']))
+            body.append('%s        return False' % pad)
+        if 'maxItems' in node:
+            body.append('%s    if len(%s) > %d:' % (pad, var, node['maxItems']))
+            body.append('%s        return False' % pad)
+        items = node.get('items')
+        if isinstance(items, dict):
+            x = self._name('x')
+            sub = []
+            self._node(items, x, base, sub, indent + 2)
+            if sub:
+                body.append('%s    for %s in %s:' % (pad, x, var))
+                body.extend(sub)
+        elif isinstance(items, list):
+            for i, schema in enumerate(items):
+                x = self._name('x')
+                sub = []
+                self._node(schema, x, base, sub, indent + 2)
+                if sub:
+                    body.append('%s    if len(%s) > %d:' % (pad, var, i))
+                    body.append('%s        %s = %s[%d]' % (pad, x, var, i))
+                    body.extend(sub)
+        if body:
+            out.append('%sif isinstance(%s, list):' % (pad, var))
+            out.extend(body)
+
+    def source(self, entry_points):
+        """entry_points: dict of public function name: schema URL"""
+        aliases = ['%s = %s' % (name, self.function(url)) for name, url in entry_points.items()]
+        return '\n\n'.join(['# Generated by vfb_query_builder.fast_validator.  Do not edit.',
+                            '_MISSING = object()',
+                            '\n'.join(self.constants)] + self.blocks + ['\n'.join(aliases)]) + '\n'
+
+
+def _schema_store(filename, base_uri=''):
+    if not base_uri:
+        base_uri = 'file://' + os.path.dirname(os.path.abspath(filename)) + '/'
+    store = {urljoin(base_uri, os.path.basename(f)): get_json_from_file(f)
+             for f in _ref_files(filename)}
+    return base_uri, store
+
+
+def generate_source(schema_dir, base_uri=''):
+    """Generate a Python module with an is_valid_<schema> function
+    for each schema file in schema_dir."""
+    files = sorted(glob.glob(os.path.join(schema_dir, '*.json')))
+    base_uri, store = _schema_store(files[0], base_uri)
+    compiler = SchemaCompiler(store)
+    entry_points = {'is_valid_' + os.path.splitext(os.path.basename(f))[0]:
+                    urljoin(base_uri, os.path.basename(f)) for f in files}
+    return compiler.source(entry_points)
+
+
+class FastValidator:
+    """Validator with a generated is_valid function.
+    iter_errors (used for reporting failures) is delegated to jsonschema."""
+
+    def __init__(self, filename, base_uri=''):
+        self.filename = filename
+        self.base_uri, store = _schema_store(filename, base_uri)
+        compiler = SchemaCompiler(store)
+        self.source = compiler.source({'is_valid': urljoin(self.base_uri, os.path.basename(filename))})
+        namespace = {}
+        exec(compile(self.source, '<fast_validator %s>' % filename, 'exec'), namespace)
+        self.is_valid = namespace['is_valid']
+
+    def iter_errors(self, instance):
+        return get_jsonschema_validator(self.filename, self.base_uri).iter_errors(instance)
+
+
+# schema path -> (mtimes, FastValidator)
+_fast_validator_registry = {}
+
+
+def get_validator(filename, base_uri=''):
+    """FastValidator for a schema file, built once per schema (path, base_uri, mtimes)."""
+    key = (os.path.abspath(filename), base_uri)
+    mtimes = tuple(os.path.getmtime(f) for f in [filename] + _ref_files(filename))
+    registered = _fast_validator_registry.get(key)
+    if registered and registered[0] == mtimes:
+        return registered[1]
+    validator = FastValidator(filename, base_uri)
+    _fast_validator_registry[key] = (mtimes, validator)
+    return validator
+
+
+def validate(validator, instance):
+    """Validate an instance of a schema and report errors.
+    Drop-in for schema_test_suite.validate."""
+    return jsonschema_validate(validator, instance)
+
+
+if __name__ == '__main__':
+    src = generate_source(sys.argv[1])
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            f.write(src)
+    else:
+        print(src)
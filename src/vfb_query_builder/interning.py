@@ -0,0 +1,93 @@
+"""Interning of repeated entities in results.
+Results rows (e.g. from anat_image_query or anatomy_channel_image) repeat
+the same entities, such as templates, imaging techniques, datasets and
+licenses, in every row.  normalise() moves each entity that occurs more
+than once into a shared table, leaving {'_entity': index} references;
+expand() reverses this losslessly.  intern_rows() keeps the vfb_query.json
+shape but shares one Python object per distinct entity."""
+import json
+
+ENTITY_KEY = '_entity'
+
+
+def is_entity(d):
+    """True for minimal_entity_info objects and objects wrapping one as core
+    (dataset, license, pub)."""
+    return ('short_form' in d and 'iri' in d) or isinstance(d.get('core'), dict)
+
+
+def _canonical(d):
+    return json.dumps(d, sort_keys=True)
+
+
+def _count(o, counts):
+    if isinstance(o, dict):
+        if is_entity(o):
+            key = _canonical(o)
+            counts[key] = counts.get(key, 0) + 1
+        for v in o.values():
+            _count(v, counts)
+    elif isinstance(o, list):
+        for v in o:
+            _count(v, counts)
+    return counts
+
+
+def normalise(rows, min_count=2):
+    """{'entities': [...], 'rows': [...]} where each entity occurring at
+    least min_count times in rows is replaced by a reference into entities."""
+    counts = _count(rows, {})
+    index = {}
+    entities = []
+
+    def replace(o):
+        if isinstance(o, dict):
+            if is_entity(o):
+                key = _canonical(o)
+                if counts[key] >= min_count:
+                    if key not in index:
+                        index[key] = len(entities)
+                        entities.append(o)
+                    return {ENTITY_KEY: index[key]}
+            return {k: replace(v) for k, v in o.items()}
+        if isinstance(o, list):
+            return [replace(v) for v in o]
+        return o
+
+    rows = replace(rows)
+    return {'entities': entities, 'rows': rows}
+
+
+def expand(payload, share=False):
+    """Rows of a normalised payload in the original shape.  With share,
+    references to the same entity resolve to the same (read-only) object."""
+    entities = payload['entities']
+
+    def replace(o):
+        if isinstance(o, dict):
+            if ENTITY_KEY in o and len(o) == 1:
+                e = entities[o[ENTITY_KEY]]
+                return e if share else json.loads(json.dumps(e))
+            return {k: replace(v) for k, v in o.items()}
+        if isinstance(o, list):
+            return [replace(v) for v in o]
+        return o
+
+    return replace(payload['rows'])
+
+
+def intern_rows(rows):
+    """Copy of rows sharing one (read-only) object per distinct entity."""
+    table = {}
+
+    def replace(o):
+        if isinstance(o, dict):
+            o = {k: replace(v) for k, v in o.items()}
+            if is_entity(o):
+                return table.setdefault(_canonical(o), o)
+            return o
+        if isinstance(o, list):
+            return [replace(v) for v in o]
+        return o
+
+    return replace(rows)
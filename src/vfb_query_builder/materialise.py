@@ -0,0 +1,83 @@
+"""Batch Cypher scripts materialising values that TermInfo queries would
+otherwise compute on every call:
+ - SUBCLASS_DEPTH_PROPERTY on each Class: the depth of the subclass
+   hierarchy below it, used by parents() to order parents.
+ - EXEMPLAR_IMAGE_REL edges, ranked from 0, from each Class and DataSet to
+   the channels of its exemplar images, as found by anatomy_channel_image.
+Scripts are idempotent: re-running them replaces previous values.
+QueryLibrary(materialised=True) reads these values instead of traversing.
+
+Usage: python -m vfb_query_builder.materialise [endpoint] [--sample_size N] [--max_depth N] [--all_paths]
+Without an endpoint the scripts are printed."""
+import argparse
+import json
+import sys
+from string import Template
+from vfb_query_builder.executor import Neo4jRestClient, dict_cursor
+from vfb_query_builder.query_roller import QueryLibrary, SUBCLASS_DEPTH_PATTERN, SUBCLASS_DEPTH_PROPERTY, \
+    EXEMPLAR_IMAGE_REL, NEAREST_IMAGE_MAX_DEPTH
+
+
+def _iterate(source, action, batch_size):
+    return "CALL apoc.periodic.iterate('%s', '%s', {batchSize: %d, parallel: false})" % (source, action, batch_size)
+
+
+def subclass_depth_script(batch_size=10000):
+    return _iterate("MATCH (o:Class) RETURN o",
+                    "OPTIONAL MATCH p=%s WITH o, MAX(length(p)) AS depth SET o.%s = depth"
+                    % (SUBCLASS_DEPTH_PATTERN, SUBCLASS_DEPTH_PROPERTY),
+                    batch_size)
+
+
+def exemplar_image_script(query_library=None, sample_size=None, max_depth=None, nearest_first=True,
+                          batch_size=1000):
+    """Script replacing the exemplar images of every Class and DataSet.
+    sample_size: images kept per term (default from the QueryLibrary); read
+    variants can use at most this many.
+    max_depth: defaults to NEAREST_IMAGE_MAX_DEPTH when nearest_first,
+    otherwise unbounded."""
+    ql = query_library or QueryLibrary()
+    if sample_size is None:
+        sample_size = ql.image_sample_size
+    traversal = Template(ql.image_traversal(max_depth, nearest_first)).substitute(
+        pvar='t', labels='', limit='limit %d' % sample_size)
+    return _iterate("MATCH (t) WHERE t:Class OR t:DataSet RETURN t",
+                    "OPTIONAL MATCH (t)-[old:%s]->() DELETE old WITH DISTINCT t "
+                    "CALL { %s } "
+                    "WITH t, collect(DISTINCT channel) AS channels "
+                    "UNWIND range(0, size(channels) - 1) AS rank "
+                    "WITH t, channels[rank] AS channel, rank "
+                    "MERGE (t)-[e:%s]->(channel) SET e.rank = rank"
+                    % (EXEMPLAR_IMAGE_REL, traversal, EXEMPLAR_IMAGE_REL),
+                    batch_size)
+
+
+def materialisation_scripts(**kwargs):
+    """kwargs are passed to exemplar_image_script."""
+    return [subclass_depth_script(), exemplar_image_script(**kwargs)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('endpoint', nargs='?')
+    parser.add_argument('--usr', default='neo4j')
+    parser.add_argument('--pwd', default='neo4j')
+    parser.add_argument('--sample_size', type=int, default=None)
+    parser.add_argument('--max_depth', type=int, default=None,
+                        help="Default: %d, or unbounded with --all_paths." % NEAREST_IMAGE_MAX_DEPTH)
+    parser.add_argument('--all_paths', action='store_true',
+                        help="Find exemplars via all paths rather than nearest first.")
+    args = parser.parse_args(argv)
+    scripts = materialisation_scripts(sample_size=args.sample_size, max_depth=args.max_depth,
+                                      nearest_first=not args.all_paths)
+    if not args.endpoint:
+        print(';\n'.join(scripts) + ';')
+        return 0
+    client = Neo4jRestClient(args.endpoint, usr=args.usr, pwd=args.pwd)
+    for s in scripts:
+        print(json.dumps(dict_cursor(client.commit([s])), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Clause level cost attribution for QueryLibrary queries.
+A query is rebuilt from cumulative prefixes of its clauses (clauses[:1],
+clauses[:2], ...), each of which is run under PROFILE.  The cost of a
+clause is the difference between its prefix and the previous one.
+
+Responses can be recorded (--record) and replayed (--replay), so reports
+can be regenerated offline.
+
+Usage: python -m vfb_query_builder.profiler endpoint method short_form [short_form ...]
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+from vfb_query_builder.executor import Neo4jRestClient, Neo4jQueryError
+from vfb_query_builder.query_roller import QueryLibrary, query_builder, select_clauses
+
+
+def capture_clauses(method, short_forms, query_library=None, **kwargs):
+    """Run a QueryLibrary method, returning the clauses and query_builder
+    kwargs it builds its query from."""
+    ql = copy.copy(query_library or QueryLibrary())
+    captured = []
+
+    def capture(clauses, **kw):
+        captured.append((clauses, kw))
+        return query_builder(clauses, **kw)
+
+    ql.query_builder = capture
+    getattr(ql, method)(short_forms, **kwargs)
+    return captured[0]
+
+
+def clause_name(clause):
+    return ', '.join(clause.vars or clause.node_vars)
+
+
+def prefix_queries(method, short_forms, query_library=None, **kwargs):
+    """List of (clause name, (statement, parameters)) for each cumulative
+    prefix of the clauses of a QueryLibrary method."""
+    query_library = query_library or QueryLibrary()
+    clauses, kw = capture_clauses(method, short_forms, query_library, **kwargs)
+    if kw.get('fields') is not None:
+        clauses = select_clauses(clauses, kw['fields'])
+    out = []
+    for i in range(1, len(clauses) + 1):
+        q = query_builder(clauses[:i],
+                          query_short_forms=kw.get('query_short_forms'),
+                          query_labels=kw.get('query_labels'),
+                          pretty_print=False, annotate=False, parameterise=True,
+                          subqueries=query_library.subqueries)
+        out.append((clause_name(clauses[i - 1]), q))
+    return out
+
+
+def sum_db_hits(plan):
+    return plan.get('dbHits', 0) + sum(sum_db_hits(c) for c in plan.get('children', []))
+
+
+def profile_query(client, method, short_forms, query_library=None, **kwargs):
+    """Profile each clause of a QueryLibrary method.
+    Returns a list of dicts, one per clause: clause, db_hits, rows, time_ms
+    (each attributed to that clause) and cumulative db_hits and time_ms."""
+    report = []
+    prev_hits = prev_time = 0
+    for name, (statement, parameters) in prefix_queries(method, short_forms, query_library, **kwargs):
+        start = time.perf_counter()
+        result = client.commit([('PROFILE ' + statement, parameters)])[0]
+        elapsed = (time.perf_counter() - start) * 1000
+        plan = result.get('profile', {})
+        hits = sum_db_hits(plan)
+        report.append({'clause': name,
+                       'db_hits': hits - prev_hits,
+                       'rows': plan.get('rows', len(result.get('data', []))),
+                       'time_ms': round(elapsed - prev_time, 1),
+                       'cumulative_db_hits': hits,
+                       'cumulative_time_ms': round(elapsed, 1)})
+        prev_hits, prev_time = hits, elapsed
+    return report
+
+
+def format_table(report):
+    header = ('clause', 'db_hits', 'rows', 'time_ms', 'cumulative_db_hits')
+    rows = [header] + [tuple(str(r[h]) for h in header) for r in report]
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(c.ljust(w) if i == 0 else c.rjust(w)
+                               for i, (c, w) in enumerate(zip(r, widths)))
+                     for r in rows)
+
+
+class RecordingClient:
+    """Wraps a client, recording results by statement for replay with RecordedClient."""
+
+    def __init__(self, client):
+        self.client = client
+        self.recording = {}
+
+    def commit(self, statements):
+        results = self.client.commit(statements)
+        for s, r in zip(statements, results):
+            self.recording[s if isinstance(s, str) else s[0]] = r
+        return results
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.recording, f, indent=1)
+
+
+class RecordedClient:
+    """Stands in for Neo4jRestClient, returning recorded results.
+    recording: dict of statement: result, or path to a saved recording."""
+
+    def __init__(self, recording):
+        if isinstance(recording, str):
+            with open(recording, 'r') as f:
+                recording = json.load(f)
+        self.recording = recording
+
+    def commit(self, statements):
+        results = []
+        for s in statements:
+            statement = s if isinstance(s, str) else s[0]
+            if statement not in self.recording:
+                raise Neo4jQueryError('No recorded result for: %s' % statement)
+            results.append(self.recording[statement])
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('endpoint', help='Neo4j endpoint (ignored with --replay)')
+    parser.add_argument('method', help='QueryLibrary method, e.g. class_term_info')
+    parser.add_argument('short_forms', nargs='+')
+    parser.add_argument('--usr', default='neo4j')
+    parser.add_argument('--pwd', default='neo4j')
+    parser.add_argument('--json', action='store_true', help='Report as JSON')
+    parser.add_argument('--subqueries', action='store_true', help='Generate CALL { } subqueries')
+    parser.add_argument('--record', help='Save responses to this file')
+    parser.add_argument('--replay', help='Use responses saved with --record')
+    args = parser.parse_args(argv)
+    if args.replay:
+        client = RecordedClient(args.replay)
+    else:
+        client = Neo4jRestClient(args.endpoint, usr=args.usr, pwd=args.pwd)
+        if args.record:
+            client = RecordingClient(client)
+    report = profile_query(client, args.method, args.short_forms,
+                           query_library=QueryLibrary(subqueries=args.subqueries))
+    if args.record and not args.replay:
+        client.save(args.record)
+    print(json.dumps(report, indent=2) if args.json else format_table(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,42 @@
 from dataclasses import dataclass, field
 from typing import List
 from string import Template
+from functools import lru_cache
 import subprocess
-from xml.sax import saxutils
+import threading
+import os
 import json
+import re
 
+# Stamped at build time, e.g. git rev-parse --short HEAD > src/vfb_query_builder/VERSION
+VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VERSION')
 
-def get_version_tag():
-    tag = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'])
+
+def _stamped_version_tag():
+    try:
+        with open(VERSION_FILE, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _git_version_tag():
+    try:
+        tag = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=os.path.dirname(VERSION_FILE),
+                                      stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
     return tag.decode(encoding='ascii').rstrip()
 
 
+@lru_cache(maxsize=None)
+def get_version_tag():
+    """Version tag used to annotate queries.  Resolved once per process:
+    from VERSION_FILE if present, falling back to git, then to 'unknown'."""
+    return _stamped_version_tag() or _git_version_tag() or 'unknown'
+
+
 @dataclass
 class Clause:
     """Specifies a single cypher clause (MATCH + WITH/RETURN values + variables
@@ -46,6 +72,9 @@ class Clause:
               referring to whole nodes, to be interpolated into subsequent clauses.
     RETURN: A cypher string that converts variables referenced in node_vars
     into a data structure in the final return statement of the generated cypher query.
+    row_key: For initial clauses returning several rows per combination of node_vars,
+    a string expression over the MATCH bindings distinguishing those rows.
+    Paged queries add it to the cursor, so that every row has a unique cursor.
     """
 
     MATCH: Template  # Should probably make this a string and refactor to make Template object inside function.
@@ -58,6 +87,7 @@ class Clause:
     pvar: str = 'primary'
     limit: str = ''
     prel: str = ''
+    row_key: str = ''
 
     def get_clause(self, varz, pretty_print=True):
         """Generate a cypher string using the attributes of this clause object,
@@ -77,14 +107,99 @@ class Clause:
                                    limit=self.limit),
              'WITH ' + ','.join([self.WITH] + varz)])
 
+    def get_subquery(self, imports, pretty_print=True):
+        """Generate a CALL { } subquery wrapping this clause, importing the
+        variables in imports and returning vars and node_vars.  This keeps
+        the clause's intermediate rows (and aggregation) local to the
+        subquery, rather than carrying accumulated vars through them."""
+        sep = ' '
+        if pretty_print:
+            sep = ' \n'
+        return sep.join(['CALL { WITH ' + ', '.join(imports),
+                         self.get_clause(imports, pretty_print=pretty_print),
+                         'RETURN ' + ', '.join(self.vars + self.node_vars) + ' }'])
+
+    def key(self):
+        """Hashable summary of the clause spec (excluding starting_short_forms),
+        for use in cache keys."""
+        return (self.MATCH.template, self.WITH, tuple(self.vars), self.RETURN,
+                tuple(self.node_vars), tuple(self.starting_labels or []),
+                self.pvar, self.limit, self.prel, self.row_key)
+
+
+SHORT_FORMS_PARAM = 'short_forms'
+CURSOR_PARAM = 'cursor'
+ROW_KEY_VAR = 'row_key'
+
+# Fields returned by every TermInfo query, whatever the selection.
+ALWAYS_RETURNED_FIELDS = ('term', 'query', 'version', 'pub_specific_content')
+
+
+def _clause_vars(c):
+    return {v.strip() for var in c.vars for v in var.split(',')}
+
+
+def select_clauses(clauses: List[Clause], fields):
+    """Select the clauses needed to return fields (names of vars, matching
+    vfb_termInfo.json properties).  The first clause is always kept, as are
+    clauses providing node_vars (pvar) used by selected clauses.
+    Raises ValueError for fields no clause provides."""
+    fields = set(fields)
+    unknown = fields - set(ALWAYS_RETURNED_FIELDS).union(*[_clause_vars(c) for c in clauses])
+    if unknown:
+        raise ValueError("Unknown fields: %s" % ', '.join(sorted(unknown)))
+    keep = []
+    needed = set()
+    for c in reversed(clauses[1:]):
+        if _clause_vars(c) & fields or set(c.node_vars) & needed:
+            keep.append(c)
+            needed.add(c.pvar)
+    return clauses[:1] + keep[::-1]
+
+
+def page_clause(node_vars, page_size, cursor=None, row_key=False):
+    """Clause ordering rows by a cursor (short_forms of node_vars, then
+    ROW_KEY_VAR if row_key), keeping page_size rows after cursor (a cypher expression)."""
+    key = " + ' ' + ".join(["%s.short_form" % v for v in node_vars] + ([ROW_KEY_VAR] if row_key else []))
+    out = "WITH *, %s AS %s " % (key, CURSOR_PARAM)
+    if cursor is not None:
+        out += "WHERE %s > %s " % (CURSOR_PARAM, cursor)
+    return out + "WITH * ORDER BY %s LIMIT %d" % (CURSOR_PARAM, page_size)
+
 
 def query_builder(clauses: List[Clause], query_short_forms=None,
-                  query_labels=None, pretty_print=True, annotate=True, q_name=''):
+                  query_labels=None, pretty_print=True, annotate=True, q_name='',
+                  parameterise=False, subqueries=False, fields=None,
+                  page_size=None, cursor=None, version=None):
     """clauses: A list of Clause objects. The first element in the list must be an initial clause.
-    Initial clauses must have slot for short_forms """
+    Initial clauses must have slot for short_forms
+    parameterise: If True, short_forms are not spliced into the statement but
+    referenced as $short_forms.  Returns (statement, parameters)
+    subqueries: If True, clauses after the first are generated as CALL { }
+    subqueries importing only node_vars, so intermediate cardinality stays at
+    one row per row of the outer query (requires Neo4j 4+).  Results are unchanged.
+    fields: If specified, only the clauses needed to return these fields are
+    used (see select_clauses).
+    page_size: If specified, rows are ordered by a cursor (the short_forms of
+    the initial clause's node_vars) and at most page_size rows, with cursor
+    greater than cursor, are returned.  The cursor is returned as a column.
+    With parameterise, cursor is passed as $cursor ('' for the first page).
+    version: tag returned as version (default: get_version_tag())."""
 
     if not query_labels:
         query_labels = []  # Set to some default for no var.
+    if fields is not None:
+        clauses = select_clauses(clauses, fields)
+    if parameterise:
+        parameters = {}
+        if query_short_forms is not None:
+            parameters[SHORT_FORMS_PARAM] = list(query_short_forms)
+        query_short_forms = '$' + SHORT_FORMS_PARAM
+        if page_size:
+            parameters[CURSOR_PARAM] = cursor or ''
+            cursor = '$' + CURSOR_PARAM
+    elif cursor is not None:
+        cursor = json.dumps(cursor)
     clauses[0].starting_short_forms = query_short_forms
     clauses[0].starting_labels = query_labels
 
@@ -98,21 +213,34 @@ def query_builder(clauses: List[Clause], query_short_forms=None,
     return_clauses = []
     out = []
 
-    for c in clauses:
+    for i, c in enumerate(clauses):
 
-        out.append(c.get_clause(varz=node_vars + data_vars))
+        if subqueries and i and (c.vars or c.node_vars):
+            out.append(c.get_subquery(imports=list(node_vars)))
+        elif page_size and not i and c.row_key:
+            # Carry the row key (unreturned) to the page clause.
+            out.append(c.get_clause(varz=['%s AS %s' % (c.row_key, ROW_KEY_VAR)]))
+        else:
+            out.append(c.get_clause(varz=node_vars + data_vars))
         node_vars.extend(c.node_vars)
         data_vars.extend(c.vars)
         if c.RETURN:
             return_clauses.append(c.RETURN)
+        if page_size and not i:
+            out.append(page_clause(node_vars, page_size, cursor, row_key=bool(c.row_key)))
+            data_vars.append(CURSOR_PARAM)
 
         # TODO: Add in some checks to make sure vars don't get stomped
     if annotate:
         if q_name:
             return_clauses.append("'%s' AS query" % q_name)
-        return_clauses.append("'%s' AS version " % get_version_tag())
+        return_clauses.append("'%s' AS version " % (version or get_version_tag()))
     return_clause = "RETURN " + ', '.join(return_clauses + data_vars)
+    if page_size:
+        return_clause += " ORDER BY %s" % CURSOR_PARAM
     out.append(return_clause)
+    if parameterise:
+        return sep.join(out), parameters
     return sep.join(out)
 
 
@@ -135,6 +263,21 @@ def roll_min_edge_info(var):
                var, var, var, var, var
            ) # short_forms are not present in OLS-PDB
 
+def roll_min_node_projection(var):
+    """Map projection equivalent of roll_min_node_info, for compact statements.
+    Only for variables that cannot be null: projecting null gives null,
+    not a map of nulls."""
+    return "%s{.short_form,.iri,label:coalesce(%s.label,''),types:labels(%s)," \
+           "unique_facets:apoc.coll.sort(coalesce(%s.uniqueFacets,[])),symbol:coalesce(([]+%s.symbol)[0],'')}" \
+           % (var, var, var, var, var)
+
+
+def roll_min_edge_projection(var):
+    """Map projection equivalent of roll_min_edge_info (see roll_min_node_projection)."""
+    return "%s{.label,.iri,type:type(%s),database_cross_reference:coalesce(%s.database_cross_reference,[])," \
+           "confidence_value:coalesce(toString(%s.confidence_value[0]),'')}" % (var, var, var, var)
+
+
 def roll_pub_return(var):
     s = Template("{ core: $core, "
                  "PubMed: coalesce(([]+$v.PMID)[0], ''), "
@@ -156,12 +299,12 @@ def roll_dataset_return_dict(var, typ=''):
     }
 
 
-def roll_node_map(var: str, d: dict, typ=''):
+def roll_node_map(var: str, d: dict, typ='', node=roll_min_node_info):
     if typ:
         if typ == 'core':
-            d.update({'core': roll_min_node_info(var)})
+            d.update({'core': node(var)})
         elif typ == 'extended_core':
-            d.update({'core': roll_min_node_info(var),
+            d.update({'core': node(var),
                       'description': "coalesce(%s.description, [])" % var,
                       "comment": "coalesce(%s.comment, [])" % var
                       })
@@ -171,13 +314,116 @@ def roll_node_map(var: str, d: dict, typ=''):
     return '{ ' + ', '.join([' : '.join(kv) for kv in d.items()]) + ' }'
 
 
+def roll_license_map(var):
+    return roll_node_map(var=var, d=roll_license_return_dict(var), typ='core')
+
+
+# Small sets of entities repeated across many results: kind -> function rolling their map.
+ENTITY_MAPS = {'site': roll_min_node_info,
+               'license': roll_license_map,
+               'template': roll_min_node_info,
+               'technique': roll_min_node_info}
+ENTITY_REF_KEY = '_ref'
+
+
+def roll_entity_ref(var, kind):
+    """Reference to an entity of kind (ENTITY_MAPS), to be hydrated from an EntityDictionary."""
+    return "{ %s: ['%s', %s.short_form] }" % (ENTITY_REF_KEY, kind, var)
+
+
+# String literals (possibly unterminated) and quoted identifiers.
+_LITERAL = re.compile(r"""('[^'\\]*(?:\\.[^'\\]*)*'?|"[^"\\]*(?:\\.[^"\\]*)*"?|`[^`]*`?)""", re.S)
+_PUNCTUATION_SPACE = re.compile(r' ?([,:{}()\[\]=+]) ?')
+_CONTROL = re.compile(r'[\x00-\x1f]')
+
+
+def _collapse(code):
+    """code with whitespace runs replaced by single spaces."""
+    return (' ' if code[:1].isspace() else '') + ' '.join(code.split()) + \
+           (' ' if code[-1:].isspace() and not code.isspace() else '')
+
+
+def minify(statement, compact=False):
+    """statement with whitespace outside literals collapsed to single spaces,
+    or with compact, removed around punctuation.  The statement is split
+    into literals and code once; code is then rewritten in one go, joined
+    by NUL placeholders for the literals."""
+    # Code at even indices, literals at odd.
+    parts = None
+    if '"' not in statement and '`' not in statement and '\\' not in statement:
+        # Only unescaped single-quoted literals: split on quotes, unless one is unterminated.
+        parts = statement.split("'")
+        quote = "'"
+        if not len(parts) % 2:
+            parts = None
+    if parts is None:
+        parts = _LITERAL.split(statement)
+        quote = ''
+    if '\0' in statement:  # Placeholder clash: rewrite each part of code.
+        code = [_collapse(c) for c in parts[::2]]
+        if compact:
+            code = [_PUNCTUATION_SPACE.sub(r'\1', c) for c in code]
+    else:
+        code = ' '.join('\0'.join(parts[::2]).split())
+        if compact:
+            code = _PUNCTUATION_SPACE.sub(r'\1', code)
+        code = code.split('\0')
+    parts[::2] = code
+    return quote.join(parts).strip()
+
+
+def _json_escape(s):
+    s = s.replace('\\', '\\\\').replace('"', '\\"')
+    # isprintable is a much faster scan than _CONTROL when nothing matches.
+    if not s.isprintable() and _CONTROL.search(s):
+        s = _CONTROL.sub(lambda m: '\\u%04x' % ord(m.group()), s)
+    return s
+
+
+def compact_whitespace(statement):
+    """statement with whitespace outside string literals removed around
+    punctuation and collapsed to single spaces elsewhere."""
+    return minify(statement, compact=True)
+
+
+def render_statement(statement, compact=False):
+    """(raw, json, xmi) forms of the minified statement: raw, escaped for a
+    JSON string, and escaped for a JSON string inside an XMI attribute."""
+    raw = minify(statement, compact)
+    js = _json_escape(raw)
+    return raw, js, js.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;')
+
+
+# Materialised values, written by the materialise scripts.
+SUBCLASS_DEPTH_PATTERN = "(o)<-[:SUBCLASSOF*..5]-(:Class)"
+SUBCLASS_DEPTH_PROPERTY = 'subclass_depth'
+EXEMPLAR_IMAGE_REL = 'has_exemplar_image'
+
+# Default max_depth for nearest-first image traversal, which expands level by
+# level and must not walk an unbounded subtree when few images exist.
+NEAREST_IMAGE_MAX_DEPTH = 10
+
+
 class QueryLibraryCore:
 
     # Using class to wrap for convenience.
     # Could do the same with a set of static methods.
     # This class contains methods for generating query clauses.
 
-    def __init__(self):
+    def __init__(self, subqueries=False, entity_refs=False, image_max_depth=None,
+                 image_sample_size=10, nearest_images=False, materialised=False, compact=False):
+        # subqueries: generate queries using CALL { } subqueries (see query_builder)
+        self.subqueries = subqueries
+        # entity_refs: return references to ENTITY_MAPS entities (see entity_dictionary)
+        self.entity_refs = entity_refs
+        # Defaults for anatomy_channel_image traversal (see anatomy_channel_image)
+        self.image_max_depth = image_max_depth
+        self.image_sample_size = image_sample_size
+        self.nearest_images = nearest_images
+        # materialised: read precomputed parent depths and exemplar images (see materialise)
+        self.materialised = materialised
+        # compact: emit minimal statements, using map projections (see _node)
+        self.compact = compact
         # Using methods for ease of reading code - so these can be next to queries where they apply.
         self._set_image_query_common_elements()
         self._set_pub_common_query_elements()
@@ -188,6 +434,35 @@ class QueryLibraryCore:
                                     'link': "coalesce(([]+%s.license_url)[0], '')x"
                                     }
 
+    def query_builder(self, clauses, **kwargs):
+        """Builds queries for library methods (see query_builder).
+        Override, or replace on an instance, to intercept clauses."""
+        q = query_builder(clauses, subqueries=self.subqueries, **kwargs)
+        if not self.compact:
+            return q
+        if isinstance(q, tuple):
+            return compact_whitespace(q[0]), q[1]
+        return compact_whitespace(q)
+
+    def _node(self, var):
+        """Map of minimal info for var, which must not be null (see roll_min_node_projection)."""
+        if self.compact:
+            return roll_min_node_projection(var)
+        return roll_min_node_info(var)
+
+    def _edge(self, var):
+        """Map of minimal info for edge var, which must not be null."""
+        if self.compact:
+            return roll_min_edge_projection(var)
+        return roll_min_edge_info(var)
+
+    def _entity(self, var, kind, nullable=True):
+        if self.entity_refs:
+            return roll_entity_ref(var, kind)
+        if not nullable and ENTITY_MAPS[kind] is roll_min_node_info:
+            return self._node(var)
+        return ENTITY_MAPS[kind](var)
+
     def term(self, return_extensions=None):
         if return_extensions is None:
             return_extensions = {}
@@ -198,7 +473,8 @@ class QueryLibraryCore:
             RETURN=roll_node_map(
                 d=return_extensions,
                 typ='extended_core',
-                var='primary') + " AS term")
+                var='primary',
+                node=self._node) + " AS term")
 
     # EXPRESSION QUERIES
 
@@ -220,22 +496,32 @@ class QueryLibraryCore:
         return Clause(
             MATCH=Template(' '.join([match_self_xref, "WITH", xr, xrs, match_ext_xref])
                            % ('[]', 'primary.short_form',
-                              roll_min_node_info("s"))),
+                              self._entity("s", 'site', nullable=False))),
             WITH='  '.join([xr, xrx]) % ('self_xref',
                                          '([]+dbx.accession)[0]',
-                                         roll_min_node_info("s")),
+                                         self._entity("s", 'site', nullable=False)),
             vars=["xrefs"])
 
     # RELATIONSHIPS
 
-    def parents(self):  return Clause(vars=["parents"],
-                                      MATCH=Template("OPTIONAL MATCH (o:Class)"
-                                                     "<-[r:SUBCLASSOF|INSTANCEOF]-($pvar$labels) "
-                                                     "OPTIONAL MATCH p=(o)<-[:SUBCLASSOF*..5]-(:Class) "
-                                                     "WITH *, MAX(length(p)) AS max_chain_length, null as p "
-                                                     "ORDER BY max_chain_length ASC "),
-                                      WITH="CASE WHEN o IS NULL THEN [] ELSE COLLECT "
-                                           "(DISTINCT %s) END AS parents " % roll_min_node_info("o"))  # Draft
+    def parents(self, materialised=None):
+        """Parent classes, ordered by the depth of their subclass hierarchy
+        (SUBCLASS_DEPTH_PATTERN), or by its precomputed SUBCLASS_DEPTH_PROPERTY
+        if materialised (default from the QueryLibrary)."""
+        if materialised is None:
+            materialised = self.materialised
+        if materialised:
+            depth = "WITH *, o.%s AS max_chain_length " % SUBCLASS_DEPTH_PROPERTY
+        else:
+            depth = "OPTIONAL MATCH p=%s " \
+                    "WITH *, MAX(length(p)) AS max_chain_length, null as p " % SUBCLASS_DEPTH_PATTERN
+        return Clause(vars=["parents"],
+                      MATCH=Template("OPTIONAL MATCH (o:Class)"
+                                     "<-[r:SUBCLASSOF|INSTANCEOF]-($pvar$labels) " +
+                                     depth +
+                                     "ORDER BY max_chain_length ASC "),
+                      WITH="CASE WHEN o IS NULL THEN [] ELSE COLLECT "
+                           "(DISTINCT %s) END AS parents " % self._node("o"))  # Draft
 
     def relationships(self): return (Clause(vars=["relationships"],
                                             MATCH=Template("OPTIONAL MATCH "
@@ -244,8 +530,8 @@ class QueryLibraryCore:
                                                            "(not (r.hide_in_terminfo[0] = true))) "),
                                             WITH="CASE WHEN o IS NULL THEN [] "
                                                  "ELSE COLLECT ({ relation: %s, object: %s }) "
-                                                 "END AS relationships " % (roll_min_edge_info("r"),
-                                                                            roll_min_node_info("o"))))
+                                                 "END AS relationships " % (self._edge("r"),
+                                                                            self._node("o"))))
 
     def related_individuals(self): return (Clause(vars=["related_individuals"],
                                                   MATCH=Template(
@@ -255,8 +541,8 @@ class QueryLibraryCore:
                                                   WITH="CASE WHEN o IS NULL THEN [] ELSE COLLECT "
                                                        "({ relation: %s, object: %s }) "
                                                        "END AS related_individuals "
-                                                       % (roll_min_edge_info("r"),
-                                                          roll_min_node_info("o"))))
+                                                       % (self._edge("r"),
+                                                          self._node("o"))))
 
     def term_replaced_by(self): return (Clause(vars=["related_individuals"],
                                                   MATCH=Template(
@@ -265,8 +551,8 @@ class QueryLibraryCore:
                                                   WITH="CASE WHEN o IS NULL THEN [] ELSE COLLECT "
                                                        "({ relation: %s, object: %s }) "
                                                        "END AS related_individuals "
-                                                       % (roll_min_edge_info("r"),
-                                                          roll_min_node_info("o"))))
+                                                       % (self._edge("r"),
+                                                          self._node("o"))))
 
     def related_individuals_neuron_region(self):
         return (Clause(vars=["synapse_counts, object"],
@@ -279,7 +565,7 @@ class QueryLibraryCore:
                        WITH="apoc.map.removeKeys(apoc.map.merge(props[0], props[1]),"
                              "['iri', 'short_form', 'Related', 'label', 'type']) "
                              "as synapse_counts, %s as object, target  "
-                             "" % roll_min_node_info("target")))  # o -> images, parent classes
+                             "" % self._node("target")))  # o -> images, parent classes
 
 
     def related_individuals_neuron_neuron(self): return (Clause(vars=["synapse_counts, object"],
@@ -294,7 +580,7 @@ class QueryLibraryCore:
                                                   WITH="{ downstream: [coalesce(down.weight[0],0)], "
                                                        "upstream:[coalesce(up.weight[0],0)] } as synapse_counts, "
                                                        "%s as object, oi"
-                                                       % roll_min_node_info("oi")))  # oi -> images, parent classes
+                                                       % self._node("oi")))  # oi -> images, parent classes
 
     def ep_stage(self):
         return Clause(
@@ -302,8 +588,8 @@ class QueryLibraryCore:
             WITH="CASE WHEN o IS NULL THEN [] ELSE COLLECT "
                  "({ relation: %s, object: %s }) "
                  "END AS stages "
-                 "" % (roll_min_edge_info("r"),
-                       roll_min_node_info("o")),
+                 "" % (self._edge("r"),
+                       self._node("o")),
             vars=['stages']
         )
 
@@ -315,7 +601,7 @@ class QueryLibraryCore:
                            "-[:has_source]->(ds:scRNAseq_DataSet:Individual)"
                            "OPTIONAL MATCH (ds)-[:has_reference]->(p:pub)"),
             WITH="%s AS cluster, %s AS dataset, COLLECT(%s) AS pubs" 
-                 "" % (roll_min_node_info("c"), roll_min_node_info("ds"), roll_pub_return("p")),
+                 "" % (self._node("c"), self._node("ds"), roll_pub_return("p")),
             vars=["cluster, dataset, pubs"]
         )
 
@@ -323,7 +609,7 @@ class QueryLibraryCore:
         return Clause(
             MATCH=Template("MATCH (a:Anatomy:Class)<-[:composed_primarily_of]-($pvar$labels)"),
             WITH="%s AS anatomy" 
-                 "" % roll_min_node_info("a"),
+                 "" % self._node("a"),
             vars=["anatomy"]
         )
 
@@ -332,7 +618,7 @@ class QueryLibraryCore:
             MATCH=Template("MATCH ($pvar$labels)-[e:expresses]->(g:Gene:Class)"),
             WITH="e.expression_level[0] as expression_level, "
                  "e.expression_extent[0] as expression_extent, "
-                 "%s AS gene" % (roll_min_node_info("g")),
+                 "%s AS gene" % (self._node("g")),
             vars=["expression_level", "expression_extent", "gene"]
         )
 
@@ -354,10 +640,10 @@ class QueryLibraryCore:
                                      "image_obj: COALESCE(([]+irw.obj)[0], ''), " \
                                      "image_wlz: COALESCE(([]+irw.wlz)[0], ''), " \
                                      "index: coalesce(apoc.convert.toInteger(([]+irw.index)[0]), []) + [] }" \
-                                     "}" % (roll_min_node_info('channel'),
-                                            roll_min_node_info('technique'),
-                                            roll_min_node_info('template'),
-                                            roll_min_node_info('template_anat'))
+                                     "}" % (self._node('channel'),
+                                            self._entity('technique', 'technique'),
+                                            self._entity('template', 'template', nullable=False),
+                                            self._entity('template_anat', 'template', nullable=False))
 
     def channel_image(self):
         return Clause(
@@ -384,29 +670,93 @@ class QueryLibraryCore:
         return Clause(
             MATCH=Template("OPTIONAL MATCH ($pvar)-[:INSTANCEOF]->(typ:Class) "),
             WITH="CASE WHEN typ is null THEN [] "
-                 "ELSE collect (%s) END AS parents" % roll_min_node_info('typ'),
+                 "ELSE collect (%s) END AS parents" % self._node('typ'),
             vars=["parents"])
 
-    def anatomy_channel_image(self):
+    def image_traversal(self, max_depth=None, nearest_first=False):
+        """Cypher (with $pvar, $labels and $limit placeholders) finding images
+        of individuals reached from $pvar, as used by anatomy_channel_image
+        and by the exemplar image materialisation (see materialise).
+        With nearest_first, the breadth-first expansion streams into $limit,
+        so it stops once enough images are found; only the selected rows are
+        sorted.  max_depth then defaults to NEAREST_IMAGE_MAX_DEPTH."""
+        if nearest_first and max_depth is None:
+            max_depth = NEAREST_IMAGE_MAX_DEPTH
+        if max_depth is not None and max_depth < 1:
+            raise ValueError("max_depth must be at least 1: %s" % max_depth)
+        image_match = "(i)<-[:depicts]- " \
+                      "(channel:Individual)-[irw:in_register_with] " \
+                      "->(template:Individual)-[:depicts]-> " \
+                      "(template_anat:Individual) "
+        if nearest_first:
+            return "WITH $pvar MATCH ($pvar$labels) " \
+                   "CALL apoc.path.expandConfig($pvar, {relationshipFilter: \"<has_source|<SUBCLASSOF|<INSTANCEOF\", " \
+                   "labelFilter: \">Individual\", minLevel: 1, maxLevel: %d, bfs: true, " \
+                   "uniqueness: \"NODE_GLOBAL\"}) YIELD path " \
+                   "WITH last(nodes(path)) AS i, length(path) AS depth " \
+                   "MATCH %s" \
+                   "WITH i, depth, channel, irw, template, template_anat $limit " \
+                   "WITH i, depth, channel, irw, template, template_anat ORDER BY depth, i.short_form, channel.short_form " \
+                   "WITH collect({ i: i, channel: channel, irw: irw, template: template, template_anat: template_anat }) AS images " \
+                   "UNWIND CASE WHEN images = [] THEN [null] ELSE images END AS image " \
+                   "RETURN image.template AS template, image.channel AS channel, image.template_anat AS template_anat, " \
+                   "image.i AS i, image.irw AS irw" % (max_depth, image_match)
+        return "WITH $pvar OPTIONAL MATCH ($pvar$labels)<- " \
+               "[:has_source|SUBCLASSOF|INSTANCEOF%s]-%s" \
+               "RETURN template, channel, template_anat, i, irw " \
+               "$limit" % ('*' if max_depth is None else '*..%d' % max_depth,
+                           image_match.replace('(i)', '(i:Individual)'))
+
+    def anatomy_channel_image(self, max_depth=None, sample_size=None, nearest_first=None, materialised=None):
+        """Images of individuals reached from $pvar via incoming has_source,
+        SUBCLASSOF and INSTANCEOF edges, up to sample_size (limit) of them.
+        max_depth: maximum number of edges traversed (None: unbounded, or
+        NEAREST_IMAGE_MAX_DEPTH with nearest_first).
+        nearest_first: expand breadth-first, visiting each node once, and
+        stop at the first sample_size images, so the nearest are returned
+        (ordered by depth, then short_form; ties at the furthest depth
+        reached are broken by traversal order).
+        Otherwise every matching path is walked and any sample_size images
+        are returned.
+        materialised: read precomputed EXEMPLAR_IMAGE_REL edges, in rank order,
+        instead of traversing (max_depth and nearest_first then apply when
+        materialising).
+        Defaults are taken from the QueryLibrary."""
+        if max_depth is None:
+            max_depth = self.image_max_depth
+        if sample_size is None:
+            sample_size = self.image_sample_size
+        if nearest_first is None:
+            nearest_first = self.nearest_images
+        if materialised is None:
+            materialised = self.materialised
+        if sample_size < 1:
+            raise ValueError("sample_size must be at least 1: %s" % sample_size)
+        if materialised:
+            # A channel may be registered to several templates: order and limit the rows.
+            match = "CALL { WITH $pvar OPTIONAL MATCH ($pvar$labels)-[e:%s]->(channel:Individual)" \
+                    "-[irw:in_register_with]->(template:Individual)-[:depicts]->(template_anat:Individual), " \
+                    "(channel)-[:depicts]->(i:Individual) WHERE e.rank < %d " \
+                    "RETURN template, channel, template_anat, i, irw ORDER BY e.rank $limit } " \
+                    % (EXEMPLAR_IMAGE_REL, sample_size)
+        else:
+            match = "CALL apoc.cypher.run('" + self.image_traversal(max_depth, nearest_first) + \
+                    "', {$pvar:$pvar}) " \
+                    "yield value with value.template as template, value.channel as channel," \
+                    "value.template_anat as template_anat, value.i as i, value.irw as irw, $v "
 
         return Clause(
             MATCH=Template(
-                "CALL apoc.cypher.run('WITH $pvar OPTIONAL MATCH ($pvar$labels)<- "
-                "[:has_source|SUBCLASSOF|INSTANCEOF*]-(i:Individual)<-[:depicts]- "
-                "(channel:Individual)-[irw:in_register_with] "
-                "->(template:Individual)-[:depicts]-> "
-                "(template_anat:Individual) RETURN template, channel, template_anat, i, irw "
-                "limit 10', {$pvar:$pvar}) yield value with value.template as template, value.channel as channel,"
-                "value.template_anat as template_anat, value.i as i, value.irw as irw, $v "
+                match +
                 "OPTIONAL MATCH (channel)-[:is_specified_output_of]"
                 "->(technique:Class) "),
             WITH="CASE WHEN channel IS NULL THEN [] " \
                  "ELSE COLLECT({ anatomy: %s, channel_image: %s }) " \
                  "END AS anatomy_channel_image " % (
-                     roll_min_node_info("i"), self._channel_image_return),
+                     self._node("i"), self._channel_image_return),
 
             vars=["anatomy_channel_image"],
-            limit='limit 10, {}) yield value')
+            limit='limit %d' % sample_size)
 
     def template_domain(self):  return Clause(
         MATCH=Template(
@@ -446,7 +796,7 @@ class QueryLibraryCore:
              "image_swc: COALESCE(([]+irw.swc)[0], ''), "
              "image_obj: COALESCE(([]+irw.obj)[0], ''), "
              "image_wlz: COALESCE(([]+irw.wlz)[0], ''), "
-             "channel: %s } as template_channel" % roll_min_node_info("channel"),
+             "channel: %s } as template_channel" % self._node("channel"),
         vars=["template_channel"])
 
     ## PUBS
@@ -457,7 +807,7 @@ class QueryLibraryCore:
                            "PubMed: coalesce(([]+p.PMID)[0], ''), " \
                            "FlyBase: coalesce(([]+p.FlyBase)[0], ''), " \
                            "DOI: coalesce(([]+p.DOI)[0], '') } " \
-                           "" % roll_min_node_info("p")
+                           "" % self._node("p")
 
         # temp fixes in here for list -> single !
         self._syn_return = "{ label: coalesce(([]+rp.value)[0], ''), " \
@@ -493,7 +843,7 @@ class QueryLibraryCore:
             MATCH=Template("OPTIONAL MATCH (:Class { label: 'intersectional expression pattern'})"
                            "<-[:SUBCLASSOF]-(ep:Class)<-[ar:part_of]-(anoni:Individual)"
                            "-[:INSTANCEOF]->($pvar)"),
-            WITH="CASE WHEN ep IS NULL THEN [] ELSE COLLECT(%s) END AS targeting_splits" % roll_min_node_info("ep"),
+            WITH="CASE WHEN ep IS NULL THEN [] ELSE COLLECT(%s) END AS targeting_splits" % self._node("ep"),
             vars=['targeting_splits'])
 
     def split_neuron(self):
@@ -501,7 +851,7 @@ class QueryLibraryCore:
             MATCH=Template("OPTIONAL MATCH (:Class { label: 'intersectional expression pattern'})"
                            "<-[:SUBCLASSOF]-($pvar)<-[ar:part_of]-(anoni:Individual)"
                            "-[:INSTANCEOF]->(n:Neuron)"),
-            WITH="CASE WHEN n IS NULL THEN [] ELSE COLLECT(%s) END AS target_neurons" % roll_min_node_info("n"),
+            WITH="CASE WHEN n IS NULL THEN [] ELSE COLLECT(%s) END AS target_neurons" % self._node("n"),
             vars=['target_neurons'])
 
 
@@ -514,9 +864,7 @@ class QueryLibraryCore:
                  "AS dataset_license" % (roll_node_map(var='ds',
                                                        d=roll_dataset_return_dict('ds'),
                                                        typ='core'),
-                                         roll_node_map(var='l',
-                                                       d=roll_license_return_dict('l'),
-                                                       typ='core')),
+                                         self._entity('l', 'license')),
             vars=['dataset_license'],
             prel=prel)
 
@@ -524,10 +872,7 @@ class QueryLibraryCore:
         return Clause(
             MATCH=Template("OPTIONAL MATCH "
                            "($pvar$labels)-[:has_license|license]->(l:License)"),
-            WITH="collect (%s) as license"
-                 % roll_node_map(var='l',
-                                 typ='core',
-                                 d=roll_license_return_dict('l')),
+            WITH="collect (%s) as license" % self._entity('l', 'license'),
             vars=['license'])
 
     def dataset_counts(self):
@@ -550,8 +895,10 @@ class QueryLibrary(QueryLibraryCore):
     def anatomical_ind_term_info(self, short_form: list,
                                  *args,
                                  pretty_print=False,
-                                 q_name='Get JSON for Individual'):
-        return query_builder(query_labels=['Individual'],
+                                 q_name='Get JSON for Individual',
+                                 parameterise=False,
+                                 fields=None):
+        return self.query_builder(query_labels=['Individual'],
                              query_short_forms=short_form,
                              clauses=[self.term(),
                                       self.dataSet_license(),
@@ -564,27 +911,35 @@ class QueryLibrary(QueryLibraryCore):
                                       self.def_pubs()
                                       ],
                              q_name=q_name,
-                             pretty_print=pretty_print)  # Is Anatomy label sufficient here
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             fields=fields)  # Is Anatomy label sufficient here
 
     def license_term_info(self, short_form: list,
                           *args,
                           pretty_print=False,
-                          q_name='Get JSON for License'):
-        return query_builder(query_labels=['License'],
+                          q_name='Get JSON for License',
+                          parameterise=False,
+                          fields=None):
+        return self.query_builder(query_labels=['License'],
                              query_short_forms=short_form,
                              clauses=[self.term(
                                  return_extensions=roll_license_return_dict('primary'))],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             fields=fields)
 
     def class_term_info(self, short_form,
                     *args,
                     pretty_print=False,
                     q_name='Get JSON for Class',
-                    additional_clauses=None):
+                    additional_clauses=None,
+                    parameterise=False,
+                    fields=None):
         if additional_clauses is None:
             additional_clauses = []
-        return query_builder(query_labels=['Class'],
+        return self.query_builder(query_labels=['Class'],
                              query_short_forms=short_form,
                              clauses=[self.term(),
                                       self.parents(),
@@ -595,30 +950,42 @@ class QueryLibrary(QueryLibraryCore):
                                       self.pub_syn(),
                                       self.def_pubs()] + additional_clauses,
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             fields=fields)
 
     def neuron_class_term_info(self, short_form,
                                *args,
                                pretty_print=False,
-                               q_name="Get JSON for Neuron Class"):
+                               q_name="Get JSON for Neuron Class",
+                               parameterise=False,
+                               fields=None):
         return self.class_term_info(short_form, *args,
                                 q_name=q_name,
                                 pretty_print=pretty_print,
+                                parameterise=parameterise,
+                                fields=fields,
                                 additional_clauses=[self.neuron_split()])
 
     def split_class_term_info(self, short_form,
                               *args,
                               pretty_print=False,
-                              q_name="Get JSON for Split Class"):
+                              q_name="Get JSON for Split Class",
+                              parameterise=False,
+                              fields=None):
         return self.class_term_info(short_form, *args,
                                 q_name=q_name,
                                 pretty_print=pretty_print,
+                                parameterise=parameterise,
+                                fields=fields,
                                 additional_clauses=[self.split_neuron()])
 
 
     def dataset_term_info(self, short_form: list, *args, pretty_print=False,
-                      q_name='Get JSON for DataSet'):
-        return query_builder(query_labels=['DataSet'],
+                      q_name='Get JSON for DataSet',
+                      parameterise=False,
+                      fields=None):
+        return self.query_builder(query_labels=['DataSet'],
                              query_short_forms=short_form,
                              clauses=[self.term(
                                  return_extensions=
@@ -632,10 +999,14 @@ class QueryLibrary(QueryLibraryCore):
                                  self.dataset_counts()
                              ],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             fields=fields)
 
     def pub_term_info(self, short_form: list, *args, pretty_print=False,
-                           q_name='Get JSON for pub'):
+                           q_name='Get JSON for pub',
+                           parameterise=False,
+                           fields=None):
         return_clause_hack = ", {" \
                              "title: coalesce(([]+primary.title)[0], '') ," \
                              "PubMed: coalesce(([]+primary.PMID)[0], ''), "  \
@@ -643,19 +1014,26 @@ class QueryLibrary(QueryLibraryCore):
                              "DOI: coalesce(([]+primary.DOI)[0], '') }" \
                              "AS pub_specific_content"
 
-        return query_builder(
+        q = self.query_builder(
             query_short_forms=short_form,
             query_labels=['Individual', 'pub'],
             clauses=[self.term(),
                      self.dataSet_license(prel='has_reference')],
             q_name=q_name,
-            pretty_print=pretty_print
-        ) + return_clause_hack
+            pretty_print=pretty_print,
+            parameterise=parameterise,
+            fields=fields
+        )
+        if parameterise:
+            return q[0] + return_clause_hack, q[1]
+        return q + return_clause_hack
 
 
     def template_term_info(self, short_form: list, *args, pretty_print=False,
-                           q_name='Get JSON for Template'):
-        return query_builder(query_labels=['Template'],
+                           q_name='Get JSON for Template',
+                           parameterise=False,
+                           fields=None):
+        return self.query_builder(query_labels=['Template'],
                              query_short_forms=short_form,
                              clauses=[self.term(),
                                       self.template_channel(),
@@ -667,7 +1045,9 @@ class QueryLibrary(QueryLibraryCore):
                                       self.related_individuals()
                                       ],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             fields=fields)
 
     #
 
@@ -680,7 +1060,7 @@ class QueryLibrary(QueryLibraryCore):
             WITH="anat, ep, collect(%s) as pubs" % roll_pub_return("pub"),
             vars=['pubs'],
             node_vars=['anat', 'ep'],
-            RETURN='%s as anatomy, %s AS expression_pattern' % (roll_min_node_info('anat'), roll_min_node_info('ep')))
+            RETURN='%s as anatomy, %s AS expression_pattern' % (self._node('anat'), self._node('ep')))
 
     def ep_2_anat_wrapper(self):
         return Clause(
@@ -691,7 +1071,8 @@ class QueryLibrary(QueryLibraryCore):
             WITH="anat, anoni, %s AS pub" % roll_pub_return("p"),
             vars=['pub'],
             node_vars=['anoni', 'anat'],
-            RETURN='%s AS anatomy' % (roll_min_node_info('anat')))
+            RETURN='%s AS anatomy' % (self._node('anat')),
+            row_key='toString(id(ar))')
 
         # XREFS
 
@@ -702,28 +1083,30 @@ class QueryLibrary(QueryLibraryCore):
                       WITH="distinct ds",
                       vars=[],
                       node_vars=['ds'],
-                      RETURN="%s as dataset" % (roll_min_node_info('ds')))
+                      RETURN="%s as dataset" % (self._node('ds')))
 
     def all_datasets_wrapper(self):
         return Clause(MATCH=Template("MATCH (ds:DataSet)"),
                       WITH="ds",
                       vars=[],
                       node_vars=['ds'],
-                      RETURN="%s as dataset" % (roll_min_node_info('ds')))
+                      RETURN="%s as dataset" % (self._node('ds')))
 
-    def anat_2_ep_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for anat_2_ep query'):
+    def anat_2_ep_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for anat_2_ep query', parameterise=False, page_size=None, cursor=None):
         # we want images of eps (ep, returned by self.anat_2_ep_wrapper())
         aci = self.anatomy_channel_image()
         aci.__setattr__('pvar', 'ep')
-        aci.__setattr__('limit', '')
-        return query_builder(query_labels=['Class'],
+        return self.query_builder(query_labels=['Class'],
                              query_short_forms=short_forms,
                              clauses=[self.anat_2_ep_wrapper(),
                                       aci],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             page_size=page_size,
+                             cursor=cursor)
 
-    def ep_2_anat_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for ep_2_anat query'):
+    def ep_2_anat_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for ep_2_anat query', parameterise=False, page_size=None, cursor=None):
         # columns: anatomy,
         aci = self.anatomy_channel_image()
         # We want images of anat, returned by self.anat_2_ep_wrapper())
@@ -734,41 +1117,46 @@ class QueryLibrary(QueryLibraryCore):
         rel = self.ep_stage()
         rel.__setattr__('pvar', 'anoni')
 
-        return query_builder(query_labels=['Class'],
+        return self.query_builder(query_labels=['Class'],
                              query_short_forms=short_forms,
                              clauses=[self.ep_2_anat_wrapper(),
                                       rel,
                                       aci],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             page_size=page_size,
+                             cursor=cursor)
 
-    def neuron_region_connectivity_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for neuron_region_connectivity query'):
+    def neuron_region_connectivity_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for neuron_region_connectivity query', parameterise=False):
         aci = self.channel_image()
         aci.__setattr__('pvar', 'target')
         parents = self.parents()
         parents.__setattr__('pvar', 'target')
-        return query_builder(query_short_forms=short_forms,
+        return self.query_builder(query_short_forms=short_forms,
                              clauses=[self.term(),  # Not needed?
                                       self.related_individuals_neuron_region(),
                                       parents,
                                       aci],
                             q_name=q_name,
-                            pretty_print=pretty_print)
+                            pretty_print=pretty_print,
+                            parameterise=parameterise)
 
-    def neuron_neuron_connectivity_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for neuron_neuron_connectivity query'):
+    def neuron_neuron_connectivity_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for neuron_neuron_connectivity query', parameterise=False):
         ci = self.channel_image()
         ci.__setattr__('pvar', 'oi')
         parents = self.parents()
         parents.__setattr__('pvar', 'oi')
-        return query_builder(query_short_forms=short_forms,
+        return self.query_builder(query_short_forms=short_forms,
                              clauses=[self.term(),  # Not needed?
                                       self.related_individuals_neuron_neuron(),
                                       parents,
                                       ci],
                             q_name=q_name,
-                            pretty_print=pretty_print)
+                            pretty_print=pretty_print,
+                            parameterise=parameterise)
 
-    def template_2_datasets_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for template_2_datasets query'):
+    def template_2_datasets_query(self, short_forms, *args, pretty_print=False, q_name='Get JSON for template_2_datasets query', parameterise=False, page_size=None, cursor=None):
         aci = self.anatomy_channel_image()
         aci.__setattr__('pvar', 'ds')
         # In the absence of extra tools available for Neo4j3.n
@@ -781,16 +1169,19 @@ class QueryLibrary(QueryLibraryCore):
         li.__setattr__('pvar', 'ds')
         counts = self.dataset_counts()
         counts.__setattr__('pvar', 'ds')
-        return query_builder(query_short_forms=short_forms,
+        return self.query_builder(query_short_forms=short_forms,
                              clauses=[self.template_2_datasets_wrapper(),
                                       aci,  # commenting as too slow w/o limit
                                       pub,
                                       li,
                                       counts],
                             q_name=q_name,
-                            pretty_print=pretty_print)
+                            pretty_print=pretty_print,
+                            parameterise=parameterise,
+                            page_size=page_size,
+                            cursor=cursor)
 
-    def all_datasets_query(self, *args, pretty_print=False, q_name='Get JSON for all_datasets query'):
+    def all_datasets_query(self, *args, pretty_print=False, q_name='Get JSON for all_datasets query', parameterise=False, page_size=None, cursor=None):
         aci = self.anatomy_channel_image()
         aci.__setattr__('pvar', 'ds')
         # In the absence of extra tools available for Neo4j3.n
@@ -803,134 +1194,213 @@ class QueryLibrary(QueryLibraryCore):
         li.__setattr__('pvar', 'ds')
         counts = self.dataset_counts()
         counts.__setattr__('pvar', 'ds')
-        return query_builder(clauses=[self.all_datasets_wrapper(),
+        return self.query_builder(clauses=[self.all_datasets_wrapper(),
                                       aci, # commenting as too slow w/o limit
                                       pub,
                                       li,
                                       counts],
                             q_name=q_name,
-                            pretty_print=pretty_print)
+                            pretty_print=pretty_print,
+                            parameterise=parameterise,
+                            page_size=page_size,
+                            cursor=cursor)
 
-    def anat_image_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat_image query'):
-        return query_builder(query_short_forms=short_forms,
+    def anat_image_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat_image query', parameterise=False, page_size=None, cursor=None):
+        return self.query_builder(query_short_forms=short_forms,
                              query_labels=['Individual'],
                              clauses=[self.term(),
                                       self.channel_image(),
                                       self.image_type()],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise,
+                             page_size=page_size,
+                             cursor=cursor)
 
-    def anat_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat query'):
-        return query_builder(query_short_forms=short_forms,
+    def anat_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat query', parameterise=False):
+        return self.query_builder(query_short_forms=short_forms,
                              query_labels=['Class', 'Anatomy'],
                              clauses=[self.term(),
                                       self.anatomy_channel_image()],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise)
 
-    def anat_scRNAseq_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat_scRNAseq query'):
-        return query_builder(query_short_forms=short_forms,
+    def anat_scRNAseq_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for anat_scRNAseq query', parameterise=False):
+        return self.query_builder(query_short_forms=short_forms,
                              query_labels=['Class', 'Anatomy'],
                              clauses=[self.term(), self.anat_cluster_dataset_pubs()],
                              q_name=q_name,
-                             pretty_print=pretty_print)
+                             pretty_print=pretty_print,
+                             parameterise=parameterise)
 
-    def cluster_expression_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for cluster_expression query'):
-        return query_builder(query_short_forms=short_forms,
+    def cluster_expression_query(self, short_forms: List, *args, pretty_print=False, q_name='Get JSON for cluster_expression query', parameterise=False):
+        return self.query_builder(query_short_forms=short_forms,
                              query_labels=['Individual', 'Cluster'],
                              clauses=[self.term(), self.cluster_expression(), self.cluster_anat()],
                              q_name=q_name,
-                             pretty_print=pretty_print)
-
-def term_info_export(escape='xmi'):
-    # Generate a JSON with TermInto queries
-    ql = QueryLibrary()
-    query_methods = ['anatomical_ind_term_info',
-                     'class_term_info',
-                     'neuron_class_term_info',
-                     'split_class_term_info',
-                     'dataset_term_info',
-                     'license_term_info',
-                     'template_term_info',
-                     'pub_term_info']
-
-    out = {}
+                             pretty_print=pretty_print,
+                             parameterise=parameterise)
+
+class CompiledQueryCache:
+    """Cache of rendered QueryLibrary statements.
+    Each (method, pretty_print, q_name, additional_clauses, fields) combination is
+    rendered once in parameterised form (short_forms as $short_forms).
+    Subsequent calls only bind parameters.  Query labels are fixed
+    per method, so are covered by the method name.
+    hits/misses count cache lookups."""
+
+    def __init__(self, query_library=None):
+        if query_library is None:
+            query_library = QueryLibrary()
+        self.ql = query_library
+        self.hits = 0
+        self.misses = 0
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def key(self, method, kwargs):
+        """Hashable key for a method and its kwargs."""
+        k = [method]
+        for name, value in sorted(kwargs.items()):
+            if name == 'additional_clauses':
+                value = tuple(c.key() for c in value)
+            elif name == 'fields' and value is not None:
+                value = tuple(sorted(value))
+            k.append((name, value))
+        return tuple(k)
+
+    def statement(self, method, **kwargs):
+        """Return the parameterised statement for a QueryLibrary method.
+        kwargs (pretty_print, q_name, additional_clauses, fields) are passed on
+        to the method when rendering."""
+        key = self.key(method, kwargs)
+        with self._lock:
+            if key in self._statements:
+                self.hits += 1
+                return self._statements[key]
+            self.misses += 1
+        q, _ = getattr(self.ql, method)([], parameterise=True, **kwargs)
+        with self._lock:
+            self._statements.setdefault(key, q)
+        return q
+
+    def get(self, method, short_form, **kwargs):
+        """Return (statement, parameters) for a QueryLibrary method
+        with short_form (a list of short_forms) bound as a parameter."""
+        return self.statement(method, **kwargs), {SHORT_FORMS_PARAM: list(short_form)}
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._statements)}
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+TERM_INFO_EXPORT_METHODS = ['anatomical_ind_term_info',
+                            'class_term_info',
+                            'neuron_class_term_info',
+                            'split_class_term_info',
+                            'dataset_term_info',
+                            'license_term_info',
+                            'template_term_info',
+                            'pub_term_info']
+
+MULTI_INPUT_EXPORT_METHODS = ['ep_2_anat_query',
+                              'template_2_datasets_query',
+                              'neuron_region_connectivity_query',
+                              'neuron_neuron_connectivity_query',
+                              'anat_2_ep_query',
+                              'anat_image_query',
+                              'anat_query',
+                              'anat_scRNAseq_query',
+                              'cluster_expression_query']
+
+
+def _statement_forms(q, escape):
+    """Forms of statement q (or (q, parameters)) for an export: (q,) without
+    escape, otherwise the forms from render_statement."""
+    if isinstance(q, tuple):
+        q = q[0]
+    if not escape:
+        return (q,)
+    if escape == 'json':
+        q = q.replace('[$id]', "['$ID']")
+    return render_statement(q)
+
+
+def _export_forms(query_methods, escape, parameterise=False, compact=False, short_forms='[$id]',
+                  by_method=False, cache=None):
+    """Yields (key, digest, forms) for each of query_methods (see _export).
+    With cache (an export_cache.ExportCache), forms of unchanged queries are
+    reused and digest identifies the query; otherwise digest is None."""
+    ql = QueryLibrary(compact=compact)
+    args, kwargs = ([[]], {'parameterise': True}) if parameterise else ([short_forms], {})
     for qm in query_methods:
-        # This whole approach feels a bit hacky...
-        qf = getattr(ql, qm)
-        q_name = qf.__kwdefaults__['q_name']
-        q = qf(short_form='[$id]')
-        if escape == 'xmi' or escape == True:
-            out[q_name] = '&quot;statement&quot;: &quot;' + q.replace('  ',' ').replace('<','&lt;').replace('\n',' ').replace('  ',' ') + '&quot;, &quot;parameters&quot; : { &quot;id&quot; : &quot;$ID&quot; }'
+        key = qm if by_method else getattr(ql, qm).__kwdefaults__['q_name']
+        if cache is None:
+            yield key, None, _statement_forms(getattr(ql, qm)(*args, **kwargs), escape)
         else:
-            if escape == 'json':
-                out[q_name] = '  "' + q_name + '": "' + q.replace('  ',' ').replace('\n',' ').replace('  ',' ').replace('[$id]',"['$ID']") + '",'
-            else:
-                out[q_name] = q
+            digest, forms = cache.forms(ql, qm, args, kwargs, escape,
+                                        lambda q: _statement_forms(q, escape))
+            yield key, digest, forms
+
+
+def _export(query_methods, escape, parameterise=False, compact=False, short_forms='[$id]',
+            by_method=False, cache=None):
+    """Export statements for query_methods (QueryLibrary method names) as JSON.
+    escape: 'xmi' (or True) for the statement and parameters of a geppetto
+    vfb.xmi query, 'json' for a line of a VFB_connect resource file, or
+    False for the statement as generated.
+    by_method: key by method name (rather than q_name), giving statements
+    only, as generated and XML-escaped (&, <, >) unless escape is False.
+    cache: an export_cache.ExportCache, to reuse unchanged statements."""
+    if parameterise:
+        # Shared statement, with short_forms passed as a parameter
+        xmi_parameters = '{ &quot;%s&quot; : [&quot;$ID&quot;] }' % SHORT_FORMS_PARAM
+    else:
+        xmi_parameters = '{ &quot;id&quot; : &quot;$ID&quot; }'
+    out = {}
+    for key, _, forms in _export_forms(query_methods, False if by_method else escape, parameterise=parameterise,
+                                       compact=compact, short_forms=short_forms, by_method=by_method,
+                                       cache=cache):
+        if by_method and escape:
+            out[key] = forms[0].replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            continue
+        if not escape:
+            out[key] = forms[0]
+            continue
+        raw, js, xmi = forms
+        if escape == 'json':
+            out[key] = '  "' + key + '": "' + js + '",'
+        else:
+            out[key] = '&quot;statement&quot;: &quot;' + xmi + '&quot;, &quot;parameters&quot; : ' + xmi_parameters
     return json.dumps(out)
 
-def multi_input_export(escape='json'):
+
+def term_info_export(escape='xmi', parameterise=False, compact=False, cache=None):
+    # Generate a JSON with TermInfo queries
+    return _export(TERM_INFO_EXPORT_METHODS, escape, parameterise=parameterise, compact=compact, cache=cache)
+
+
+def multi_input_export(escape='json', parameterise=False, compact=False, cache=None):
     # Generate a JSON with queries
-    ql = QueryLibrary()
-    query_methods = ['ep_2_anat_query',
-                     'template_2_datasets_query',
-                     'neuron_region_connectivity_query',
-                     'neuron_neuron_connectivity_query',
-                     'anat_2_ep_query',
-                     'anat_image_query',
-                     'anat_query',
-                     'anat_scRNAseq_query',
-                     'cluster_expression_query']
+    return _export(MULTI_INPUT_EXPORT_METHODS, escape, parameterise=parameterise, compact=compact, cache=cache)
 
-    out = {}
-    for qm in query_methods:
-        # This whole approach feels a bit hacky...
-        qf = getattr(ql, qm)
-        q_name = qf.__kwdefaults__['q_name']
-        q = qf(short_forms='[$id]')
-        if escape == 'xmi' or escape == True:
-            out[q_name] = '&quot;statement&quot;: &quot;' + q.replace('  ',' ').replace('<','&lt;').replace('\n',' ').replace('  ',' ') + '&quot;, &quot;parameters&quot; : { &quot;id&quot; : &quot;$ID&quot; }'
-        else:
-            if escape == 'json':
-                out[q_name] = '  "' + q_name + '": "' + q.replace('  ',' ').replace('\n',' ').replace('  ',' ').replace('[$id]',"['$ID']") + '",'
-            else:
-                out[q_name] = q
-    return json.dumps(out)
 
 def results_query_single_input_export(escape=True):
-    # Generate a JSON with TermInto queries
-    ql = QueryLibrary()
-    query_methods = ['ep_2_anat_query',
-                     'template_2_datasets_query',
-                     'neuron_region_connectivity_query']
+    return _export(['ep_2_anat_query',
+                    'template_2_datasets_query',
+                    'neuron_region_connectivity_query'],
+                   escape, short_forms=['$ID'], by_method=True)
 
-    out = {}
-    for qm in query_methods:
-        # This whole approach feels a bit hacky...
-        qf = getattr(ql, qm)
-        q_name = qm
-        q = qf(short_form=['$ID'])
-        if escape:
-            out[q_name] = saxutils.escape(q)
-        else:
-            out[q_name] = q
-    return json.dumps(out)
 
 def results_query_multi_input_export(escape=True):
-    # Generate a JSON with TermInto queries
-    ql = QueryLibrary()
-    query_methods = ['anat_2_ep_query',
-                     'anat_image_query',
-                     'anat_query']
-
-    out = {}
-    for qm in query_methods:
-        # This whole approach feels a bit hacky...
-        qf = getattr(ql, qm)
-        q_name = qm
-        q = qf(short_forms=['$ID'])
-        if escape:
-            out[q_name] = saxutils.escape(q)
-        else:
-            out[q_name] = q
-    return json.dumps(out)
+    return _export(['anat_2_ep_query',
+                    'anat_image_query',
+                    'anat_query'],
+                   escape, short_forms=['$ID'], by_method=True)
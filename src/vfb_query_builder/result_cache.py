@@ -0,0 +1,126 @@
+"""Cache of TermInfo results keyed by (query, short_form, version).
+version combines a graph data version, supplied by the caller (e.g. the
+KB load date), with the query version tag, so bumping either invalidates
+every entry at once."""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from vfb_query_builder import query_roller
+
+
+class TermInfoResultCache:
+    """In-process LRU cache of results with TTL expiry, optionally backed
+    by a SQLite file (path) shared between processes and restarts.
+    max_size: Maximum entries held in memory (least recently used are evicted).
+    max_disk_size: Maximum entries held on disk (oldest are evicted).
+    ttl: Seconds an entry remains valid (None: no expiry).
+    Counters: hits, misses, evictions (size or TTL; an expired entry counts
+    once, though dropped from both tiers), disk_hits (hits served from disk)."""
+
+    def __init__(self, max_size=10000, ttl=24 * 3600, path=None, max_disk_size=None,
+                 data_version='', clock=time.time):
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, version TEXT, stored REAL, value TEXT)")
+            self._db.commit()
+        self.set_data_version(data_version)
+
+    @property
+    def version(self):
+        return "%s:%s" % (self.data_version, query_roller.get_version_tag())
+
+    def set_data_version(self, data_version):
+        """Set the graph data version, invalidating all entries for other versions."""
+        with self._lock:
+            self.data_version = data_version
+            self._entries.clear()
+            if self._db:
+                self._db.execute("DELETE FROM results WHERE version != ?", (self.version,))
+                self._db.commit()
+
+    def _key(self, query, short_form):
+        return json.dumps([query, short_form, self.version])
+
+    def _expired(self, stored):
+        return self.ttl is not None and self.clock() - stored > self.ttl
+
+    def get(self, query, short_form):
+        """Cached result for query (name) and short_form, or None."""
+        key = self._key(query, short_form)
+        expired = False
+        with self._lock:
+            if key in self._entries:
+                stored, value = self._entries[key]
+                if not self._expired(stored):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+                expired = True
+            if self._db:
+                row = self._db.execute("SELECT stored, value FROM results WHERE key = ?", (key,)).fetchone()
+                if row and not self._expired(row[0]):
+                    value = json.loads(row[1])
+                    self._store(key, row[0], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+                if row:
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.evictions += not expired
+            self.misses += 1
+            return None
+
+    def _store(self, key, stored, value):
+        self._entries[key] = (stored, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, query, short_form, value):
+        key = self._key(query, short_form)
+        now = self.clock()
+        with self._lock:
+            self._store(key, now, value)
+            if self._db:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                 (key, self.version, now, json.dumps(value)))
+                if self.max_disk_size:
+                    cur = self._db.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY stored "
+                        "LIMIT max(0, (SELECT count(*) FROM results) - ?))", (self.max_disk_size,))
+                    self.evictions += cur.rowcount
+                self._db.commit()
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'disk_hits': self.disk_hits, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
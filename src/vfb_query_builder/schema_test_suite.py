@@ -1,9 +1,12 @@
 import json
+from dataclasses import dataclass, field
+from typing import List
 from jsonschema import Draft4Validator, RefResolver, SchemaError
 import warnings
 import subprocess
 import os
 import glob
+from urllib.parse import urljoin
 
 
 def get_json_from_file(filename, warn = False):
@@ -16,15 +19,17 @@ def get_json_from_file(filename, warn = False):
     return json.loads(fc)
 
 
-def get_validator(filename, base_uri = ''):
-    """Load schema from JSON file;
-    Check whether it's a valid schema;
-    Return a Draft4Validator object.
-    Optionally specify a base URI for relative path
-    resolution of JSON pointers (This is especially useful
-    for local resolution via base_uri of form file://{some_path}/)
-    """
-   
+# (schema path, base_uri) -> (mtimes, validator)
+_validator_registry = {}
+
+
+def _ref_files(filename):
+    """JSON files alongside a schema (e.g. mod.json) that it may $ref."""
+    d = os.path.dirname(os.path.abspath(filename))
+    return sorted(glob.glob(os.path.join(d, '*.json')))
+
+
+def _build_validator(filename, base_uri):
     schema = get_json_from_file(filename)
     try:
         # Check schema via class method call. Works, despite IDE complaining
@@ -34,24 +39,112 @@ def get_validator(filename, base_uri = ''):
     except SchemaError:
         raise
     if base_uri:
+        # Preload referenced schema files, so $refs are not re-fetched.
+        store = {urljoin(base_uri, os.path.basename(f)): get_json_from_file(f)
+                 for f in _ref_files(filename)}
         resolver = RefResolver(base_uri = base_uri,
-                               referrer = filename)
+                               referrer = schema,
+                               store = store)
     else:
         resolver = None
     return Draft4Validator(schema = schema,
                            resolver = resolver)
 
 
-def validate(validator, instance):
-    """Validate an instance of a schema and report errors."""
+def get_validator(filename, base_uri = '', cache = True):
+    """Load schema from JSON file;
+    Check whether it's a valid schema;
+    Return a Draft4Validator object.
+    Optionally specify a base URI for relative path
+    resolution of JSON pointers (This is especially useful
+    for local resolution via base_uri of form file://{some_path}/)
+    JSON files in the schema directory (e.g. mod.json) are preloaded
+    into the resolver store.
+    If cache is True (default), validators are registered by schema path
+    and base_uri, and the same validator is returned until the schema
+    (or a file in its directory) is modified.
+    """
+    if not cache:
+        return _build_validator(filename, base_uri)
+    key = (os.path.abspath(filename), base_uri)
+    mtimes = tuple(os.path.getmtime(f) for f in [filename] + _ref_files(filename))
+    registered = _validator_registry.get(key)
+    if registered and registered[0] == mtimes:
+        return registered[1]
+    validator = _build_validator(filename, base_uri)
+    _validator_registry[key] = (mtimes, validator)
+    return validator
+
+
+@dataclass
+class ErrorRecord:
+    """A validation error, deduplicated by schema_path.
+    instance_path is that of the first occurrence; count is the number of occurrences.
+    depth: 0 for top level errors, n for errors n levels down in error context
+    (e.g. failing anyOf branches)."""
+    instance_path: str
+    schema_path: str
+    validator: str
+    depth: int
+    message: str
+    count: int = 1
+
+
+@dataclass
+class ValidationReport:
+    """Result of validate().  Truthy if validation passed."""
+    valid: bool
+    errors: List[ErrorRecord] = field(default_factory=list)
+    truncated: bool = False  # True if more than max_errors distinct errors were found
+
+    def __bool__(self):
+        return self.valid
+
+
+def _path(p):
+    return '/'.join(str(x) for x in p)
+
+
+def collect_errors(validator, instance, max_errors=100):
+    """Structured errors for an instance, deduplicated by schema path,
+    with counts.  At most max_errors distinct records are kept.
+    Returns (records, truncated)."""
+    records = {}
+    truncated = False
+    stack = [(e, 0) for e in validator.iter_errors(instance)]
+    stack.reverse()
+    while stack:
+        e, depth = stack.pop()
+        schema_path = _path(e.absolute_schema_path)
+        if schema_path in records:
+            records[schema_path].count += 1
+        elif len(records) < max_errors:
+            records[schema_path] = ErrorRecord(instance_path=_path(e.absolute_path),
+                                               schema_path=schema_path,
+                                               validator=str(e.validator),
+                                               depth=depth,
+                                               message=e.message)
+        else:
+            truncated = True
+        stack.extend(reversed([(c, depth + 1) for c in e.context]))
+    return list(records.values()), truncated
+
+
+def validate(validator, instance, max_errors=100):
+    """Validate an instance of a schema and report errors.
+    Returns a ValidationReport (truthy if validation passes) with
+    structured error records.  Errors are only collected on failure."""
     if validator.is_valid(instance):
         print("Validation Passes")
-        return True
+        return ValidationReport(valid=True)
     else:
-        es = validator.iter_errors(instance)
-        recurse_through_errors(es)
+        errors, truncated = collect_errors(validator, instance, max_errors=max_errors)
+        warnings.warn('\n'.join(
+            ["%s%s x%d at %s: %s (schema path: %s)" % ("  " * r.depth, r.validator, r.count,
+                                                       r.instance_path or '/', r.message, r.schema_path)
+             for r in errors]) + ("\n... more than %d distinct errors" % max_errors if truncated else ''))
         print("Validation Fails")
-        return False
+        return ValidationReport(valid=False, errors=errors, truncated=truncated)
 
 
 def recurse_through_errors(es, level=0):
@@ -63,8 +156,7 @@ def recurse_through_errors(es, level=0):
             "***"*level + " subschema level " + str(level) + "\t".join([str(e.message),
             "Path to error:" + str(e.absolute_schema_path)]) + "\n")
         if e.context:
-            level += 1
-            recurse_through_errors(e.context, level = level)
+            recurse_through_errors(e.context, level = level + 1)
             
 
 def test_local(path_to_schema_dir, schema_file, test_dir):
@@ -0,0 +1,95 @@
+"""Single-flight coalescing of identical concurrent queries.
+While a call for a key is in flight, further calls for the same key wait
+for it and receive its result (or exception) rather than running again.
+Shared results should be treated as read-only."""
+import asyncio
+import json
+import threading
+
+
+def statement_key(statements):
+    """Key for a list of statements (cypher strings or (statement, parameters) tuples)."""
+    return json.dumps([s if isinstance(s, str) else [s[0], s[1]] for s in statements],
+                      sort_keys=True)
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces calls from threads.
+    calls: number of calls run; coalesced: number of calls served by another's result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Coalesces calls from coroutines running on one event loop.
+    The call runs as a task of its own, so cancelling one waiter does not
+    cancel it for the others."""
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _done(self, key, task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved, even if every waiter was cancelled.
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) (a coroutine function), or the call in flight for key."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+
+class CoalescingClient:
+    """Wraps a client (e.g. Neo4jRestClient) so that concurrent identical
+    commits from different threads are sent once."""
+
+    def __init__(self, client):
+        self.client = client
+        self.flight = SingleFlight()
+
+    def commit(self, statements):
+        return self.flight.do(statement_key(statements), self.client.commit, statements)
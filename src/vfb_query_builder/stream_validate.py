@@ -0,0 +1,195 @@
+"""Streaming validation of large result sets.
+Rows are read incrementally from a Neo4j HTTP API JSON response or a
+JSONL file and validated one at a time, so memory use does not grow
+with the size of the input.
+
+Usage: python -m vfb_query_builder.stream_validate schema_file results_file [max_errors]
+"""
+import json
+import sys
+from dataclasses import dataclass, field, asdict
+from typing import List
+from vfb_query_builder.fast_validator import get_validator
+from vfb_query_builder.schema_test_suite import collect_errors
+
+
+class _StreamReader:
+    """Minimal incremental JSON reader over a text file object."""
+
+    ws = ' \t\n\r'
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.ws:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError("Expected %r at offset %d" % (ch, self.pos))
+        self.pos += 1
+
+    def _truncated(self, e):
+        """Whether JSONDecodeError e may be due to the value continuing
+        past the end of the buffer, rather than invalid JSON."""
+        if e.pos >= len(self.buf) or e.msg.startswith('Unterminated string'):
+            return True
+        # A literal ('tru') or \\u escape cut short.  Invalid JSON near the
+        # end of the buffer costs one more read before it is reported.
+        return len(self.buf) - e.pos < 9 and e.msg in ('Expecting value', 'Invalid \\uXXXX escape')
+
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Possibly incomplete: read more and retry, reading twice as
+                # much each time so a large value is decoded O(log n) times.
+                if not self._truncated(e) or not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            # A number may continue into the next chunk.
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return v
+
+    def items(self):
+        """Iterate over the elements of an array, leaving each to the caller to consume."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            c = self.peek()
+            self.pos += 1
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError("Expected ',' or ']' at offset %d" % self.pos)
+
+    def keys(self):
+        """Iterate over the keys of an object, leaving values to the caller to consume."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            k = self.value()
+            self.expect(':')
+            yield k
+            c = self.peek()
+            self.pos += 1
+            if c == '}':
+                return
+            if c != ',':
+                raise ValueError("Expected ',' or '}' at offset %d" % self.pos)
+
+
+def iter_neo4j_rows(f, chunk_size=1 << 16):
+    """Yield rows as dicts (as dict_cursor) from a Neo4j HTTP API
+    JSON response, read incrementally from text file object f.
+    Raises ValueError if the response reports errors."""
+    r = _StreamReader(f, chunk_size)
+    errors = []
+    for key in r.keys():
+        if key == 'results':
+            for _ in r.items():
+                columns = None
+                for rkey in r.keys():
+                    if rkey == 'columns':
+                        columns = r.value()
+                    elif rkey == 'data':
+                        if columns is None:
+                            raise ValueError("'data' precedes 'columns' in results")
+                        for _ in r.items():
+                            for dkey in r.keys():
+                                if dkey == 'row':
+                                    yield dict(zip(columns, r.value()))
+                                else:
+                                    r.value()
+                    else:
+                        r.value()
+        elif key == 'errors':
+            errors = r.value()
+        else:
+            r.value()
+    if errors:
+        raise ValueError('; '.join(e.get('message', '') for e in errors))
+
+
+def iter_jsonl(f):
+    """Yield one JSON document per non-blank line."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+@dataclass
+class StreamValidationResult:
+    total: int = 0
+    passed: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)  # First max_errors errors
+
+    def __bool__(self):
+        return self.failed == 0
+
+
+def validate_rows(rows, validator, max_errors=10):
+    """Validate each row in an iterable, returning aggregate counts
+    and the paths of the first max_errors errors."""
+    result = StreamValidationResult()
+    for i, row in enumerate(rows):
+        result.total += 1
+        if validator.is_valid(row):
+            result.passed += 1
+            continue
+        result.failed += 1
+        if len(result.errors) < max_errors:
+            records, _ = collect_errors(validator, row, max_errors=max_errors - len(result.errors))
+            result.errors.extend(dict(asdict(r), row=i) for r in records)
+    return result
+
+
+def validate_file(schema_file, results_file, max_errors=10, fmt=None, base_uri=''):
+    """Stream-validate the rows of results_file against schema_file.
+    fmt: 'neo4j' (HTTP API response) or 'jsonl'.  By default, guessed
+    from the file extension (.jsonl -> jsonl)."""
+    validator = get_validator(schema_file, base_uri=base_uri)
+    if fmt is None:
+        fmt = 'jsonl' if results_file.endswith('.jsonl') else 'neo4j'
+    with open(results_file, 'r') as f:
+        rows = iter_jsonl(f) if fmt == 'jsonl' else iter_neo4j_rows(f)
+        return validate_rows(rows, validator, max_errors=max_errors)
+
+
+if __name__ == '__main__':
+    r = validate_file(sys.argv[1], sys.argv[2],
+                      max_errors=int(sys.argv[3]) if len(sys.argv) > 3 else 10)
+    print(json.dumps(r.__dict__, indent=2))
+    sys.exit(0 if r else 1)
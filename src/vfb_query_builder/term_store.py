@@ -0,0 +1,285 @@
+"""Materialised TermInfo store.
+A batch job runs the TermInfo query for every term, validates each
+result against vfb_termInfo.json and writes the results to sharded
+JSONL files.  Shards are assigned by hashing short_forms, so each term
+always lands in the same shard.  A sorted, fixed width index maps each
+short_form to (shard, offset, length) and is read via mmap, so lookups
+need no Cypher.
+
+The build is recorded in manifest.json after each shard is written, with
+the shard's fingerprint (its terms and the query version tag) and the
+data version it was built from.  A shard is rebuilt if its fingerprint
+changed or it was built from another data version.  Passing changed=
+(the short_forms whose TermInfo changed, e.g. from a KB diff) with a new
+data version rebuilds only the shards of those terms (and of added or
+removed terms); without it, a new data version rebuilds every shard.
+Re-running an interrupted or repeated build only rebuilds shards not yet
+built for the data version.
+
+Usage: python -m vfb_query_builder.term_store build endpoint out_dir --data_version V [--changed FILE] [--shards N]
+       python -m vfb_query_builder.term_store get out_dir short_form
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from vfb_query_builder import query_roller
+from vfb_query_builder.executor import Neo4jRestClient, TermInfoBatchExecutor, TERM_INFO_METHODS, dict_cursor
+from vfb_query_builder.fast_validator import get_validator
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'json_schema', 'vfb_termInfo.json')
+
+# TermInfo type -> query listing the short_forms of that type
+TERM_LISTS = {'Class': "MATCH (n:Class) RETURN n.short_form AS short_form",
+              'Individual': "MATCH (n:Individual) WHERE NOT (n:Template OR n:DataSet OR n:pub OR n:License) "
+                            "RETURN n.short_form AS short_form",
+              'DataSet': "MATCH (n:DataSet) RETURN n.short_form AS short_form",
+              'Template': "MATCH (n:Template) RETURN n.short_form AS short_form",
+              'pub': "MATCH (n:pub) RETURN n.short_form AS short_form",
+              'License': "MATCH (n:License) RETURN n.short_form AS short_form"}
+
+KEY_SIZE = 64
+INDEX_RECORD = struct.Struct('<%dsHQI' % KEY_SIZE)  # short_form, shard, offset, length
+MANIFEST = 'manifest.json'
+INDEX = 'index.bin'
+
+
+def shard_of(short_form, n_shards):
+    return zlib.crc32(short_form.encode('utf-8')) % n_shards
+
+
+def shard_file(shard):
+    return 'shard_%04d.jsonl' % shard
+
+
+def shard_index_file(shard):
+    return 'shard_%04d.idx.json' % shard
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def list_terms(client):
+    """dict of TermInfo type: list of short_forms, for every term in the KB."""
+    return {t: [r['short_form'] for r in dict_cursor(client.commit([q]))]
+            for t, q in TERM_LISTS.items()}
+
+
+class TermStoreBuilder:
+    """Builds a TermInfo store in out_dir.
+    client: Neo4jRestClient (or compatible) used via TermInfoBatchExecutor.
+    data_version: graph data version the store is built from."""
+
+    def __init__(self, client, out_dir, n_shards=64, data_version='', chunk_size=100,
+                 max_workers=1, validator=None):
+        self.out_dir = out_dir
+        self.n_shards = n_shards
+        self.data_version = data_version
+        self.executor = TermInfoBatchExecutor(client, chunk_size=chunk_size, max_workers=max_workers)
+        self.validator = validator or get_validator(SCHEMA)
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        path = os.path.join(self.out_dir, MANIFEST)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            if manifest['n_shards'] == self.n_shards:
+                return manifest
+        return {'n_shards': self.n_shards, 'shards': {}}
+
+    def _save_manifest(self):
+        _write_atomic(os.path.join(self.out_dir, MANIFEST),
+                      json.dumps(self.manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+    def fingerprint(self, terms):
+        """terms: sorted list of (short_form, type)."""
+        h = hashlib.sha1(json.dumps([query_roller.get_version_tag(), terms]).encode('utf-8'))
+        return h.hexdigest()
+
+    def build(self, terms_by_type, changed=None):
+        """Build (or update) the store for terms_by_type (dict of TermInfo
+        type: short_forms, see list_terms).  changed: short_forms whose
+        TermInfo changed since the data version of the existing build
+        (None: unknown, so all of them if the data version changed).
+        Returns a dict summarising the build: shards built and skipped,
+        terms written, invalid and missing."""
+        shards = {}
+        for term_type, short_forms in terms_by_type.items():
+            if term_type not in TERM_INFO_METHODS:
+                raise ValueError('Unknown TermInfo type: %s' % term_type)
+            for sf in short_forms:
+                if len(sf.encode('utf-8')) > KEY_SIZE:
+                    raise ValueError('short_form longer than %d bytes: %s' % (KEY_SIZE, sf))
+                shards.setdefault(shard_of(sf, self.n_shards), {})[sf] = term_type
+        forced = {shard_of(sf, self.n_shards) for sf in changed or ()}
+        summary = {'built': 0, 'skipped': 0, 'written': 0, 'invalid': [], 'missing': []}
+        for shard in range(self.n_shards):
+            terms = sorted(shards.get(shard, {}).items())
+            fp = self.fingerprint(terms)
+            done = self.manifest['shards'].get(str(shard))
+            if done and done['fingerprint'] == fp \
+                    and os.path.exists(os.path.join(self.out_dir, shard_index_file(shard))) \
+                    and (done.get('data_version') == self.data_version
+                         or changed is not None and shard not in forced):
+                if done.get('data_version') != self.data_version:
+                    done['data_version'] = self.data_version  # Unaffected by the changes.
+                    self._save_manifest()
+                summary['skipped'] += 1
+                continue
+            entry = self._build_shard(shard, terms)
+            entry['fingerprint'] = fp
+            entry['data_version'] = self.data_version
+            self.manifest['shards'][str(shard)] = entry
+            self._save_manifest()
+            summary['built'] += 1
+            summary['written'] += entry['count']
+            summary['invalid'].extend(entry['invalid'])
+            summary['missing'].extend(entry['missing'])
+        self.write_index()
+        return summary
+
+    def _build_shard(self, shard, terms):
+        by_type = {}
+        for sf, term_type in terms:
+            by_type.setdefault(term_type, []).append(sf)
+        results = {}
+        for term_type, short_forms in by_type.items():
+            results.update(self.executor.run(short_forms, term_type))
+        data = bytearray()
+        index, invalid, missing = [], [], []
+        for sf, _ in terms:
+            row = results.get(sf)
+            if row is None:
+                missing.append(sf)
+                continue
+            if not self.validator.is_valid(row):
+                invalid.append(sf)
+                continue
+            line = json.dumps(row).encode('utf-8') + b'\n'
+            index.append([sf, len(data), len(line) - 1])
+            data += line
+        _write_atomic(os.path.join(self.out_dir, shard_file(shard)), bytes(data))
+        _write_atomic(os.path.join(self.out_dir, shard_index_file(shard)), json.dumps(index).encode('utf-8'))
+        return {'count': len(index), 'invalid': invalid, 'missing': missing}
+
+    def write_index(self):
+        """Write the sorted short_form -> (shard, offset, length) index for all built shards."""
+        records = []
+        for shard in self.manifest['shards']:
+            with open(os.path.join(self.out_dir, shard_index_file(int(shard))), 'r') as f:
+                records.extend((sf.encode('utf-8'), int(shard), offset, length)
+                               for sf, offset, length in json.load(f))
+        records.sort()
+        _write_atomic(os.path.join(self.out_dir, INDEX),
+                      b''.join(INDEX_RECORD.pack(*r) for r in records))
+
+
+class TermInfoStore:
+    """Read access to a store built by TermStoreBuilder.
+    get(short_form) costs a binary search of the mmapped index and one
+    slice of an mmapped shard."""
+
+    def __init__(self, path):
+        self.path = path
+        self._files = []
+        self._index = self._mmap(os.path.join(path, INDEX))
+        self._n = len(self._index) // INDEX_RECORD.size if self._index else 0
+        self._shards = {}
+
+    def _mmap(self, path):
+        f = open(path, 'rb')
+        self._files.append(f)
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._n
+
+    def _find(self, short_form):
+        key = short_form.encode('utf-8').ljust(KEY_SIZE, b'\0')
+        lo, hi = 0, self._n
+        size = INDEX_RECORD.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._index[mid * size:mid * size + KEY_SIZE]
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._index[lo * size:lo * size + KEY_SIZE] == key:
+            return INDEX_RECORD.unpack_from(self._index, lo * size)[1:]
+        return None
+
+    def get_raw(self, short_form):
+        """The stored JSON (bytes) for short_form, or None."""
+        loc = self._find(short_form)
+        if loc is None:
+            return None
+        shard, offset, length = loc
+        if shard not in self._shards:
+            self._shards[shard] = self._mmap(os.path.join(self.path, shard_file(shard)))
+        return self._shards[shard][offset:offset + length]
+
+    def get(self, short_form):
+        """The stored TermInfo for short_form, or None."""
+        raw = self.get_raw(short_form)
+        return None if raw is None else json.loads(raw)
+
+    def close(self):
+        for m in [self._index] + list(self._shards.values()):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    b = sub.add_parser('build')
+    b.add_argument('endpoint')
+    b.add_argument('out_dir')
+    b.add_argument('--usr', default='neo4j')
+    b.add_argument('--pwd', default='neo4j')
+    b.add_argument('--shards', type=int, default=64)
+    b.add_argument('--data_version', required=True,
+                   help='Graph data version; a new one rebuilds every shard, or those of --changed')
+    b.add_argument('--changed', default=None,
+                   help='File listing the short_forms whose TermInfo changed, one per line')
+    b.add_argument('--max_workers', type=int, default=4)
+    g = sub.add_parser('get')
+    g.add_argument('store')
+    g.add_argument('short_form')
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        client = Neo4jRestClient(args.endpoint, usr=args.usr, pwd=args.pwd)
+        builder = TermStoreBuilder(client, args.out_dir, n_shards=args.shards,
+                                   data_version=args.data_version, max_workers=args.max_workers)
+        changed = None
+        if args.changed:
+            with open(args.changed, 'r') as f:
+                changed = [line.strip() for line in f if line.strip()]
+        summary = builder.build(list_terms(client), changed=changed)
+        print(json.dumps(summary, indent=2))
+        return 0 if not summary['invalid'] else 1
+    store = TermInfoStore(args.store)
+    raw = store.get_raw(args.short_form)
+    if raw is None:
+        return 1
+    print(raw.decode('utf-8'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
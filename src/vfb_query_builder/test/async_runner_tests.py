@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from vfb_query_builder.async_runner import AsyncQueryRunner
+from vfb_query_builder.executor import Neo4jRestClient, Neo4jQueryError
+
+
+class StubNeo4jHandler(BaseHTTPRequestHandler):
+    """Answers Neo4j HTTP API requests with one canned TermInfo row
+    per $short_forms entry, after server.delay seconds.
+    The first server.fail requests get a 503."""
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            fail = self.server.requests <= self.server.fail
+        time.sleep(self.server.delay)
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        results = []
+        for s in payload['statements']:
+            if 'syntax error' in s['statement']:
+                body = {'results': [], 'errors': [{'code': 'Neo.ClientError.Statement.SyntaxError',
+                                                   'message': 'Invalid input'}]}
+                break
+            results.append({'columns': ['term'],
+                            'data': [{'row': [{'core': {'short_form': sf}}]}
+                                     for sf in s.get('parameters', {}).get('short_forms', [])]})
+        else:
+            body = {'results': results, 'errors': []}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncQueryRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubNeo4jHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.fail = 0
+        self.server.delay = 0.2
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05},
+                         daemon=True).start()
+        self.endpoint = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def test_concurrent_term_info(self):
+        runner = AsyncQueryRunner(self.endpoint, max_in_flight=20)
+        sfs = ['FBbt_%08d' % i for i in range(40)]
+
+        async def collect():
+            return [r async for r in runner.term_info(sfs, 'Class')]
+
+        start = time.time()
+        results = asyncio.run(collect())
+        elapsed = time.time() - start
+        self.assertEqual(sorted(sf for sf, r in results), sfs)
+        self.assertTrue(all(r['term']['core']['short_form'] == sf for sf, r in results))
+        # 40 x 0.2s queries, 20 at a time.
+        self.assertLess(elapsed, 2)
+        self.assertEqual(runner.cache.misses, 1)
+
+    def test_retry(self):
+        self.server.fail = 2
+        self.server.delay = 0
+        runner = AsyncQueryRunner(Neo4jRestClient(self.endpoint), max_in_flight=1,
+                                  retries=3, backoff=0.01)
+        out = runner.run({'a': ('MATCH (n) RETURN n', {'short_forms': ['a']})})
+        self.assertEqual(out, {'a': [{'term': {'core': {'short_form': 'a'}}}]})
+        self.assertEqual(self.server.requests, 3)
+
+    def test_backoff_releases_slot(self):
+        self.server.fail = 1
+        self.server.delay = 0
+        runner = AsyncQueryRunner(Neo4jRestClient(self.endpoint), max_in_flight=1,
+                                  retries=1, backoff=1)
+
+        async def first_done():
+            start = time.time()
+            async for key, rows in runner.stream({'a': ('MATCH (n) RETURN n', {'short_forms': ['a']}),
+                                                  'b': ('MATCH (n) RETURN n', {'short_forms': ['b']})}):
+                return time.time() - start
+
+        # One statement backs off after a 503; the other takes the slot meanwhile.
+        self.assertLess(asyncio.run(first_done()), 0.5)
+
+    def test_flight_outlives_stream(self):
+        self.server.fail = 1
+        self.server.delay = 0
+        statement = {'a': ('MATCH (n) RETURN n', {'short_forms': ['a']})}
+
+        async def main():
+            async with AsyncQueryRunner(self.endpoint, retries=1, backoff=0.2, coalesce=True) as runner:
+                # The first stream is closed while its statement backs off; the second joins it.
+                first = runner.stream(statement)
+                waiter = asyncio.ensure_future(first.__anext__())
+                await asyncio.sleep(0.1)
+                waiter.cancel()
+                await asyncio.gather(waiter, return_exceptions=True)
+                out = await runner.run_all(statement)
+                return out, runner.flight.coalesced
+
+        out, coalesced = asyncio.run(main())
+        self.assertEqual(out, {'a': [{'term': {'core': {'short_form': 'a'}}}]})
+        self.assertEqual((coalesced, self.server.requests), (1, 2))
+
+    def test_reuse(self):
+        self.server.delay = 0
+        with AsyncQueryRunner(self.endpoint, max_in_flight=2) as runner:
+            for sf in ('a', 'b'):
+                out = runner.run({sf: ('MATCH (n) RETURN n', {'short_forms': [sf]})})
+                self.assertEqual(out[sf][0]['term']['core']['short_form'], sf)
+        self.assertIsNone(runner._pool)
+
+    def test_no_retry_on_query_error(self):
+        self.server.delay = 0
+        runner = AsyncQueryRunner(self.endpoint, retries=3, backoff=0.01)
+        self.assertRaises(Neo4jQueryError, runner.run, {'a': 'syntax error'})
+        self.assertEqual(self.server.requests, 1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
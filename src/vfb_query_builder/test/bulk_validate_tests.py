@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+from vfb_query_builder.bulk_validate import bulk_validate, byte_ranges, _iter_lines
+from .schema_test_suite_tests import SCHEMA_DIR, term_info
+
+
+class BulkValidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump = os.path.join(self.tmp.name, 'dump.jsonl')
+        bad_core = term_info('FBbt_00000002')
+        del bad_core['term']['core']['iri']
+        bad_parents = term_info('FBbt_00000003')
+        bad_parents['parents'] = {}
+        with open(self.dump, 'w') as f:
+            for i in range(300):
+                row = [term_info(), bad_core, bad_parents][i % 3]
+                f.write(json.dumps(row) + '\n')
+            f.write('{not json\n')
+
+    def test_ranges_cover_every_line(self):
+        with open(self.dump, 'rb') as f:
+            lines = f.readlines()
+        for chunk_size in (999, 4096, 1 << 20):
+            got = [l for s, e in byte_ranges(self.dump, chunk_size) for o, l in _iter_lines(self.dump, s, e)]
+            self.assertEqual(got, lines)
+
+    def test_bulk_validate(self):
+        report = bulk_validate(os.path.join(SCHEMA_DIR, 'vfb_termInfo.json'), self.dump,
+                               processes=2, chunk_size=4096, max_samples=5)
+        self.assertEqual((report['total'], report['passed'], report['failed']), (301, 100, 201))
+        self.assertEqual(report['errors'],
+                         {'properties/term/properties/core/required': 100,
+                          'properties/parents/type': 100,
+                          '<invalid JSON>': 1})
+        self.assertEqual(len(report['samples']), 5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,272 @@
+import json
+import os
+import tempfile
+import unittest
+from vfb_query_builder import query_roller
+from vfb_query_builder.query_roller import QueryLibrary, CompiledQueryCache, term_info_export
+
+
+class CompiledQueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = QueryLibrary()
+        self.cache = CompiledQueryCache(self.ql)
+
+    def test_parameterised_statement(self):
+        q, p = self.cache.get('class_term_info', ['FBbt_00000591'])
+        self.assertIn('primary.short_form in $short_forms', q)
+        self.assertNotIn('FBbt_00000591', q)
+        self.assertEqual(p, {'short_forms': ['FBbt_00000591']})
+
+    def test_hits_and_misses(self):
+        q1, _ = self.cache.get('class_term_info', ['FBbt_00000591'])
+        q2, p2 = self.cache.get('class_term_info', ['FBbt_00047035'])
+        self.assertIs(q1, q2)
+        self.assertEqual(p2, {'short_forms': ['FBbt_00047035']})
+        self.cache.get('class_term_info', ['FBbt_00000591'], pretty_print=True)
+        self.cache.get('anatomical_ind_term_info', ['VFB_00011179'])
+        self.assertEqual(self.cache.info(), {'hits': 1, 'misses': 3, 'size': 3})
+
+    def test_additional_clauses_key(self):
+        self.cache.get('class_term_info', ['a'], additional_clauses=[self.ql.neuron_split()])
+        self.cache.get('class_term_info', ['b'], additional_clauses=[self.ql.neuron_split()])
+        q, _ = self.cache.get('class_term_info', ['c'], additional_clauses=[self.ql.split_neuron()])
+        self.assertIn('target_neurons', q)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_clear(self):
+        self.cache.get('license_term_info', ['VFBlicense_CC_BY_SA_4_0'])
+        self.cache.clear()
+        self.assertEqual(self.cache.info(), {'hits': 0, 'misses': 0, 'size': 0})
+
+
+class ParameterisedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = QueryLibrary()
+
+    def test_results_query(self):
+        short_forms = ['VFB_%08d' % i for i in range(200)]
+        q, p = self.ql.anat_image_query(short_forms, parameterise=True)
+        self.assertEqual(q, self.ql.anat_image_query(['VFB_00002007'], parameterise=True)[0])
+        self.assertIn('primary.short_form in $short_forms', q)
+        self.assertEqual(p, {'short_forms': short_forms})
+
+    def test_wrapper_query(self):
+        q, p = self.ql.anat_2_ep_query(['FBbt_00050101'], parameterise=True)
+        self.assertIn('anat.short_form in $short_forms', q)
+        self.assertEqual(p, {'short_forms': ['FBbt_00050101']})
+
+    def test_no_short_forms(self):
+        q, p = self.ql.all_datasets_query(parameterise=True)
+        self.assertEqual(p, {})
+
+    def test_pub(self):
+        q, p = self.ql.pub_term_info(['FBrf0221438'], parameterise=True)
+        self.assertTrue(q.endswith('AS pub_specific_content'))
+
+    def test_export(self):
+        queries = json.loads(term_info_export(escape=False, parameterise=True))
+        self.assertEqual(queries['Get JSON for Class'],
+                         self.ql.class_term_info([], parameterise=True)[0])
+
+
+class VersionTagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.version_file = query_roller.VERSION_FILE
+        self.tmp = tempfile.TemporaryDirectory()
+        query_roller.VERSION_FILE = os.path.join(self.tmp.name, 'VERSION')
+        query_roller.get_version_tag.cache_clear()
+
+    def test_stamped_version(self):
+        with open(query_roller.VERSION_FILE, 'w') as f:
+            f.write('abc1234\n')
+        self.assertEqual(query_roller.get_version_tag(), 'abc1234')
+        os.remove(query_roller.VERSION_FILE)
+        # Resolved once per process
+        self.assertEqual(query_roller.get_version_tag(), 'abc1234')
+
+    def test_no_git(self):
+        # No VERSION file and not in a git checkout.
+        self.assertEqual(query_roller.get_version_tag(), 'unknown')
+
+    def tearDown(self):
+        query_roller.VERSION_FILE = self.version_file
+        query_roller.get_version_tag.cache_clear()
+        self.tmp.cleanup()
+
+
+class FieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = QueryLibrary()
+
+    def returned(self, q):
+        return q.split('RETURN ')[-1]
+
+    def test_class_fields(self):
+        q = self.ql.class_term_info(['FBbt_00000591'], fields=['term', 'parents'])
+        self.assertTrue(self.returned(q).endswith(' parents'))
+        self.assertNotIn('apoc.cypher.run', q)
+        self.assertNotIn('has_reference', q)
+        q = self.ql.class_term_info(['FBbt_00000591'], fields=['anatomy_channel_image'])
+        self.assertIn('apoc.cypher.run', q)
+        self.assertNotIn('parents', q)
+        self.assertEqual(self.ql.class_term_info(['FBbt_00000591'], fields=[]).count('MATCH'), 1)
+
+    def test_full_selection_unchanged(self):
+        fields = ['term', 'parents', 'relationships', 'related_individuals', 'xrefs',
+                  'anatomy_channel_image', 'pub_syn', 'def_pubs', 'targeting_splits']
+        self.assertEqual(self.ql.neuron_class_term_info(['a'], fields=fields),
+                         self.ql.neuron_class_term_info(['a']))
+        self.assertTrue(self.returned(self.ql.neuron_class_term_info(['a'], fields=['targeting_splits']))
+                        .endswith('AS version , targeting_splits'))
+
+    def test_node_var_dependencies(self):
+        clauses = [self.ql.term(), self.ql.related_individuals_neuron_region(), self.ql.parents()]
+        clauses[2].pvar = 'target'
+        self.assertEqual(query_roller.select_clauses(clauses, ['parents']), clauses)
+        self.assertEqual(query_roller.select_clauses(clauses, ['synapse_counts']), clauses[:2])
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, self.ql.anatomical_ind_term_info, ['a'], fields=['template_domains'])
+
+    def test_cache_key(self):
+        cache = CompiledQueryCache(self.ql)
+        q1, _ = cache.get('template_term_info', ['a'], fields=['xrefs', 'parents'])
+        q2, _ = cache.get('template_term_info', ['b'], fields=('parents', 'xrefs'))
+        self.assertIs(q1, q2)
+        self.assertNotEqual(q1, cache.get('template_term_info', ['a'])[0])
+
+
+class PageQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = QueryLibrary()
+
+    def test_page_clause(self):
+        q = self.ql.anat_image_query(['VFB_00000001'], page_size=50, cursor='VFB_00000000')
+        self.assertIn('WITH *, primary.short_form AS cursor WHERE cursor > "VFB_00000000" '
+                      'WITH * ORDER BY cursor LIMIT 50', q)
+        self.assertTrue(q.endswith(', cursor, channel_image, parents ORDER BY cursor'))
+        self.assertNotIn('cursor', self.ql.anat_image_query(['VFB_00000001']))
+
+    def test_parameterised(self):
+        q, p = self.ql.ep_2_anat_query(['FBtp0000001'], page_size=10, parameterise=True)
+        self.assertIn("AS pub,toString(id(ar)) AS row_key WITH *, "
+                      "anoni.short_form + ' ' + anat.short_form + ' ' + row_key AS cursor WHERE cursor > $cursor", q)
+        self.assertNotIn('row_key', self.ql.ep_2_anat_query(['FBtp0000001']))
+        self.assertEqual(p, {'short_forms': ['FBtp0000001'], 'cursor': ''})
+        q2, p2 = self.ql.ep_2_anat_query(['FBtp0000001'], page_size=10, cursor='a b', parameterise=True)
+        self.assertEqual(q, q2)
+        self.assertEqual(p2['cursor'], 'a b')
+
+
+class SubqueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chained = QueryLibrary()
+        self.subqueries = QueryLibrary(subqueries=True)
+
+    def test_class_term_info(self):
+        a = self.chained.class_term_info(['FBbt_00000591'], pretty_print=True).split('\n')
+        b = self.subqueries.class_term_info(['FBbt_00000591'], pretty_print=True).split('\n')
+        # Same starting clause and return.
+        self.assertEqual(a[:2], b[:2])
+        self.assertEqual(a[-1], b[-1])
+        calls = [l for l in b if l.startswith('CALL {')]
+        self.assertEqual(len(calls), 7)
+        self.assertEqual(set(calls), {'CALL { WITH primary '})
+        self.assertIn('RETURN anatomy_channel_image } ', b)
+
+    def test_node_vars_imported(self):
+        q = self.subqueries.neuron_region_connectivity_query(['VFB_00000001'])
+        self.assertIn('CALL { WITH primary, target', q)
+        self.assertIn('RETURN synapse_counts, object, target }', q)
+
+    def test_default_unchanged(self):
+        self.assertEqual(self.chained.anat_query(['FBbt_00000591']),
+                         query_roller.QueryLibraryCore.query_builder(
+                             self.chained, clauses=[self.chained.term(), self.chained.anatomy_channel_image()],
+                             query_short_forms=['FBbt_00000591'], query_labels=['Class', 'Anatomy'],
+                             q_name='Get JSON for anat query', pretty_print=False))
+        self.assertNotIn('CALL {', self.chained.template_term_info(['VFB_00017894']))
+
+
+class AnatomyChannelImageTest(unittest.TestCase):
+
+    def test_default(self):
+        q = QueryLibrary().anat_query(['FBbt_00000591'])
+        self.assertIn("[:has_source|SUBCLASSOF|INSTANCEOF*]-(i:Individual)", q)
+        self.assertIn("RETURN template, channel, template_anat, i, irw limit 10', {primary:primary})", q)
+        self.assertNotIn('expandConfig', q)
+
+    def test_bounded(self):
+        ql = QueryLibrary(image_max_depth=3, image_sample_size=5)
+        q = ql.anat_query(['FBbt_00000591'])
+        self.assertIn("INSTANCEOF*..3]-(i:Individual)", q)
+        self.assertIn("irw limit 5'", q)
+        self.assertIn("irw limit 2'", ql.anatomy_channel_image(sample_size=2).get_clause(['primary']))
+        self.assertNotEqual(ql.anatomy_channel_image().key(), QueryLibrary().anatomy_channel_image().key())
+
+    def test_nearest_first(self):
+        q = QueryLibrary(nearest_images=True, image_max_depth=4).anat_query(['FBbt_00000591'])
+        self.assertIn("CALL apoc.path.expandConfig(primary, {relationshipFilter: "
+                      "\"<has_source|<SUBCLASSOF|<INSTANCEOF\"", q)
+        self.assertIn("maxLevel: 4, bfs: true, uniqueness: \"NODE_GLOBAL\"", q)
+        # The expansion streams into the limit; only selected rows are sorted.
+        self.assertIn("MATCH (i)<-[:depicts]- (channel:Individual)", q)
+        self.assertIn("(template_anat:Individual) WITH i, depth, channel, irw, template, template_anat limit 10 "
+                      "WITH i, depth, channel, irw, template, template_anat "
+                      "ORDER BY depth, i.short_form, channel.short_form WITH collect(", q)
+        self.assertNotIn("INSTANCEOF*", q)
+        q = QueryLibrary().anatomy_channel_image(nearest_first=True).get_clause(['primary'])
+        self.assertIn("maxLevel: %d," % query_roller.NEAREST_IMAGE_MAX_DEPTH, q)
+        # Starting labels are still required.
+        q = QueryLibrary(nearest_images=True).ep_2_anat_query(['VFB_1'])
+        self.assertIn("MATCH (anat:Synaptic_neuropil) CALL apoc.path.expandConfig(anat,", q)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, QueryLibrary().anatomy_channel_image, max_depth=0)
+        self.assertRaises(ValueError, QueryLibrary(image_sample_size=0).anat_query, ['FBbt_00000591'])
+
+
+class CompactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = QueryLibrary()
+        self.compact = QueryLibrary(compact=True)
+
+    def test_projections(self):
+        q = self.compact.anatomical_ind_term_info(['VFB_1'])
+        self.assertLess(len(q), len(self.ql.anatomical_ind_term_info(['VFB_1'])))
+        self.assertIn("RETURN{core:primary{.short_form,.iri,label:coalesce(primary.label,'')", q)
+        self.assertIn("THEN[]ELSE COLLECT(DISTINCT o{.short_form,.iri,", q)
+        self.assertIn("channel:channel{.short_form,", q)
+        self.assertIn("template_anatomy:template_anat{.short_form,", q)
+        # Nullable nodes keep the literal map.
+        self.assertIn("imaging_technique:{short_form:technique.short_form,", q)
+        self.assertIn("license:{icon:coalesce(([]+l.license_logo)[0],''),link:coalesce(([]+l.license_url)[0],''),"
+                      "core:{short_form:l.short_form,", q)
+        self.assertNotIn('  ', q)
+
+    def test_whitespace(self):
+        self.assertEqual(query_roller.compact_whitespace(
+            "MATCH (n) \nWHERE n.label = 'a  b , c'  AND n.x <> \"q ' \" RETURN  n.a + ' on ' + n.b"),
+            "MATCH(n)WHERE n.label='a  b , c' AND n.x <> \"q ' \" RETURN n.a+' on '+n.b")
+        q = self.compact.ep_2_anat_query(['FBbt_1'])
+        self.assertIn("link_text:primary.label+' on '+s.label", self.compact.class_term_info(['FBbt_1']))
+        self.assertNotIn('\n', q)
+        q, p = self.compact.class_term_info([], parameterise=True)
+        self.assertIn("primary.short_form in $short_forms WITH", q)
+        self.assertEqual(p, {'short_forms': []})
+
+    def test_export(self):
+        queries = json.loads(term_info_export(escape=False, compact=True))
+        self.assertIn("o{.short_form,.iri,", queries['Get JSON for Class'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
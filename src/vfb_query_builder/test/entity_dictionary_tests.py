@@ -0,0 +1,78 @@
+import unittest
+from vfb_query_builder.entity_dictionary import EntityDictionary, NULL_MIN_NODE, ENTITY_MATCHES
+from vfb_query_builder.query_roller import QueryLibrary
+
+
+def min_node(sf, types=('Entity',)):
+    return {'short_form': sf, 'label': sf.lower(), 'iri': 'http://x/' + sf, 'types': list(types),
+            'unique_facets': [], 'symbol': ''}
+
+
+class EntityStubClient:
+    """Serves entities of each kind; extra entities only via the by-short_form query."""
+
+    def __init__(self, extra=None):
+        self.entities = {'site': {'FlyBase': min_node('FlyBase', ['Site'])},
+                         'license': {'CC_BY': {'icon': 'i', 'link': 'l', 'core': min_node('CC_BY')}},
+                         'template': {'VFB_00017894': min_node('VFB_00017894', ['Template'])},
+                         'technique': {'FBbi_00000001': min_node('FBbi_00000001', ['Class'])}}
+        self.extra = extra or {}
+        self.statements = []
+
+    def commit(self, statements):
+        self.statements.extend(statements)
+        statement = statements[0]
+        if isinstance(statement, str):
+            rows = [[k, sf, e] for k in sorted(self.entities) for sf, e in self.entities[k].items()]
+        else:
+            kind = statement[0].split("'")[1]
+            rows = [[kind, sf, self.extra[sf]] for sf in statement[1]['short_forms'] if sf in self.extra]
+        return [{'columns': ['kind', 'short_form', 'entity'], 'data': [{'row': r} for r in rows]}]
+
+
+class EntityDictionaryTest(unittest.TestCase):
+
+    def test_queries(self):
+        default = QueryLibrary().anatomical_ind_term_info(['VFB_1'])
+        refs = QueryLibrary(entity_refs=True).anatomical_ind_term_info(['VFB_1'])
+        self.assertNotIn('_ref:', default)
+        self.assertIn("{ _ref: ['site', s.short_form] }", refs)
+        self.assertIn("{ _ref: ['template', template_anat.short_form] }", refs)
+        self.assertLess(len(refs), len(default))
+        self.assertIn("{ _ref: ['license', l.short_form] }",
+                      QueryLibrary(entity_refs=True).dataset_term_info(['ds']))
+
+    def test_hydrate(self):
+        client = EntityStubClient()
+        d = EntityDictionary(client)
+        row = {'xrefs': [{'link_base': 'x', 'site': {'_ref': ['site', 'FlyBase']}}],
+               'license': [{'_ref': ['license', 'CC_BY']}, {'_ref': ['license', None]}],
+               'channel_image': [{'image': {'template_anatomy': {'_ref': ['template', 'VFB_00017894']},
+                                            'imaging_technique': {'_ref': ['technique', 'FBbi_00000001']}}}]}
+        out = d.hydrate(row)
+        self.assertEqual(out['xrefs'][0], {'link_base': 'x', 'site': min_node('FlyBase', ['Site'])})
+        self.assertEqual(out['license'], [{'icon': 'i', 'link': 'l', 'core': min_node('CC_BY')},
+                                          {'icon': '', 'link': '', 'core': NULL_MIN_NODE}])
+        self.assertEqual(out['channel_image'][0]['image']['template_anatomy']['types'], ['Template'])
+        self.assertEqual(row['license'][0], {'_ref': ['license', 'CC_BY']})  # Not modified.
+        # A single load query covering every kind.
+        self.assertEqual(len(client.statements), 1)
+        for match in ENTITY_MATCHES.values():
+            self.assertIn(match, client.statements[0])
+        d.hydrate(row)
+        self.assertEqual(len(client.statements), 1)
+
+    def test_refresh_and_missing(self):
+        now = [0]
+        client = EntityStubClient(extra={'VFB_new': min_node('VFB_new', ['Template'])})
+        d = EntityDictionary(client, refresh_interval=10, clock=lambda: now[0])
+        self.assertEqual(d.hydrate({'_ref': ['template', 'VFB_new']})['short_form'], 'VFB_new')
+        self.assertEqual(client.statements[1][1], {'short_forms': ['VFB_new']})
+        self.assertRaises(KeyError, d.hydrate, [{'_ref': ['site', 'Nowhere']}])
+        now[0] = 11
+        d.hydrate([])
+        self.assertEqual(sum(isinstance(s, str) for s in client.statements), 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
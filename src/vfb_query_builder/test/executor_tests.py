@@ -0,0 +1,182 @@
+import re
+import threading
+import time
+import unittest
+from vfb_query_builder.executor import TermInfoBatchExecutor, ChunkedQueryExecutor, dict_cursor, \
+    iter_pages, iter_rows
+
+
+def term_row(sf):
+    return {'term': {'core': {'short_form': sf, 'iri': '', 'label': sf, 'types': []}}}
+
+
+class StubClient:
+    """Stands in for Neo4jRestClient, returning one TermInfo row per
+    requested short_form."""
+
+    def __init__(self, missing=()):
+        self.requests = []
+        self.missing = set(missing)
+        self.lock = threading.Lock()
+
+    def commit(self, statements):
+        with self.lock:
+            self.requests.append(statements)
+        results = []
+        for statement, parameters in statements:
+            results.append({'columns': ['term'],
+                            'data': [{'row': [term_row(sf)['term']]}
+                                     for sf in parameters['short_forms']
+                                     if sf not in self.missing]})
+        return results
+
+
+class TermInfoBatchExecutorTest(unittest.TestCase):
+
+    def test_dict_cursor(self):
+        r = [{'columns': ['a', 'b'], 'data': [{'row': [1, 2]}, {'row': [3, 4]}]},
+             {'columns': ['a'], 'data': []}]
+        self.assertEqual(dict_cursor(r), [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}])
+
+    def test_single_request(self):
+        client = StubClient()
+        ex = TermInfoBatchExecutor(client, chunk_size=10)
+        sfs = ['FBbt_%08d' % i for i in range(5)]
+        out = ex.run(sfs, 'Class')
+        self.assertEqual(list(out), sfs)
+        self.assertEqual(out['FBbt_00000003'], term_row('FBbt_00000003'))
+        self.assertEqual(len(client.requests), 1)
+
+    def test_chunking(self):
+        client = StubClient(missing=['VFB_00000004'])
+        ex = TermInfoBatchExecutor(client, chunk_size=3, chunks_per_request=2, max_workers=4)
+        sfs = ['VFB_%08d' % i for i in range(10)]
+        out = ex.run(sfs + sfs[:2], 'Individual')
+        self.assertEqual(len(out), 10)
+        self.assertIsNone(out['VFB_00000004'])
+        self.assertEqual(out['VFB_00000009'], term_row('VFB_00000009'))
+        # 4 chunks, 2 per request
+        self.assertEqual(sorted(len(r) for r in client.requests), [2, 2])
+        # One statement shared by every chunk.
+        self.assertEqual(len({s for r in client.requests for s, p in r}), 1)
+
+    def test_unknown_type(self):
+        ex = TermInfoBatchExecutor(StubClient())
+        self.assertRaises(ValueError, ex.run, ['a'], 'Neuron')
+
+
+class ChunkStubClient(StubClient):
+    """Returns rows in reverse order, with a duplicate of each row
+    and a latency of per_row seconds per short_form."""
+
+    def __init__(self, per_row=0.0):
+        super().__init__()
+        self.per_row = per_row
+
+    def commit(self, statements):
+        results = super().commit(statements)
+        for r in results:
+            r['data'] = r['data'][::-1] * 2
+        time.sleep(self.per_row * sum(len(p['short_forms']) for _, p in statements))
+        return results
+
+
+class ChunkedQueryExecutorTest(unittest.TestCase):
+
+    def test_merge(self):
+        client = ChunkStubClient()
+        ex = ChunkedQueryExecutor(client, chunk_size=7, max_workers=3, target_latency=1000,
+                                  max_chunk_size=7)
+        sfs = ['FBbt_%08d' % i for i in range(50)]
+        rows = ex.run('anat_query', sfs + sfs[:5])
+        self.assertEqual([r['term']['core']['short_form'] for r in rows], sfs)
+        self.assertEqual(len(client.requests), 8)
+        self.assertRaises(ValueError, ex.run, 'class_term_info', sfs)
+
+    def test_adapt(self):
+        ex = ChunkedQueryExecutor(None, chunk_size=100, target_latency=1.0)
+        self.assertEqual(ex.adapt(100, 4.0), 50)  # At most halved
+        self.assertEqual(ex.adapt(50, 0.8), 62)
+        self.assertEqual(ex.adapt(62, 0.001), 124)  # At most doubled
+        self.assertEqual(ex.adapt(10, 100), 10)  # min_chunk_size
+
+    def test_adaptive_run(self):
+        # 1 ms per short_form: a 20 ms target settles on chunks of ~20.
+        client = ChunkStubClient(per_row=0.001)
+        ex = ChunkedQueryExecutor(client, chunk_size=80, max_workers=2, target_latency=0.02)
+        sfs = ['VFB_%08d' % i for i in range(400)]
+        self.assertEqual(len(ex.run('anat_image_query', sfs)), 400)
+        self.assertLess(ex.chunk_size, 40)
+
+
+class PagedStubClient:
+    """Stands in for Neo4jRestClient, serving pages of n dataset rows
+    according to the cursor parameter and the LIMIT of the statement."""
+
+    def __init__(self, n):
+        self.rows = [{'dataset': {'short_form': 'ds%04d' % i}, 'cursor': 'ds%04d' % i} for i in range(n)]
+        self.requests = []
+
+    def commit(self, statements):
+        results = []
+        for statement, parameters in statements:
+            self.requests.append(parameters)
+            limit = int(re.search(r'LIMIT (\d+)', statement).group(1))
+            page = [r for r in self.rows if r['cursor'] > parameters['cursor']][:limit]
+            results.append({'columns': ['dataset', 'cursor'],
+                            'data': [{'row': [r['dataset'], r['cursor']]} for r in page]})
+        return results
+
+
+class EpAnatStubClient:
+    """Serves ep_2_anat_query pages from rows with several overlaps
+    edges (ar) per (anoni, anat), computing cursors as the statement does."""
+
+    def __init__(self):
+        self.rows = [{'anoni': 'VFB_%04d' % (i // 3), 'anat': 'FBbt_0001', 'ar': i} for i in range(12)]
+
+    def commit(self, statements):
+        results = []
+        for statement, parameters in statements:
+            limit = int(re.search(r'LIMIT (\d+)', statement).group(1))
+            rows = []
+            for r in self.rows:
+                cursor = r['anoni'] + ' ' + r['anat']
+                if 'toString(id(ar)) AS row_key' in statement:
+                    cursor += ' ' + str(r['ar'])
+                rows.append((r, cursor))
+            page = sorted((r for r in rows if r[1] > parameters['cursor']), key=lambda r: r[1])[:limit]
+            results.append({'columns': ['anatomy', 'cursor'],
+                            'data': [{'row': list(r)} for r in page]})
+        return results
+
+
+
+class PaginationTest(unittest.TestCase):
+
+    def test_iter_pages(self):
+        client = PagedStubClient(25)
+        pages = iter_pages(client, 'all_datasets_query', page_size=10)
+        first = next(pages)
+        # Lazy: only the first page has been requested.
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(first[0], {'dataset': {'short_form': 'ds0000'}})
+        self.assertEqual([len(p) for p in pages], [10, 5])
+        self.assertEqual([r['cursor'] for r in client.requests], ['', 'ds0009', 'ds0019'])
+
+    def test_iter_rows(self):
+        client = PagedStubClient(20)
+        rows = list(iter_rows(client, 'template_2_datasets_query', ['VFB_00017894'], page_size=10))
+        self.assertEqual([r['dataset']['short_form'] for r in rows], ['ds%04d' % i for i in range(20)])
+        # Full last page: one more (empty) request.
+        self.assertEqual(len(client.requests), 3)
+        self.assertEqual(client.requests[0]['short_forms'], ['VFB_00017894'])
+
+    def test_iter_rows_cursor_spans_pages(self):
+        # Each (anoni, anat) has 3 rows; pages of 4 split them.
+        rows = list(iter_rows(EpAnatStubClient(), 'ep_2_anat_query', ['FBtp0000001'], page_size=4))
+        self.assertEqual(sorted(r['anatomy']['ar'] for r in rows), list(range(12)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from vfb_query_builder import query_roller, export_cache
+from vfb_query_builder.query_roller import QueryLibrary, term_info_export, multi_input_export
+from vfb_query_builder.export_cache import ExportCache, write_resources, RESOURCE_FILES, MANIFEST
+
+
+template_channel = QueryLibrary.template_channel
+
+
+def edited_template_channel(self):
+    """template_channel with an edited WITH."""
+    c = template_channel(self)
+    c.WITH = c.WITH.replace('{index:', '{edited: true, index:')
+    return c
+
+
+@mock.patch.object(query_roller, 'get_version_tag', lambda: 'v')
+class ExportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def test_same_as_uncached(self):
+        cache = ExportCache(os.path.join(self.dir, 'cache'))
+        for kwargs in ({}, {'escape': 'json'}, {'escape': False}, {'compact': True}, {'parameterise': True}):
+            for f in (term_info_export, multi_input_export):
+                self.assertEqual(f(cache=cache, **kwargs), f(**kwargs))
+        misses = cache.misses
+        # A new cache on the same directory, with a new version, renders nothing.
+        cache = ExportCache(os.path.join(self.dir, 'cache'), version='w')
+        self.assertEqual(json.loads(term_info_export(cache=cache))['Get JSON for pub'],
+                         json.loads(term_info_export())['Get JSON for pub'].replace("'v' AS", "'w' AS"))
+        self.assertEqual((cache.hits, cache.misses), (8, 0))
+        self.assertGreater(misses, 0)
+
+    def test_renderer_change(self):
+        term_info_export(cache=ExportCache(self.dir))
+        # E.g. an edited minify: nothing cached is reused.
+        with mock.patch.object(export_cache, 'RENDERERS', export_cache.RENDERERS[:-1]):
+            cache = ExportCache(self.dir)
+            term_info_export(cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 8))
+
+    def test_write_resources(self):
+        manifest = write_resources(self.dir)
+        self.assertEqual(sorted(manifest['written']), sorted(RESOURCE_FILES))
+        with open(os.path.join(self.dir, 'VFB_TermInfo_queries.json')) as f:
+            statements = json.load(f)
+        self.assertEqual(len(statements), 8)
+        self.assertIn("['$ID']", statements['Get JSON for Template'])
+        self.assertEqual(len(manifest['diff']['VFB_TermInfo_queries.json']['added']), 8)
+        # Unchanged: no files written, no queries changed.
+        manifest = write_resources(self.dir)
+        self.assertEqual(manifest['written'], [])
+        self.assertEqual(manifest['diff']['VFB_TermInfo_queries.json'],
+                         {'added': [], 'changed': [], 'removed': []})
+        # One clause edited: only the query using it changes.
+        with mock.patch.object(QueryLibrary, 'template_channel', edited_template_channel):
+            manifest = write_resources(self.dir)
+        self.assertEqual(manifest['written'], ['VFB_TermInfo_queries.json'])
+        self.assertEqual(manifest['diff']['VFB_TermInfo_queries.json']['changed'], ['Get JSON for Template'])
+        self.assertEqual(manifest['diff']['VFB_results_multi_input.json']['changed'], [])
+        with open(os.path.join(self.dir, MANIFEST)) as f:
+            self.assertEqual(json.load(f)['digests'], manifest['digests'])
+        # A new version: every statement returns it, so every query changed.
+        manifest = write_resources(self.dir, version='w')
+        self.assertEqual((manifest['version'], manifest['previous_version']), ('w', 'v'))
+        self.assertEqual(len(manifest['diff']['VFB_TermInfo_queries.json']['changed']), 8)
+        self.assertEqual(sorted(manifest['written']), sorted(RESOURCE_FILES))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
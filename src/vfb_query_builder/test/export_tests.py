@@ -0,0 +1,76 @@
+import json
+import unittest
+from unittest import mock
+from xml.sax import saxutils
+from vfb_query_builder import query_roller
+from vfb_query_builder.query_roller import QueryLibrary, minify, render_statement, term_info_export, multi_input_export, \
+    results_query_single_input_export, results_query_multi_input_export
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_literals_preserved(self):
+        s = "MATCH (n) \n  WHERE n.label = 'a  b\n c' AND n.x = \"it's  \\\"q\\\"\" RETURN `odd  name`"
+        self.assertEqual(minify(s), "MATCH (n) WHERE n.label = 'a  b\n c' AND n.x = \"it's  \\\"q\\\"\" "
+                                    "RETURN `odd  name`")
+        self.assertEqual(minify("RETURN { a : 'x , y' }", compact=True), "RETURN{a:'x , y'}")
+
+    def test_single_quoted(self):
+        # Split on quotes, without the literal regex.
+        self.assertEqual(minify(" a  'b  c'  =  ''  d "), "a 'b  c' = '' d")
+        self.assertEqual(minify(" a  'b  c'  =  ''  d ", compact=True), "a 'b  c'='' d")
+
+    def test_unterminated_literal(self):
+        self.assertEqual(minify("RETURN  'a  b"), "RETURN 'a  b")
+
+    def test_nul(self):
+        self.assertEqual(minify("RETURN  '  ' +\0  x"), "RETURN '  ' +\0 x")
+
+
+class RenderStatementTest(unittest.TestCase):
+
+    def test_forms(self):
+        raw, js, xmi = render_statement('MATCH (n) WHERE n.l = "a\\b" \n RETURN  \'<&>\t\'')
+        self.assertEqual(raw, 'MATCH (n) WHERE n.l = "a\\b" RETURN \'<&>\t\'')
+        self.assertEqual(json.loads('"%s"' % js), raw)
+        self.assertEqual(xmi, 'MATCH (n) WHERE n.l = \\&quot;a\\\\b\\&quot; RETURN \'&lt;&amp;>\\u0009\'')
+
+
+@mock.patch.object(query_roller, 'get_version_tag', lambda: 'v')
+class ExportTest(unittest.TestCase):
+
+    def test_xmi(self):
+        out = json.loads(term_info_export())
+        self.assertIn('Get JSON for Class', out)
+        for v in out.values():
+            self.assertTrue(v.startswith('&quot;statement&quot;: &quot;MATCH'))
+            self.assertNotIn('<', v)
+            self.assertNotIn('\n', v)
+
+    def test_json(self):
+        for line in json.loads(multi_input_export()).values():
+            name, statement = json.loads('{' + line.rstrip(',') + '}').popitem()
+            self.assertIn("['$ID']", statement)
+            self.assertEqual(minify(statement), statement)
+
+    def test_results_exports(self):
+        self.assertEqual(set(json.loads(results_query_single_input_export())),
+                         {'ep_2_anat_query', 'template_2_datasets_query', 'neuron_region_connectivity_query'})
+        out = json.loads(results_query_multi_input_export())
+        # The statement as generated, XML-escaped.
+        self.assertEqual(out['anat_query'], saxutils.escape(QueryLibrary().anat_query(['$ID'])))
+        self.assertIn("in ['$ID']", out['anat_query'])
+        self.assertEqual(json.loads(results_query_multi_input_export(escape=False))['anat_query'],
+                         QueryLibrary().anat_query(['$ID']))
+
+    def test_one_path(self):
+        with mock.patch.object(query_roller, '_export', return_value='{}') as export:
+            term_info_export()
+            multi_input_export()
+            results_query_single_input_export()
+            results_query_multi_input_export()
+        self.assertEqual(export.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
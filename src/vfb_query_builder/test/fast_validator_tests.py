@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+from vfb_query_builder.fast_validator import FastValidator, get_validator, generate_source, validate
+from vfb_query_builder.schema_test_suite import get_validator as get_jsonschema_validator
+from .schema_test_suite_tests import SCHEMA_DIR, term_info, min_node
+
+
+class FastValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_uri = 'file://' + os.path.abspath(SCHEMA_DIR) + '/'
+        self.schema = os.path.join(SCHEMA_DIR, 'vfb_termInfo.json')
+        self.fv = get_validator(self.schema, base_uri=self.base_uri)
+        self.jv = get_jsonschema_validator(self.schema, base_uri=self.base_uri)
+
+    def assertAgrees(self, instance, expected):
+        self.assertEqual(self.jv.is_valid(instance), expected)
+        self.assertEqual(self.fv.is_valid(instance), expected)
+
+    def test_valid(self):
+        self.assertAgrees(term_info(n_images=50), True)
+        self.assertTrue(validate(self.fv, term_info()))
+
+    def test_invalid(self):
+        d = term_info()
+        del d['term']['core']['label']
+        self.assertAgrees(d, False)
+        self.assertFalse(validate(self.fv, d))
+        d = term_info()
+        d['unknown_section'] = []
+        self.assertAgrees(d, False)
+        d = term_info()
+        d['anatomy_channel_image'][0]['channel_image']['image']['index'] = [1, 2]
+        self.assertAgrees(d, False)
+        d = term_info()
+        d['parents'].append(dict(min_node('FBbt_00000003'), short_form=3))
+        self.assertAgrees(d, False)
+        d = term_info()
+        d['anatomy_channel_image'][0]['channel_image']['image']['index'] = [True]
+        self.assertAgrees(d, False)
+
+    def test_registry(self):
+        self.assertIs(self.fv, get_validator(self.schema, base_uri=self.base_uri))
+
+    def test_generate_source(self):
+        namespace = {}
+        exec(generate_source(SCHEMA_DIR), namespace)
+        self.assertTrue(namespace['is_valid_vfb_termInfo'](term_info()))
+        self.assertFalse(namespace['is_valid_vfb_query']({'xrefs': []}))
+
+    def test_empty_additional_properties(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'schema.json')
+            with open(path, 'w') as f:
+                json.dump({'type': 'object', 'additionalProperties': {},
+                           'properties': {'a': {'additionalProperties': {'type': 'string'}}}}, f)
+            fv = FastValidator(path)
+        self.assertTrue(fv.is_valid({'a': {'b': 'c'}, 'x': 1}))
+        self.assertFalse(fv.is_valid({'a': {'b': 1}}))
+        self.assertFalse(fv.is_valid([]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,38 @@
+import json
+import unittest
+from vfb_query_builder.bench.interning_bench import anat_image_rows
+from vfb_query_builder.interning import normalise, expand, intern_rows, ENTITY_KEY
+
+
+class InterningTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = anat_image_rows(100)
+
+    def test_normalise_expand(self):
+        payload = normalise(self.rows)
+        # Templates, template channels, technique, datasets and license; not per-row terms/channels.
+        self.assertEqual(len(payload['entities']), 4 + 4 + 1 + 20 + 1)
+        image = payload['rows'][0]['channel_image'][0]
+        self.assertEqual(image['imaging_technique'], {ENTITY_KEY: 0})
+        self.assertEqual(image['channel']['short_form'], 'VFBc_00000000')
+        self.assertLess(len(json.dumps(payload)), len(json.dumps(self.rows)) / 2)
+        self.assertEqual(expand(json.loads(json.dumps(payload))), self.rows)
+        expanded = expand(payload)
+        self.assertIsNot(expanded[0]['channel_image'][0]['imaging_technique'],
+                         expanded[1]['channel_image'][0]['imaging_technique'])
+        shared = expand(payload, share=True)
+        self.assertIs(shared[0]['channel_image'][0]['imaging_technique'],
+                      shared[1]['channel_image'][0]['imaging_technique'])
+
+    def test_intern_rows(self):
+        rows = intern_rows(json.loads(json.dumps(self.rows)))
+        self.assertEqual(rows, self.rows)
+        self.assertIs(rows[0]['dataset_license'][0]['license'], rows[1]['dataset_license'][0]['license'])
+        self.assertIs(rows[0]['channel_image'][0]['image']['template_anatomy'],
+                      rows[4]['channel_image'][0]['image']['template_anatomy'])
+        self.assertIsNot(rows[0]['term'], rows[1]['term'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,54 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from vfb_query_builder.materialise import subclass_depth_script, exemplar_image_script, main
+from vfb_query_builder.query_roller import QueryLibrary, NEAREST_IMAGE_MAX_DEPTH
+
+
+class MaterialiseTest(unittest.TestCase):
+
+    def test_subclass_depth(self):
+        s = subclass_depth_script()
+        self.assertTrue(s.startswith("CALL apoc.periodic.iterate('MATCH (o:Class) RETURN o', "))
+        # Same pattern as parents().
+        self.assertIn("OPTIONAL MATCH p=(o)<-[:SUBCLASSOF*..5]-(:Class) WITH o, MAX(length(p)) AS depth "
+                      "SET o.subclass_depth = depth'", s)
+        self.assertIn("p=(o)<-[:SUBCLASSOF*..5]-(:Class)", QueryLibrary().class_term_info(['FBbt_1']))
+
+    def test_exemplar_images(self):
+        s = exemplar_image_script(sample_size=3, max_depth=4)
+        self.assertEqual(s.count("'"), 4)  # Only the iterate statement quotes.
+        self.assertIn("OPTIONAL MATCH (t)-[old:has_exemplar_image]->() DELETE old", s)
+        self.assertIn("CALL { WITH t MATCH (t) CALL apoc.path.expandConfig(t, ", s)
+        self.assertIn("maxLevel: 4", s)
+        self.assertIn("template_anat limit 3 ", s)
+        self.assertIn("maxLevel: %d," % NEAREST_IMAGE_MAX_DEPTH, exemplar_image_script())
+        self.assertIn("MERGE (t)-[e:has_exemplar_image]->(channel) SET e.rank = rank", s)
+        s = exemplar_image_script(nearest_first=False)
+        self.assertIn("CALL { WITH t OPTIONAL MATCH (t)<- [:has_source|SUBCLASSOF|INSTANCEOF*]-", s)
+        self.assertIn("irw limit 10 }", s)
+
+    def test_materialised_clauses(self):
+        ql = QueryLibrary(materialised=True)
+        q = ql.class_term_info(['FBbt_1'])
+        self.assertIn("WITH *, o.subclass_depth AS max_chain_length ORDER BY max_chain_length ASC", q)
+        self.assertNotIn("SUBCLASSOF*", q)
+        self.assertNotIn("apoc.cypher.run", q)
+        self.assertIn("OPTIONAL MATCH (primary)-[e:has_exemplar_image]->(channel:Individual)", q)
+        self.assertIn("WHERE e.rank < 10 ", q)
+        c = ql.anatomy_channel_image(sample_size=2).get_clause(['primary'])
+        self.assertIn("CALL { WITH primary OPTIONAL MATCH (primary)-[e:has_exemplar_image]->", c)
+        # At most sample_size rows, in rank order, though a channel may have several templates.
+        self.assertIn("WHERE e.rank < 2 RETURN template, channel, template_anat, i, irw ORDER BY e.rank limit 2 }", c)
+        self.assertIn("(anat:Synaptic_neuropil)-[e:has_exemplar_image]->", ql.ep_2_anat_query(['FBbt_1']))
+        self.assertIn("MAX(length(p))", QueryLibrary().parents(materialised=False).MATCH.template)
+
+    def test_main(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(main(['--sample_size', '5']), 0)
+        self.assertEqual(out.getvalue().count('CALL apoc.periodic.iterate'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
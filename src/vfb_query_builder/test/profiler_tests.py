@@ -0,0 +1,63 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from vfb_query_builder.executor import Neo4jQueryError
+from vfb_query_builder.profiler import prefix_queries, profile_query, format_table, \
+    RecordedClient, RecordingClient, main
+
+
+def record(method, short_forms):
+    """Synthetic PROFILE results for each prefix of method: prefix i costs
+    10**i db hits, split over a child operator."""
+    recording = {}
+    for i, (name, (statement, parameters)) in enumerate(prefix_queries(method, short_forms)):
+        hits = 10 ** i
+        recording['PROFILE ' + statement] = {
+            'columns': ['term'], 'data': [{'row': [{}]}],
+            'profile': {'name': 'ProduceResults', 'dbHits': 0, 'rows': 1,
+                        'children': [{'name': 'Expand', 'dbHits': hits, 'rows': 1, 'children': []}]}}
+    return recording
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_prefix_queries(self):
+        qs = prefix_queries('class_term_info', ['FBbt_00000591'])
+        self.assertEqual([n for n, q in qs],
+                         ['primary', 'parents', 'relationships', 'related_individuals', 'xrefs',
+                          'anatomy_channel_image', 'pub_syn', 'def_pubs'])
+        self.assertTrue(qs[0][1][0].startswith('MATCH (primary:Class)'))
+        self.assertEqual(qs[0][1][1], {'short_forms': ['FBbt_00000591']})
+        # Each prefix extends the last.
+        for (_, (a, _)), (_, (b, _)) in zip(qs, qs[1:]):
+            self.assertTrue(b.startswith(a.split(' RETURN ')[0]))
+        self.assertEqual(prefix_queries('neuron_class_term_info', ['FBbt_00000591'])[-1][0],
+                         'targeting_splits')
+
+    def test_profile_query(self):
+        client = RecordedClient(record('anatomical_ind_term_info', ['VFB_00011179']))
+        report = profile_query(client, 'anatomical_ind_term_info', ['VFB_00011179'])
+        self.assertEqual(len(report), 9)
+        self.assertEqual([r['db_hits'] for r in report[:3]], [1, 9, 90])
+        self.assertEqual(report[-1]['cumulative_db_hits'], 10 ** 8)
+        self.assertEqual(report[0]['rows'], 1)
+        self.assertIn('def_pubs', format_table(report).split('\n')[-1])
+
+    def test_record_replay(self):
+        recorder = RecordingClient(RecordedClient(record('license_term_info', ['a'])))
+        profile_query(recorder, 'license_term_info', ['a'])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'recording.json')
+            recorder.save(path)
+            out = io.StringIO()
+            with redirect_stdout(out):
+                main(['-', 'license_term_info', 'a', '--json', '--replay', path])
+            self.assertEqual(json.loads(out.getvalue())[0]['clause'], 'primary')
+        self.assertRaises(Neo4jQueryError, profile_query, RecordedClient({}), 'license_term_info', ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+from vfb_query_builder import query_roller
+from vfb_query_builder.executor import TermInfoBatchExecutor
+from vfb_query_builder.result_cache import TermInfoResultCache
+from .executor_tests import StubClient, term_row
+
+
+class Clock:
+
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+class TermInfoResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite')
+
+    def test_lru(self):
+        c = TermInfoResultCache(max_size=2, clock=self.clock)
+        c.put('q', 'a', {'a': 1})
+        c.put('q', 'b', {'b': 1})
+        self.assertEqual(c.get('q', 'a'), {'a': 1})
+        c.put('q', 'c', {'c': 1})  # Evicts b, least recently used.
+        self.assertIsNone(c.get('q', 'b'))
+        self.assertIsNone(c.get('other_query', 'a'))
+        self.assertEqual(c.info(), {'hits': 1, 'misses': 2, 'evictions': 1, 'disk_hits': 0, 'size': 2})
+
+    def test_ttl(self):
+        c = TermInfoResultCache(ttl=10, clock=self.clock)
+        c.put('q', 'a', 1)
+        self.clock.t = 5
+        self.assertEqual(c.get('q', 'a'), 1)
+        self.clock.t = 11
+        self.assertIsNone(c.get('q', 'a'))
+        self.assertEqual(c.evictions, 1)
+
+    def test_ttl_disk(self):
+        c = TermInfoResultCache(ttl=10, path=self.path, clock=self.clock)
+        c.put('q', 'a', 1)
+        c.put('q', 'b', 2)
+        self.clock.t = 11
+        # Expired in both tiers: one eviction.
+        self.assertIsNone(c.get('q', 'a'))
+        self.assertEqual(c.info(), {'hits': 0, 'misses': 1, 'evictions': 1, 'disk_hits': 0, 'size': 1})
+        c._entries.clear()  # Expired on disk only.
+        self.assertIsNone(c.get('q', 'b'))
+        self.assertEqual(c.info(), {'hits': 0, 'misses': 2, 'evictions': 2, 'disk_hits': 0, 'size': 0})
+        c.close()
+
+    def test_versions(self):
+        c = TermInfoResultCache(data_version='2024-01', clock=self.clock)
+        c.put('q', 'a', 1)
+        c.set_data_version('2024-02')
+        self.assertIsNone(c.get('q', 'a'))
+        c.put('q', 'a', 2)
+        # A new query version tag also invalidates.
+        tag = query_roller.get_version_tag
+        query_roller.get_version_tag = lambda: 'new_tag'
+        try:
+            self.assertIsNone(c.get('q', 'a'))
+        finally:
+            query_roller.get_version_tag = tag
+        self.assertEqual(c.get('q', 'a'), 2)
+
+    def test_disk(self):
+        c = TermInfoResultCache(max_size=1, path=self.path, clock=self.clock)
+        c.put('q', 'a', {'x': [1]})
+        c.put('q', 'b', {'x': [2]})
+        c.close()
+        c = TermInfoResultCache(path=self.path, clock=self.clock)
+        self.assertEqual(c.get('q', 'a'), {'x': [1]})
+        self.assertEqual(c.get('q', 'a'), {'x': [1]})
+        self.assertEqual(c.disk_hits, 1)
+        c.set_data_version('v2')
+        self.assertIsNone(c.get('q', 'b'))
+        c.close()
+
+    def test_disk_size(self):
+        c = TermInfoResultCache(path=self.path, max_disk_size=2, clock=self.clock)
+        for i, sf in enumerate('abc'):
+            self.clock.t = i
+            c.put('q', sf, i)
+        c._entries.clear()  # Read from disk
+        self.assertIsNone(c.get('q', 'a'))
+        self.assertEqual(c.get('q', 'c'), 2)
+        c.close()
+
+    def test_executor(self):
+        client = StubClient()
+        ex = TermInfoBatchExecutor(client, result_cache=TermInfoResultCache(clock=self.clock))
+        ex.run(['a', 'b'], 'Class')
+        out = ex.run(['a', 'b', 'c'], 'Class')
+        self.assertEqual(out['c'], term_row('c'))
+        self.assertEqual(client.requests[-1][0][1], {'short_forms': ['c']})
+        ex.run(['a'], 'Class', q_name='Other')
+        self.assertEqual(client.requests[-1][0][1], {'short_forms': ['a']})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
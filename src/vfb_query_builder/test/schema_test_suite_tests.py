@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+from jsonschema import Draft4Validator
+from vfb_query_builder.schema_test_suite import get_validator, validate, collect_errors
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'json_schema')
+
+
+def min_node(sf, types=('Entity',)):
+    return {'short_form': sf, 'iri': 'http://example.org/' + sf,
+            'label': sf, 'types': list(types), 'unique_facets': [], 'symbol': ''}
+
+
+def term_info(sf='FBbt_00000001', n_images=1):
+    image = {'anatomy': min_node('VFB_00000001'),
+             'channel_image': {'channel': min_node('VFBc_00000001'),
+                               'imaging_technique': min_node('FBbi_00000001'),
+                               'image': {'template_channel': min_node('VFBc_00017894'),
+                                         'template_anatomy': min_node('VFB_00017894'),
+                                         'image_folder': 'http://example.org/', 'index': []}}}
+    return {'term': {'core': min_node(sf, ('Class', 'Anatomy')),
+                     'description': ['A term'], 'comment': []},
+            'parents': [min_node('FBbt_00000002')],
+            'anatomy_channel_image': [image] * n_images,
+            'query': 'Get JSON for Class', 'version': 'abc1234'}
+
+
+class ValidatorRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for f in ['mod.json', 'vfb_termInfo.json', 'vfb_query.json']:
+            shutil.copy(os.path.join(SCHEMA_DIR, f), self.tmp.name)
+        self.schema = os.path.join(self.tmp.name, 'vfb_termInfo.json')
+        self.base_uri = 'file://' + self.tmp.name + '/'
+
+    def test_valid(self):
+        v = get_validator(self.schema, base_uri=self.base_uri)
+        self.assertTrue(validate(v, term_info()))
+        bad = term_info()
+        del bad['term']['core']['iri']
+        self.assertFalse(validate(v, bad))
+
+    def test_refs_preloaded(self):
+        v = get_validator(self.schema, base_uri=self.base_uri)
+        self.assertIn(self.base_uri + 'mod.json', v.resolver.store)
+
+    def test_registry(self):
+        v1 = get_validator(self.schema, base_uri=self.base_uri)
+        v2 = get_validator(self.schema, base_uri=self.base_uri)
+        self.assertIs(v1, v2)
+        self.assertIsNot(v1, get_validator(self.schema, base_uri=self.base_uri, cache=False))
+        # Editing a referenced schema invalidates.
+        mod = os.path.join(self.tmp.name, 'mod.json')
+        t = time.time() + 10
+        os.utime(mod, (t, t))
+        self.assertIsNot(v1, get_validator(self.schema, base_uri=self.base_uri))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class ErrorReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.v = get_validator(os.path.join(SCHEMA_DIR, 'vfb_termInfo.json'),
+                               base_uri='file://' + os.path.abspath(SCHEMA_DIR) + '/')
+
+    def test_dedupe(self):
+        d = term_info(n_images=500)
+        d['anatomy_channel_image'] = [dict(i, anatomy={}) for i in d['anatomy_channel_image']]
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            r = validate(self.v, d)
+        self.assertFalse(r)
+        self.assertEqual(len(w), 1)
+        self.assertEqual(len(r.errors), 1)
+        e = r.errors[0]
+        # One per missing required key (4) per entry.
+        self.assertEqual((e.validator, e.count, e.depth), ('required', 2000, 0))
+        self.assertEqual(e.instance_path, 'anatomy_channel_image/0/anatomy')
+
+    def test_cap(self):
+        d = term_info()
+        d['term']['core'] = {}
+        d['parents'] = {}
+        records, truncated = collect_errors(self.v, d, max_errors=1)
+        self.assertEqual(len(records), 1)
+        self.assertTrue(truncated)
+        records, truncated = collect_errors(self.v, d)
+        self.assertEqual(len(records), 2)
+        self.assertFalse(truncated)
+
+    def test_depth(self):
+        v = Draft4Validator({'anyOf': [{'type': 'string'}, {'type': 'integer'}]})
+        records, _ = collect_errors(v, [])
+        self.assertEqual([(r.validator, r.depth) for r in records],
+                         [('anyOf', 0), ('type', 1), ('type', 1)])
+
+    def test_valid_report(self):
+        r = validate(self.v, term_info())
+        self.assertTrue(r)
+        self.assertEqual(r.errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
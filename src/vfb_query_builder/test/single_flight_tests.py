@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from vfb_query_builder.async_runner import AsyncQueryRunner
+from vfb_query_builder.executor import Neo4jQueryError, TermInfoBatchExecutor
+from vfb_query_builder.single_flight import SingleFlight, AsyncSingleFlight, CoalescingClient
+from .executor_tests import StubClient
+
+
+class SlowClient(StubClient):
+    """StubClient taking delay seconds per commit, counting commits per short_form.
+    Commits for short_form 'bad' raise Neo4jQueryError."""
+
+    def __init__(self, delay=0.1):
+        super().__init__()
+        self.delay = delay
+
+    def commit(self, statements):
+        time.sleep(self.delay)
+        if any('bad' in p['short_forms'] for _, p in statements):
+            with self.lock:
+                self.requests.append(statements)
+            raise Neo4jQueryError('boom')
+        return super().commit(statements)
+
+    def count(self, sf):
+        return sum(1 for r in self.requests for _, p in r if p['short_forms'] == [sf])
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_threads(self):
+        client = SlowClient()
+        coalescing = CoalescingClient(client)
+        ex = TermInfoBatchExecutor(coalescing)
+        keys = ['FBbt_00000001', 'FBbt_00000002', 'bad']
+        barrier = threading.Barrier(300)
+
+        def lookup(i):
+            barrier.wait()
+            try:
+                return ex.run([keys[i % 3]], 'Class')
+            except Neo4jQueryError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=300) as pool:
+            results = list(pool.map(lookup, range(300)))
+        self.assertEqual([client.count(k) for k in keys], [1, 1, 1])
+        self.assertEqual(coalescing.flight.calls, 3)
+        self.assertEqual(coalescing.flight.coalesced, 297)
+        # Every waiter gets the leader's result or exception.
+        self.assertEqual({r['FBbt_00000001']['term']['core']['short_form'] for r in results[::3]},
+                         {'FBbt_00000001'})
+        self.assertEqual(len({id(e) for e in results[2::3]}), 1)
+        # Later calls run again.
+        ex.run(['FBbt_00000001'], 'Class')
+        self.assertEqual(client.count('FBbt_00000001'), 2)
+
+    def test_sequential_not_coalesced(self):
+        sf = SingleFlight()
+        self.assertEqual([sf.do('k', lambda: i) for i in range(3)], [0, 1, 2])
+        self.assertEqual(sf.calls, 3)
+
+    def test_asyncio(self):
+        client = SlowClient()
+        runner = AsyncQueryRunner(client, max_in_flight=4, coalesce=True)
+        statements = [(i, runner.cache.get('class_term_info', ['FBbt_%08d' % (i % 2)])) for i in range(200)]
+        out = runner.run(statements)
+        self.assertEqual(len(out), 200)
+        self.assertEqual(out[7][0]['term']['core']['short_form'], 'FBbt_00000001')
+        self.assertEqual(len(client.requests), 2)
+        self.assertEqual(runner.flight.coalesced, 198)
+
+    def test_asyncio_exception_and_cancel(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise ValueError('boom')
+
+        async def main():
+            waiters = [asyncio.ensure_future(flight.do('k', fail)) for _ in range(10)]
+            await asyncio.sleep(0)
+            waiters[0].cancel()  # Does not cancel the shared call.
+            return await asyncio.gather(*waiters, return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(results[0], asyncio.CancelledError)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+from vfb_query_builder.stream_validate import iter_neo4j_rows, iter_jsonl, validate_file
+from .schema_test_suite_tests import SCHEMA_DIR, term_info
+
+
+def neo4j_response(rows):
+    columns = list(rows[0].keys())
+    return {'results': [{'columns': columns,
+                         'data': [{'row': [r[c] for c in columns], 'meta': [None] * len(columns)}
+                                  for r in rows]}],
+            'errors': []}
+
+
+class CountingReader(io.StringIO):
+    """Counts read() calls."""
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+class StreamValidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = os.path.join(SCHEMA_DIR, 'vfb_termInfo.json')
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def write(self, name, rows, n=1):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as f:
+            if name.endswith('.jsonl'):
+                for _ in range(n):
+                    for r in rows:
+                        f.write(json.dumps(r) + '\n')
+            else:
+                # Write n copies of the rows without building the full response.
+                columns = list(rows[0].keys())
+                f.write('{"results": [{"columns": %s, "data": [' % json.dumps(columns))
+                f.write(', '.join(json.dumps({'row': [r[c] for c in columns]}) for r in rows * n))
+                f.write(']}], "errors": []}')
+        return path
+
+    def test_iter_neo4j_rows(self):
+        rows = [{'a': i, 'b': {'c': [i, 'x' * i]}} for i in range(100)]
+        text = json.dumps(neo4j_response(rows))
+        # Small chunks exercise reads splitting tokens.
+        for chunk_size in (1, 7, 1 << 16):
+            self.assertEqual(list(iter_neo4j_rows(io.StringIO(text), chunk_size=chunk_size)), rows)
+
+    def test_large_row(self):
+        rows = [{'a': 'x' * (1 << 23)}]
+        f = CountingReader(json.dumps(neo4j_response(rows)))
+        self.assertEqual(list(iter_neo4j_rows(f)), rows)
+        # Reads grow geometrically rather than one chunk (and one decode) at a time.
+        self.assertLess(f.reads, 20)
+
+    def test_malformed_row(self):
+        text = '{"results": [{"columns": ["a"], "data": [{"row": [1, x]}' + ' ' * (1 << 22)
+        for chunk_size in (1, 7, 1 << 16):
+            f = CountingReader(text)
+            self.assertRaises(ValueError, list, iter_neo4j_rows(f, chunk_size=chunk_size))
+            # Reported without buffering the rest of the input.
+            self.assertLess(f.tell(), 1 << 18)
+
+    def test_neo4j_errors(self):
+        text = json.dumps({'results': [], 'errors': [{'code': 'x', 'message': 'boom'}]})
+        self.assertRaises(ValueError, list, iter_neo4j_rows(io.StringIO(text)))
+
+    def test_jsonl(self):
+        self.assertEqual(list(iter_jsonl(io.StringIO('{"a": 1}\n\n{"a": 2}\n'))), [{'a': 1}, {'a': 2}])
+
+    def test_validate_file(self):
+        bad = term_info('FBbt_00000002')
+        del bad['term']['core']['iri']
+        rows = [term_info(), bad, term_info()]
+        for name in ('results.json', 'results.jsonl'):
+            r = validate_file(self.schema, self.write(name, rows, n=5), max_errors=3)
+            self.assertEqual((r.total, r.passed, r.failed), (15, 10, 5))
+            self.assertFalse(r)
+            self.assertEqual(len(r.errors), 3)
+            self.assertEqual(r.errors[0]['row'], 1)
+            self.assertEqual(r.errors[0]['instance_path'], 'term/core')
+            self.assertEqual(r.errors[0]['validator'], 'required')
+
+    def test_flat_memory(self):
+        rows = [term_info(n_images=2)]
+        peaks = []
+        for n in (200, 2000):
+            path = self.write('results.json', rows, n=n)
+            tracemalloc.start()
+            r = validate_file(self.schema, path)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            self.assertEqual(r.passed, n)
+        self.assertLess(peaks[1], peaks[0] * 2)
+        self.assertLess(peaks[1], os.path.getsize(path) / 10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import unittest
+from vfb_query_builder.term_store import TermStoreBuilder, TermInfoStore, shard_of
+from .schema_test_suite_tests import term_info
+
+
+class TermInfoStubClient:
+    """Returns a valid TermInfo row per requested short_form, except
+    'invalid_*' (invalid rows) and 'missing_*' (no row).
+    Records the short_forms requested."""
+
+    def __init__(self, fail_after=None):
+        self.requested = []
+        self.fail_after = fail_after
+
+    def commit(self, statements):
+        results = []
+        for statement, parameters in statements:
+            if self.fail_after is not None and len(self.requested) >= self.fail_after:
+                raise IOError('Connection lost')
+            self.requested.extend(parameters['short_forms'])
+            rows = []
+            for sf in parameters['short_forms']:
+                if sf.startswith('missing'):
+                    continue
+                t = term_info(sf)
+                if sf.startswith('invalid'):
+                    del t['term']['core']['iri']
+                rows.append({'row': [t[k] for k in sorted(t)]})
+            results.append({'columns': sorted(term_info()), 'data': rows})
+        return results
+
+
+class TermStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.terms = {'Class': ['FBbt_%08d' % i for i in range(100)] + ['invalid_1', 'missing_1'],
+                      'Individual': ['VFB_%08d' % i for i in range(50)]}
+
+    def test_build_and_get(self):
+        client = TermInfoStubClient()
+        summary = TermStoreBuilder(client, self.dir, n_shards=8).build(self.terms)
+        self.assertEqual(summary['built'], 8)
+        self.assertEqual(summary['written'], 150)
+        self.assertEqual((summary['invalid'], summary['missing']), (['invalid_1'], ['missing_1']))
+        store = TermInfoStore(self.dir)
+        self.assertEqual(len(store), 150)
+        self.assertEqual(store.get('FBbt_00000042'), term_info('FBbt_00000042'))
+        self.assertEqual(json.loads(store.get_raw('VFB_00000049'))['term']['core']['short_form'], 'VFB_00000049')
+        for sf in ('invalid_1', 'missing_1', 'FBbt_0000004', 'FBbt_000000421', '', 'zzz'):
+            self.assertIsNone(store.get(sf))
+        store.close()
+
+    def test_incremental(self):
+        TermStoreBuilder(TermInfoStubClient(), self.dir, n_shards=8).build(self.terms)
+        # Unchanged: nothing rebuilt.
+        client = TermInfoStubClient()
+        summary = TermStoreBuilder(client, self.dir, n_shards=8).build(self.terms)
+        self.assertEqual((summary['built'], summary['skipped']), (0, 8))
+        self.assertEqual(client.requested, [])
+        # A new data version with a new term and one changed term rebuilds only their shards.
+        self.terms['Class'].append('FBbt_99999999')
+        summary = TermStoreBuilder(client, self.dir, n_shards=8, data_version='2').build(
+            self.terms, changed=['VFB_00000001'])
+        shards = {shard_of('FBbt_99999999', 8), shard_of('VFB_00000001', 8)}
+        self.assertEqual(summary['built'], len(shards))
+        self.assertEqual({shard_of(sf, 8) for sf in client.requested}, shards)
+        store = TermInfoStore(self.dir)
+        self.assertEqual(len(store), 151)
+        self.assertEqual(store.get('FBbt_99999999'), term_info('FBbt_99999999'))
+        store.close()
+        # Repeated: every shard is up to date for data version 2.
+        summary = TermStoreBuilder(client, self.dir, n_shards=8, data_version='2').build(
+            self.terms, changed=['VFB_00000001'])
+        self.assertEqual(summary['built'], 0)
+        summary = TermStoreBuilder(client, self.dir, n_shards=8, data_version='2').build(self.terms)
+        self.assertEqual(summary['built'], 0)
+        # A new data version without changes listed rebuilds everything.
+        summary = TermStoreBuilder(client, self.dir, n_shards=8, data_version='3').build(self.terms)
+        self.assertEqual(summary['built'], 8)
+
+    def test_resume(self):
+        builder = TermStoreBuilder(TermInfoStubClient(fail_after=60), self.dir, n_shards=8)
+        self.assertRaises(IOError, builder.build, self.terms)
+        with open(os.path.join(self.dir, 'manifest.json')) as f:
+            done = len(json.load(f)['shards'])
+        self.assertTrue(0 < done < 8)
+        summary = TermStoreBuilder(TermInfoStubClient(), self.dir, n_shards=8).build(self.terms)
+        self.assertEqual((summary['built'], summary['skipped']), (8 - done, done))
+        store = TermInfoStore(self.dir)
+        self.assertEqual(len(store), 150)
+        store.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)